@@ -4,8 +4,9 @@ from django.conf.urls import url
 from django.contrib import admin
 from django.template.response import TemplateResponse
 from django.shortcuts import get_object_or_404
-from .models import Device, Notification, APNService, FeedbackService
+from .models import Device, Notification, APNService, FeedbackService, PushJob
 from .forms import APNServiceForm
+from .settings import get_setting
 
 
 class APNServiceAdmin(admin.ModelAdmin):
@@ -41,12 +42,23 @@ class NotificationAdmin(admin.ModelAdmin):
         if request.method == 'POST':
             service = notification.service
             num_devices = service.device_set.filter(is_active=True).count()
-            notification.service.push_notification_to_devices(notification)
+            if get_setting('IOS_NOTIFICATIONS_QUEUE_PUSHES'):
+                service.enqueue_notification(notification)
+            else:
+                service.push_notification_to_devices(notification)
         request.current_app = 'ios_notifications'
         return TemplateResponse(request, 'admin/ios_notifications/notification/push_notification.html',
                                 {'notification': notification, 'num_devices': num_devices, 'sent': request.method == 'POST'})
 
+class PushJobAdmin(admin.ModelAdmin):
+    exclude = ('devices',)
+    list_display = ('notification', 'status', 'created_at', 'started_at', 'finished_at', 'sent', 'failed')
+    list_filter = ('status', 'created_at')
+    readonly_fields = ('started_at', 'finished_at', 'sent', 'failed', 'error', 'last_device_pk', 'checkpointed_at', 'retry_at')
+
+
 admin.site.register(Device, DeviceAdmin)
 admin.site.register(Notification, NotificationAdmin)
 admin.site.register(APNService, APNServiceAdmin)
 admin.site.register(FeedbackService)
+admin.site.register(PushJob, PushJobAdmin)
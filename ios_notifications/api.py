@@ -1,20 +1,61 @@
 # -*- coding: utf-8 -*-
 import re
+import json
 
 import django
 from django.http import HttpResponseNotAllowed, QueryDict
 from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import get_object_or_404
-from django.db import IntegrityError
+from django.db import IntegrityError, connection, transaction
 from django.contrib.auth.models import User
 from django.utils.decorators import method_decorator
 
-from .models import Device
+try:
+    from django.utils.timezone import now as dt_now
+except ImportError:
+    import datetime
+    dt_now = datetime.datetime.now
+
+from .models import APNService, Device, Notification, TOKEN_RE
+from .settings import get_setting
 from .forms import DeviceForm
 from .decorators import api_authentication_required
 from .http import HttpResponseNotImplemented, JSONResponse
 
 
+def clean_token(token):
+    """
+    Strips out any special characters that may be in the token, such as the
+    angle brackets and spaces of an NSData description.
+    """
+    return re.sub('<|>|\s', '', token)
+
+
+def clean_device(item):
+    """
+    Returns the device described by `item`, a token or a dict of a token and device metadata,
+    as a dict along with a dict of any errors which make it invalid.
+    """
+    if not isinstance(item, dict):
+        item = {'token': item}
+    device, errors = {}, {}
+    token = item.get('token')
+    if isinstance(token, basestring):
+        token = clean_token(token)
+    if not isinstance(token, basestring) or not TOKEN_RE.match(token):
+        errors['token'] = ['Invalid device token']
+    device['token'] = token
+    for key in Device.objects.METADATA:
+        if item.get(key) is None:
+            continue
+        value = item[key]
+        max_length = Device._meta.get_field(key).max_length
+        if not isinstance(value, basestring) or len(value) > max_length:
+            errors[key] = ['Expected a string of at most %d characters' % max_length]
+        device[key] = value
+    return device, errors
+
+
 class BaseResource(object):
     """
     The base class for any API Resources.
@@ -43,6 +84,8 @@ class DeviceResource(BaseResource):
     Allowed HTTP methods are GET, POST and PUT.
     """
     allowed_methods = ('GET', 'POST', 'PUT')
+    # The POST parameters of a device which can be created without a DeviceForm.
+    fast_path_fields = set(('token', 'service') + Device.objects.METADATA)
 
     def get(self, request, **kwargs):
         """
@@ -59,19 +102,26 @@ class DeviceResource(BaseResource):
         """
         Creates a new device or updates an existing one to `is_active=True`.
         Expects two non-options POST parameters: `token` and `service`.
+
+        An existing device is reactivated with a single update of the changed columns.
+        A new device with only a token, service and metadata is inserted straight away;
+        anything else, and any invalid device, is validated with a DeviceForm.
         """
         token = request.POST.get('token')
         if token is not None:
-            # Strip out any special characters that may be in the token
-            token = re.sub('<|>|\s', '', token)
-        devices = Device.objects.filter(token=token,
-                                        service__id=int(request.POST.get('service', 0)))
-        if devices.exists():
-            device = devices.get()
-            device.is_active = True
-            device.save()
-            return JSONResponse(device)
-        form = DeviceForm(request.POST)
+            token = clean_token(token)
+        service_id = int(request.POST.get('service', 0))
+        devices = Device.objects.filter(token=token, service__id=service_id)
+        if devices.update(is_active=True, registered_at=dt_now()):
+            return JSONResponse(devices.get())
+        data = request.POST.copy()
+        if token is not None:
+            data['token'] = token
+        if set(data) <= self.fast_path_fields:
+            device, created = self.create(service_id, data)
+            if device is not None:
+                return JSONResponse(device, status=201 if created else 200)
+        form = DeviceForm(data)
         if form.is_valid():
             device = form.save(commit=False)
             device.is_active = True
@@ -79,6 +129,30 @@ class DeviceResource(BaseResource):
             return JSONResponse(device, status=201)
         return JSONResponse(form.errors, status=400)
 
+    def create(self, service_id, data):
+        """
+        Inserts a new device of the service and returns a (device, created) pair, where created
+        is False if the device was registered concurrently and has been reactivated instead.
+        The device is None if it is not valid, leaving the errors to be reported by a DeviceForm.
+        """
+        device, errors = clean_device(data)
+        if errors:
+            return None, False
+        # Without foreign key constraints the service has to be checked beforehand.
+        # Django 1.6 does not say whether the database has them.
+        supports_foreign_keys = getattr(connection.features, 'supports_foreign_keys', False)
+        if not supports_foreign_keys and not APNService.objects.filter(pk=service_id).exists():
+            return None, False
+        try:
+            with transaction.atomic():
+                device = Device.objects.create(service_id=service_id, is_active=True, **device)
+        except IntegrityError:
+            devices = Device.objects.filter(token=device['token'], service__id=service_id)
+            if not devices.update(is_active=True, registered_at=dt_now()):
+                return None, False  # The service does not exist.
+            return devices.get(), False
+        return device, True
+
     def put(self, request, **kwargs):
         """
         Updates an existing device.
@@ -113,11 +187,117 @@ class DeviceResource(BaseResource):
         return JSONResponse(device)
 
 
+class DeviceBulkResource(BaseResource):
+    """
+    The API resource for registering many ios_notifications.models.Device at once.
+
+    Allowed HTTP methods are POST.
+    """
+    allowed_methods = ('POST',)
+
+    def post(self, request, **kwargs):
+        """
+        Creates or reactivates each of the devices in the JSON request body, which should be
+        an object with the id of the `service` and a list of `devices`. Each device is either a token
+        or an object with a `token` and optionally its `platform`, `display` and `os_version`.
+
+        Returns the result for each device, in the order given: its token, its `status`
+        ("created", "updated" or "invalid") and either its `pk` or the `errors` that made it invalid.
+        """
+        try:
+            data = json.loads(request.body)
+            service_id = int(data['service'])
+            items = data['devices']
+            if not isinstance(items, list):
+                raise TypeError
+        except (ValueError, KeyError, TypeError):
+            return JSONResponse({'error': 'Expected a JSON object with a service id and a list of devices'}, status=400)
+        try:
+            service = APNService.objects.get(pk=service_id)
+        except APNService.DoesNotExist:
+            return JSONResponse({'error': 'APNService with id %d does not exist' % service_id}, status=400)
+
+        devices, results = [], []
+        for item in items:
+            device, errors = clean_device(item)
+            if errors:
+                results.append({'token': device.get('token'), 'status': 'invalid', 'errors': errors})
+            else:
+                devices.append(device)
+                results.append({'token': device['token']})
+        registered = Device.objects.bulk_register(service, devices)
+        for result in results:
+            if 'status' not in result:
+                result['pk'], created = registered[result['token']]
+                result['status'] = 'created' if created else 'updated'
+        return JSONResponse(results)
+
+
+class UserNotificationResource(BaseResource):
+    """
+    The API resource for pushing a notification to the devices of a list of users.
+
+    Allowed HTTP methods are POST.
+    """
+    allowed_methods = ('POST',)
+
+    def post(self, request, **kwargs):
+        """
+        Pushes a notification to the active devices of the users. Expects a JSON request body with
+        the id of the `service`, a list of `users` ids and the notification's `message`, `badge`,
+        `sound` and `extra` payload, of which either `message` or `extra` is required.
+
+        Returns the number of devices the notification was `sent` to and `failed` to be sent to.
+        If IOS_NOTIFICATIONS_QUEUE_PUSHES is set the notification is queued instead and the
+        id of its push `job` is returned with a status code of 202.
+        """
+        try:
+            data = json.loads(request.body)
+            service_id = int(data['service'])
+            if not isinstance(data['users'], list):
+                raise TypeError
+            user_ids = [int(pk) for pk in data['users']]
+            badge = data.get('badge')
+            if badge is not None:
+                badge = int(badge)
+            extra = data.get('extra')
+            if extra is not None and not isinstance(extra, dict):
+                raise TypeError
+        except (ValueError, KeyError, TypeError):
+            return JSONResponse({'error': 'Expected a JSON object with a service id, a list of user ids '
+                                          'and the notification'}, status=400)
+        try:
+            service = APNService.objects.get(pk=service_id)
+        except APNService.DoesNotExist:
+            return JSONResponse({'error': 'APNService with id %d does not exist' % service_id}, status=400)
+        if not data.get('message') and not extra:
+            return JSONResponse({'error': 'Either a message or extra is required'}, status=400)
+
+        notification = Notification(service=service, message=data.get('message') or '', badge=badge,
+                                    sound=data.get('sound') or '')
+        if extra is not None:
+            notification.extra = extra
+        if not notification.is_valid_length():
+            return JSONResponse({'error': 'Notification exceeds the maximum payload length'}, status=400)
+
+        if get_setting('IOS_NOTIFICATIONS_QUEUE_PUSHES'):
+            devices = service._user_devices(user_ids)
+            if not devices:
+                # There is nothing to queue.
+                return JSONResponse({'sent': 0, 'failed': 0})
+            job = service.enqueue_notification(notification, devices)
+            return JSONResponse({'job': job.pk}, status=202)
+        result = service.push_notification_to_users(notification, user_ids)
+        return JSONResponse({'sent': result.sent, 'failed': result.failed})
+
+
 class Router(object):
     """
     A simple class for handling URL routes.
     """
     def __init__(self):
         self.device = DeviceResource().route
+        self.devices = DeviceBulkResource().route
+        self.user_notification = UserNotificationResource().route
 
 routes = Router()
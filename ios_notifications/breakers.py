@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import random
+import socket
+import threading
+import time
+
+import OpenSSL
+
+from .exceptions import ServiceUnavailable
+from .settings import get_setting
+
+MAX_DELAY = 30  # The longest wait between connection attempts, in seconds.
+
+# Errors worth trying to connect again after: failed DNS lookups, refused or reset connections and failed handshakes.
+TRANSIENT_ERRORS = (socket.error, OpenSSL.SSL.Error)
+
+
+def retry_with_backoff(func, retries, base_delay, errors=TRANSIENT_ERRORS):
+    """
+    Calls `func` and returns its result, calling it again up to `retries` times if it raises one of `errors`.
+
+    Before each retry it waits a random time between zero and `base_delay` seconds doubled for every
+    failed attempt so far (at most MAX_DELAY). The jitter spreads out the retries of the many workers
+    which lose their connections at the same moment.
+    """
+    for attempt in xrange(retries + 1):
+        try:
+            return func()
+        except errors:
+            if attempt == retries:
+                raise
+            time.sleep(random.uniform(0, min(MAX_DELAY, base_delay * 2 ** attempt)))
+
+
+class CircuitBreaker(object):
+    """
+    Stops connecting to a service which keeps failing.
+
+    After `threshold` failures in a row the breaker opens and every call fails fast with
+    ServiceUnavailable for `timeout` seconds. The first call after that is let through as a
+    probe while the others keep failing fast. The breaker closes again if the probe succeeds
+    and opens for another `timeout` seconds if it fails.
+    """
+    def __init__(self, threshold, timeout):
+        self.threshold = threshold
+        self.timeout = timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def retry_after(self):
+        """
+        Returns the number of seconds until the breaker lets a probe through.
+        """
+        if self.opened_at is None:
+            return 0
+        return max(0, self.opened_at + self.timeout - time.time())
+
+    def _before(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.probing or self.retry_after() > 0:
+                raise ServiceUnavailable(retry_after=self.retry_after() or self.timeout)
+            self.probing = True
+
+    def _succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def _failed(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = time.time()
+            self.probing = False
+
+    def call(self, func):
+        """
+        Returns the result of calling `func`, or raises ServiceUnavailable without calling it while open.
+        """
+        self._before()
+        try:
+            result = func()
+        except Exception:
+            self._failed()
+            raise
+        self._succeeded()
+        return result
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(key):
+    """
+    Returns the circuit breaker for `key`, creating it if it does not exist yet.
+    Each process has its own breakers.
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(get_setting('IOS_NOTIFICATIONS_CIRCUIT_BREAKER_THRESHOLD'),
+                                                      get_setting('IOS_NOTIFICATIONS_CIRCUIT_BREAKER_TIMEOUT'))
+        return breaker
+
+
+def clear_breaker(key):
+    with _breakers_lock:
+        _breakers.pop(key, None)
+
+
+def connect(key, open_connection):
+    """
+    Opens a connection with `open_connection`, retrying transient failures with jittered
+    exponential backoff, through the circuit breaker for `key`. A connect only counts as a
+    failure for the breaker once its retries are exhausted.
+    """
+    retries = get_setting('IOS_NOTIFICATIONS_CONNECT_RETRIES')
+    base_delay = get_setting('IOS_NOTIFICATIONS_CONNECT_BACKOFF')
+    return get_breaker(key).call(lambda: retry_with_backoff(open_connection, retries, base_delay))
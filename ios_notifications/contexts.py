@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+
+import OpenSSL
+
+from .exceptions import InvalidPassPhrase
+
+
+def fingerprint(certificate, private_key):
+    """
+    Returns a digest identifying a certificate and private key pair
+    without having to parse either of them.
+    """
+    digest = hashlib.sha1()
+    for value in (certificate, private_key):
+        if isinstance(value, unicode):
+            value = value.encode('utf8')
+        digest.update(value or '')
+    return digest.hexdigest()
+
+
+def create_context(certificate, private_key, passphrase=None):
+    """
+    Parses the certificate and private key and builds an SSL context using them.
+    """
+    # ssl in Python < 3.2 does not support certificates/keys as strings.
+    # See http://bugs.python.org/issue3823
+    # Therefore pyOpenSSL which lets us do this is a dependancy.
+    cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, certificate)
+    args = [OpenSSL.crypto.FILETYPE_PEM, private_key]
+    if passphrase is not None:
+        args.append(str(passphrase))
+    try:
+        pkey = OpenSSL.crypto.load_privatekey(*args)
+    except OpenSSL.crypto.Error:
+        raise InvalidPassPhrase
+    context = OpenSSL.SSL.Context(OpenSSL.SSL.TLSv1_METHOD)
+    context.use_certificate(cert)
+    context.use_privatekey(pkey)
+    return context
+
+
+_contexts = {}  # Maps a key to a (fingerprint, context) pair.
+_contexts_lock = threading.Lock()
+
+
+def get_context(key, certificate, private_key, passphrase=None):
+    """
+    Returns the cached SSL context for `key`.
+
+    The context is rebuilt if the certificate or private key no longer match
+    the ones the cached context was built with.
+    """
+    certificate_fingerprint = fingerprint(certificate, private_key)
+    with _contexts_lock:
+        cached = _contexts.get(key)
+    if cached is not None and cached[0] == certificate_fingerprint:
+        return cached[1]
+    context = create_context(certificate, private_key, passphrase)
+    with _contexts_lock:
+        _contexts[key] = (certificate_fingerprint, context)
+    return context
+
+
+def clear_context(key):
+    """
+    Forgets the cached SSL context for `key`.
+    """
+    with _contexts_lock:
+        _contexts.pop(key, None)
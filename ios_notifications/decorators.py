@@ -1,6 +1,9 @@
 import binascii
+import threading
+import time
 
-from django.contrib.auth import authenticate
+from django.contrib.auth import authenticate, get_user_model
+from django.utils.crypto import constant_time_compare, salted_hmac
 
 from .settings import get_setting
 from .http import JSONResponse
@@ -13,6 +16,60 @@ class InvalidAuthenticationType(Exception):
 # TODO: OAuth
 VALID_AUTH_TYPES = ('AuthBasic', 'AuthBasicIsStaff', 'AuthNone')
 
+_verified = {}  # Maps a keyed hash of an Authorization header to a (user pk, user fingerprint, expiry time) tuple.
+_verified_lock = threading.Lock()
+MAX_VERIFIED = 1000  # Expired entries are purged once this many headers are remembered.
+
+
+def _user_fingerprint(user):
+    """
+    Returns a digest which changes whenever the user's password, is_staff or is_active does.
+    """
+    return salted_hmac('ios_notifications.decorators.user',
+                       '%s:%s:%s' % (user.password, user.is_staff, user.is_active)).hexdigest()
+
+
+def authenticate_header(header, username, password):
+    """
+    Returns the user the credentials of the Authorization header `header` belong to, or None.
+
+    The password is only checked the first time the header is seen. For
+    IOS_NOTIFICATIONS_AUTHENTICATION_CACHE_TIMEOUT seconds afterwards the user is
+    looked up by pk instead, which is a lot cheaper than hashing the password again.
+    Headers are remembered by their HMAC keyed with SECRET_KEY rather than in the clear.
+    """
+    timeout = get_setting('IOS_NOTIFICATIONS_AUTHENTICATION_CACHE_TIMEOUT')
+    if not timeout:
+        return authenticate(username=username, password=password)
+    key = salted_hmac('ios_notifications.decorators.header', header).hexdigest()
+    now = time.time()
+    with _verified_lock:
+        cached = _verified.get(key)
+    if cached is not None and cached[2] > now:
+        user = get_user_model()._default_manager.filter(pk=cached[0]).first()
+        if user is not None and constant_time_compare(_user_fingerprint(user), cached[1]):
+            return user
+    user = authenticate(username=username, password=password)
+    with _verified_lock:
+        if user is None:
+            _verified.pop(key, None)
+            return None
+        if len(_verified) >= MAX_VERIFIED:
+            for expired in [k for k, v in _verified.iteritems() if v[2] <= now]:
+                del _verified[expired]
+            if len(_verified) >= MAX_VERIFIED:
+                _verified.clear()
+        _verified[key] = (user.pk, _user_fingerprint(user), now + timeout)
+    return user
+
+
+def clear_verified():
+    """
+    Forgets every verified Authorization header.
+    """
+    with _verified_lock:
+        _verified.clear()
+
 
 def api_authentication_required(func):
     """
@@ -38,7 +95,7 @@ def api_authentication_required(func):
                     username, password = userpass.split(':')
                 except ValueError:
                     return JSONResponse({'error': 'malformed Authorization header'}, status=401)
-                user = authenticate(username=username, password=password)
+                user = authenticate_header(request.META['HTTP_AUTHORIZATION'], username, password)
                 if user is not None:
                     if AUTH_TYPE == 'AuthBasic' or user.is_staff:
                         return func(request, *args, **kwargs)
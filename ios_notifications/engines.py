@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import collections
+import copy
+import Queue
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+
+try:
+    import gevent
+    import gevent.queue
+    GEVENT = True
+except ImportError:
+    GEVENT = False
+
+ENGINES = ('blocking', 'pipelined', 'gevent')
+
+
+def send_with_gevent(service, frames, devices, chunk_size, concurrency, checkpoint=None, record=None):
+    """
+    Sends the frames to the devices over `concurrency` connections at once,
+    each written to from its own greenlet.
+
+    Chunks of devices are handed to the greenlets through a queue holding at most
+    `concurrency` chunks. A greenlet only takes the next chunk once the previous one
+    has been written, and writes wait cooperatively while a connection's send buffer
+    is full, so fetching devices slows down to the rate the connections drain at.
+
+    Chunks finish out of order, so `checkpoint` is only called once every chunk
+    before (and including) a chunk has been written, with the PushResult of those chunks.
+    Once it returns False no more chunks are taken, but the chunks being written are still
+    checkpointed as they finish. With a `checkpoint` the PushResult of the checkpointed
+    chunks is returned, so it matches where the push resumes from.
+    The pks of the devices written to are passed to `record`.
+    """
+    from .models import PushResult, GEVENT_OPEN_SSL
+    # Without gevent_openssl connections use blocking sockets and the greenlets write one after another.
+    if not GEVENT or not GEVENT_OPEN_SSL:
+        raise ImproperlyConfigured('The gevent engine requires gevent and gevent_openssl to be installed.')
+
+    chunks = gevent.queue.Queue(maxsize=concurrency)
+    result = PushResult()
+    checkpointed = PushResult()  # The result of the chunks checkpointed so far.
+    pending = collections.deque()  # The last pks of the chunks fetched but not checkpointed, in order.
+    written = {}  # Maps the last pk of each chunk written but not checkpointed to its PushResult.
+    stopped = []
+
+    def write():
+        # Every greenlet needs its own connection and frame buffer.
+        sender = copy.copy(service)
+        sender.connection = None
+        sender_frames = frames.copy()
+        for chunk in chunks:
+            if stopped:
+                continue
+            last_pk = chunk[-1][0]
+            chunk_result = PushResult()
+            while chunk:
+                chunk = sender._write_chunk(chunk, sender_frames, chunk_result, record)
+            result.sent += chunk_result.sent
+            result.failed += chunk_result.failed
+            if checkpoint is None:
+                continue
+            written[last_pk] = chunk_result
+            # Chunks are taken in the order they were fetched, so after stopping
+            # every chunk still pending is one being written and is checkpointed too.
+            while pending and pending[0] in written:
+                checkpointed.sent += written[pending[0]].sent
+                checkpointed.failed += written.pop(pending[0]).failed
+                if checkpoint(pending.popleft(), checkpointed) is False:
+                    stopped.append(True)
+
+    def fetch():
+        try:
+            for chunk in service._device_batches(devices, chunk_size):
+                if stopped:
+                    break
+                if chunk:
+                    pending.append(chunk[-1][0])
+                    chunks.put(chunk)
+        finally:
+            for i in xrange(concurrency):
+                chunks.put(StopIteration)
+
+    greenlets = [gevent.spawn(write) for i in xrange(concurrency)]
+    greenlets.append(gevent.spawn(fetch))
+    try:
+        gevent.joinall(greenlets, raise_error=True)
+    finally:
+        gevent.killall(greenlets)
+    return result if checkpoint is None else checkpointed
+
+
+def _put(queue, item, stop):
+    """
+    Puts an item on a bounded queue, giving up once `stop` is set.
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Queue.Full:
+            pass
+    return False
+
+
+def send_pipelined(service, frames, devices, chunk_size, depth=2, checkpoint=None, record=None):
+    """
+    Sends the frames to the devices while fetching and bookkeeping run in their own threads.
+
+    A fetcher thread queries the next chunks of devices while the current chunk is written,
+    and a recorder thread passes the pks of the devices already written to `record` (which
+    defaults to updating their last_notified_at), so the
+    connection does not sit idle during database round trips. Frames are packed by the
+    writing thread itself, as packing a frame only fills in its token. The queues between
+    the stages hold at most `depth` chunks. If either thread fails the others stop and
+    its exception is raised.
+    """
+    from .models import PushResult
+
+    if record is None:
+        record = service._set_last_notified_at
+    fetched = Queue.Queue(maxsize=depth)
+    written = Queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    errors = []
+    result = PushResult()
+
+    def fetch():
+        try:
+            for chunk in service._device_batches(devices, chunk_size):
+                if not _put(fetched, chunk, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(fetched, None, stop)
+            connection.close()
+
+    def recorder():
+        try:
+            while True:
+                try:
+                    pks = written.get(timeout=0.1)
+                except Queue.Empty:
+                    if stop.is_set():
+                        return
+                    continue
+                record(pks)
+        except Exception as e:
+            # Stop the other threads rather than leave the writer waiting for room in `written`.
+            errors.append(e)
+            stop.set()
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=fetch), threading.Thread(target=recorder)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while not stop.is_set():
+            try:
+                chunk = fetched.get(timeout=0.1)
+            except Queue.Empty:
+                continue
+            if chunk is None:
+                break
+            if not chunk:
+                continue
+            last_pk = chunk[-1][0]
+            while chunk and not stop.is_set():
+                chunk = service._write_chunk(chunk, frames, result, lambda pks: _put(written, pks, stop))
+            if stop.is_set() or checkpoint is not None and checkpoint(last_pk, result) is False:
+                break
+    finally:
+        # The recorder finishes the chunks already written before it stops.
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return result
@@ -11,3 +11,9 @@ class NotConnectedException(Exception):
 class InvalidPassPhrase(Exception):
     def __init__(self, message='The passphrase for the private key appears to be invalid'):
         super(InvalidPassPhrase, self).__init__(message)
+
+
+class ServiceUnavailable(Exception):
+    def __init__(self, message='Connecting to the service has failed repeatedly, try again later', retry_after=None):
+        super(ServiceUnavailable, self).__init__(message)
+        self.retry_after = retry_after  # Seconds until connecting is tried again.
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from django.conf import settings
+from django.utils.timezone import utc
+import OpenSSL
+
+
+def feedback_time(timestamp):
+    """
+    Converts the timestamp of a feedback tuple, in seconds since the epoch, to a datetime
+    comparable with the ones Django stores.
+    """
+    if getattr(settings, 'USE_TZ', False):
+        return datetime.datetime.utcfromtimestamp(timestamp).replace(tzinfo=utc)
+    return datetime.datetime.fromtimestamp(timestamp)
+
+
+def iter_unpack(record, data):
+    """
+    Yields the values of each complete record in `data`, where `record` is a struct.Struct.
+    Like Python 3's struct.iter_unpack, but any trailing partial record is ignored.
+    """
+    view = memoryview(data)
+    for offset in xrange(0, len(data) // record.size * record.size, record.size):
+        yield record.unpack_from(view, offset)
+
+
+def read_records(connection, record, read_size=16384):
+    """
+    Reads from `connection` until it is closed and yields the values of each record received.
+
+    Records are read up to `read_size` bytes at a time rather than one at a time. Complete records
+    are decoded straight from the read buffer and a partial record at the end of a read is kept
+    until the rest of it arrives.
+    """
+    pending = bytearray()
+    while True:
+        try:
+            data = connection.recv(read_size)
+        except OpenSSL.SSL.ZeroReturnError:
+            # Nothing more to receive.
+            return
+        if not data:
+            return
+        pending.extend(data)
+        for values in iter_unpack(record, pending):
+            yield values
+        del pending[:len(pending) // record.size * record.size]
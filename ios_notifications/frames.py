@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import collections
+import copy
+import struct
+
+from .exceptions import NotificationPayloadSizeExceeded
+
+TOKEN = struct.Struct('32s')
+IDENTIFIER = struct.Struct('!I')
+
+
+class FrameBuilder(object):
+    """
+    Packs frames which only differ by device token (and identifier) into a preallocated buffer.
+
+    `template` is a complete frame for the notification. The buffer is filled with copies of it
+    once, so adding a frame only writes the 32 byte token at `token_offset` and, for enhanced
+    frames, the identifier at `identifier_offset`. The payload is never copied again.
+    """
+    def __init__(self, template, token_offset, identifier_offset=None, buffer_size=16384):
+        self.frame_size = len(template)
+        self.token_offset = token_offset
+        self.identifier_offset = identifier_offset
+        self.capacity = max(1, buffer_size // self.frame_size)
+        self.buffer = bytearray(template * self.capacity)
+        self.count = 0
+        self.origin = self  # Shared by copies, identifying the push the frames belong to.
+
+    @property
+    def enhanced(self):
+        return self.identifier_offset is not None
+
+    def prepare(self, chunk):
+        """
+        Called with each chunk of (pk, binary token) pairs before its frames are added.
+        Returns the pks of the devices which can not be sent to; every frame can be here.
+        """
+        return []
+
+    def add(self, token, identifier=0, pk=None):
+        """
+        Adds a frame to the buffer. Returns True once the buffer is full.
+        """
+        offset = self.count * self.frame_size
+        TOKEN.pack_into(self.buffer, offset + self.token_offset, token)
+        if self.identifier_offset is not None:
+            IDENTIFIER.pack_into(self.buffer, offset + self.identifier_offset, identifier)
+        self.count += 1
+        return self.count == self.capacity
+
+    def view(self):
+        """
+        Returns a memoryview of the frames added since the buffer was last cleared.
+        """
+        return memoryview(self.buffer)[:self.count * self.frame_size]
+
+    def clear(self):
+        self.count = 0
+
+    def copy(self):
+        """
+        Returns an empty FrameBuilder for the same frames with its own buffer.
+        """
+        frames = copy.copy(self)
+        frames.buffer = bytearray(self.buffer)
+        frames.count = 0
+        return frames
+
+
+class TemplateFrameBuilder(object):
+    """
+    Packs frames whose payloads differ per device, rendered from a payloads.PayloadTemplate.
+    It is used in place of a FrameBuilder.
+
+    `values` is a dict mapping device pks to a dict of slot values, or a callable taking a
+    list of device pks and returning such a dict. It is consulted once per chunk by `prepare`.
+    `pack` is called with a payload, token and identifier and returns the frame.
+    """
+    def __init__(self, template, values, pack, enhanced=False, buffer_size=16384):
+        self.template = template
+        self.values = values
+        self.pack = pack
+        self.enhanced = enhanced
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.payloads = {}  # Maps the pks of the prepared chunk to their payloads.
+        self.origin = self
+
+    def prepare(self, chunk):
+        """
+        Renders the payload of each device in the chunk. Returns the pks of the
+        devices whose payload is too long, which should be left out of the chunk.
+        """
+        pks = [pk for pk, token in chunk]
+        values = self.values(pks) if callable(self.values) else self.values
+        self.payloads = {}
+        too_long = []
+        for pk in pks:
+            try:
+                self.payloads[pk] = self.template.render(values.get(pk) or {})
+            except NotificationPayloadSizeExceeded:
+                too_long.append(pk)
+        return too_long
+
+    def add(self, token, identifier=0, pk=None):
+        """
+        Adds the frame of the device `pk` of the prepared chunk.
+        Returns True once the buffer is full.
+        """
+        self.buffer.extend(self.pack(self.payloads[pk], token, identifier))
+        return len(self.buffer) >= self.buffer_size
+
+    def view(self):
+        return memoryview(self.buffer)
+
+    def clear(self):
+        self.buffer = bytearray()
+
+    def copy(self):
+        frames = copy.copy(self)
+        frames.buffer = bytearray()
+        frames.payloads = {}
+        return frames
+
+
+class SentFrames(object):
+    """
+    Remembers the devices of the enhanced frames most recently written to a connection,
+    so the frames Apple discards after a failed one can be sent again.
+
+    Frames are numbered per connection rather than per chunk. Connections stay open between
+    chunks and pushes, so Apple's error response is often only read after the chunk it is
+    about has been written, and its identifier must still name the right device.
+    """
+    def __init__(self, size):
+        self.entries = collections.deque(maxlen=size)  # (identifier, pk, token, frame builder) tuples.
+        self.next_identifier = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, pk, token, frames):
+        """
+        Remembers a frame about to be written and returns its identifier.
+        """
+        identifier = self.next_identifier
+        self.next_identifier = (identifier + 1) % 0x100000000
+        self.entries.append((identifier, pk, token, frames))
+        return identifier
+
+    def split(self, identifier):
+        """
+        Forgets every frame. Returns the entry of the frame with `identifier`, or None
+        if it is not remembered, and the entries of the frames written after it.
+        """
+        entries = list(self.entries)
+        self.entries.clear()
+        for i, entry in enumerate(entries):
+            if entry[0] == identifier:
+                return entry, entries[i + 1:]
+        return None, []
+
+
+class FrameConnection(object):
+    """
+    An SSL connection to an APN service along with the SentFrames written to it.
+    Any other attribute is looked up on the wrapped connection.
+    """
+    def __init__(self, connection, history=10000):
+        self.connection = connection
+        self.sent = SentFrames(history)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
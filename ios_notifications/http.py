@@ -1,8 +1,61 @@
 import json
 
 from django.db.models.query import QuerySet
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+
+# The fields of a device included in API responses, besides its service and users.
+DEVICE_FIELDS = ('token', 'is_active', 'deactivated_at', 'added_at', 'last_notified_at',
+                 'platform', 'display', 'os_version', 'registered_at')
+
+
+def device_user_ids(pks):
+    """
+    Returns a dict mapping the pk of each of the devices to the list of its users' pks,
+    read from the many to many table in a single query without loading the users.
+    """
+    from .models import Device
+    field = Device._meta.get_field('users')
+    user_ids = dict((pk, []) for pk in pks)
+    rows = Device.users.through.objects.filter(**{'%s__in' % field.m2m_field_name(): pks})
+    for device_id, user_id in rows.values_list(field.m2m_field_name(), field.m2m_reverse_field_name()):
+        user_ids[device_id].append(user_id)
+    return user_ids
+
+
+def device_to_dict(device, user_ids):
+    """
+    Returns the device in the structure Django's serializers use, with only the DEVICE_FIELDS.
+    """
+    fields = dict((name, getattr(device, name)) for name in DEVICE_FIELDS)
+    fields['service'] = device.service_id
+    fields['users'] = user_ids
+    return {'model': 'ios_notifications.device', 'pk': device.pk, 'fields': fields}
+
+
+def serialize_devices(devices, chunk_size=100):
+    """
+    Yields the devices in `devices`, a QuerySet, as a JSON list in chunks of `chunk_size` devices.
+    The users of each chunk's devices are read in one query and the rows are never all held in memory.
+    """
+    encoder = DjangoJSONEncoder()
+    yield '['
+    chunk = []
+    first = True
+    for device in devices.iterator():
+        chunk.append(device)
+        if len(chunk) == chunk_size:
+            yield ('' if first else ', ') + _encode_devices(encoder, chunk)
+            chunk, first = [], False
+    if chunk:
+        yield ('' if first else ', ') + _encode_devices(encoder, chunk)
+    yield ']'
+
+
+def _encode_devices(encoder, devices):
+    user_ids = device_user_ids([device.pk for device in devices])
+    return ', '.join(encoder.encode(device_to_dict(device, user_ids[device.pk])) for device in devices)
 
 
 class HttpResponseNotImplemented(HttpResponse):
@@ -19,12 +72,28 @@ class JSONResponse(HttpResponse):
         super(JSONResponse, self).__init__(content, content_type, status, mimetype)
 
     def serialize(self, obj):
+        from .models import Device
+        if isinstance(obj, Device):
+            return DjangoJSONEncoder().encode(device_to_dict(obj, device_user_ids([obj.pk])[obj.pk]))
+        elif isinstance(obj, QuerySet) and obj.model is Device:
+            return ''.join(serialize_devices(obj))
+
         json_s = serializers.get_serializer('json')()
         if isinstance(obj, QuerySet):
             return json_s.serialize(obj)
-        elif isinstance(obj, dict):
+        elif isinstance(obj, (dict, list)):
             return json.dumps(obj)
 
         serialized_list = json_s.serialize([obj])
         m = json.loads(serialized_list)[0]
         return json.dumps(m)
+
+
+class StreamingJSONResponse(StreamingHttpResponse):
+    """
+    A subclass of django.http.StreamingHttpResponse which serializes a QuerySet of devices
+    as it is sent, for responses too large to build in memory.
+    """
+    def __init__(self, devices, status=None, chunk_size=100):
+        super(StreamingJSONResponse, self).__init__(serialize_devices(devices, chunk_size), status=status,
+                                                    content_type='application/json')
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import base64
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from binascii import hexlify, unhexlify
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from django.utils.timezone import now as dt_now
+except ImportError:
+    import datetime
+    dt_now = datetime.datetime.now
+
+try:
+    import hyper
+    import hyper.tls
+    HYPER = True
+except ImportError:
+    HYPER = False
+
+from .settings import get_setting
+from .pool import get_pool, clear_pool
+from .breakers import connect
+
+# The status codes and reasons for which Apple has stopped accepting a device token.
+# https://developer.apple.com/documentation/usernotifications/handling-notification-responses-from-apns
+UNREGISTERED = 410
+TOO_MANY_REQUESTS = 429
+BAD_DEVICE_TOKEN = 'BadDeviceToken'
+EXPIRED_PROVIDER_TOKEN = 'ExpiredProviderToken'
+
+MAX_REQUEUES = 2  # Times a throttled request or one with an expired provider token is sent again.
+THROTTLED_DELAY = 1  # Seconds waited before sending throttled requests again.
+
+
+def _base64url(data):
+    return base64.urlsafe_b64encode(data).rstrip('=')
+
+
+def sign_provider_token(team_id, key_id, auth_key, issued_at):
+    """
+    Returns a provider authentication token: a JWT signed with ES256 using the
+    .p8 signing key `auth_key` downloaded from the Apple developer account.
+    """
+    try:
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+    except ImportError:
+        raise ImproperlyConfigured('Token authentication requires cryptography to be installed.')
+
+    header = _base64url(json.dumps({'alg': 'ES256', 'kid': key_id}, separators=(',', ':')))
+    claims = _base64url(json.dumps({'iss': team_id, 'iat': int(issued_at)}, separators=(',', ':')))
+    signing_input = '%s.%s' % (header, claims)
+    key = serialization.load_pem_private_key(str(auth_key), None, default_backend())
+    r, s = decode_dss_signature(key.sign(signing_input, ec.ECDSA(hashes.SHA256())))
+    # A JWS signature is r and s as 32 byte big-endian integers rather than DER.
+    signature = unhexlify('%064x%064x' % (r, s))
+    return '%s.%s' % (signing_input, _base64url(signature))
+
+
+_tokens = {}  # Maps (team id, key id, key digest) to an (issued_at, token) pair.
+_tokens_lock = threading.Lock()
+
+
+def get_provider_token(team_id, key_id, auth_key):
+    """
+    Returns the cached provider token for the signing key, signing a new one once the cached
+    token is IOS_NOTIFICATIONS_PROVIDER_TOKEN_LIFETIME seconds old. Apple rejects tokens older
+    than an hour as well as tokens which are replaced too often, so tokens are not signed per request.
+    """
+    key = (team_id, key_id, hashlib.sha1(auth_key.encode('utf8') if isinstance(auth_key, unicode) else auth_key).hexdigest())
+    now = time.time()
+    with _tokens_lock:
+        cached = _tokens.get(key)
+    if cached is not None and now - cached[0] < get_setting('IOS_NOTIFICATIONS_PROVIDER_TOKEN_LIFETIME'):
+        return cached[1]
+    token = sign_provider_token(team_id, key_id, auth_key, now)
+    with _tokens_lock:
+        _tokens[key] = (now, token)
+    return token
+
+
+def clear_provider_token(team_id, key_id):
+    """
+    Forgets the cached provider tokens of the signing key, e.g. after Apple rejected one as expired.
+    """
+    with _tokens_lock:
+        for key in [key for key in _tokens if key[:2] == (team_id, key_id)]:
+            del _tokens[key]
+
+
+def create_ssl_context(certificate=None, private_key=None, passphrase=None):
+    """
+    Returns an SSL context for HTTP/2, authenticating with the certificate if one is given.
+    """
+    context = hyper.tls.init_context()
+    if certificate:
+        # The ssl module only loads certificates and keys from files.
+        paths = []
+        try:
+            for value in (certificate, private_key or certificate):
+                handle, path = tempfile.mkstemp(suffix='.pem')
+                paths.append(path)
+                with os.fdopen(handle, 'w') as f:
+                    f.write(value.encode('utf8') if isinstance(value, unicode) else value)
+            context.load_cert_chain(paths[0], paths[1], str(passphrase) if passphrase else None)
+        finally:
+            for path in paths:
+                os.remove(path)
+    return context
+
+
+def close_http2_connection(connection):
+    """
+    Closes an HTTP/2 connection, ignoring any errors raised by a connection
+    which has already been dropped by the remote end.
+    """
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def open_http2_connection(service):
+    """
+    Opens an HTTP/2 connection to the service, authenticated with its certificate
+    unless it has a signing key for token authentication. Failed attempts are retried
+    and fail fast once the service's circuit breaker opens, as for binary connections.
+    """
+    if not service.http2_secure:
+        connection = hyper.HTTP20Connection(service.hostname, service.HTTP2_PORT, secure=False)
+    else:
+        if service.auth_key:
+            context = create_ssl_context()
+        else:
+            context = create_ssl_context(service.certificate, service.private_key, service.passphrase)
+        connection = hyper.HTTP20Connection(service.hostname, service.HTTP2_PORT, secure=True, ssl_context=context)
+
+    def attempt():
+        try:
+            connection.connect()
+        except Exception:
+            close_http2_connection(connection)
+            raise
+        return connection
+    return connect(service._pool_key(), attempt)
+
+
+def http2_pool_key(service):
+    return service._pool_key() + ('http2',)
+
+
+def get_http2_pool(service):
+    """
+    Returns the pool of HTTP/2 connections to the service. A connection is reused until
+    it has been idle for IOS_NOTIFICATIONS_CONNECTION_IDLE_TIMEOUT seconds.
+    """
+    return get_pool(http2_pool_key(service), lambda: open_http2_connection(service),
+                    service._pool_version(service.certificate, service.private_key) + (service.http2_secure,),
+                    check=lambda connection: True, close=close_http2_connection)
+
+
+def clear_http2_pool(service):
+    clear_pool(http2_pool_key(service))
+
+
+def send_http2(service, notification, payload, devices, chunk_size, checkpoint=None, record=None):
+    """
+    Sends the payload to the devices as HTTP/2 requests to the APNs provider API,
+    each on its own stream of a single pooled connection.
+
+    Up to IOS_NOTIFICATIONS_HTTP2_MAX_STREAMS requests of a chunk are in flight at once.
+    The responses of a chunk are all read before the next chunk is sent, so `checkpoint`
+    (see APNService._write_message) is only called once every device of a chunk has been
+    answered. The pks of the devices Apple accepted the notification for are passed to `record`
+    in runs which are not interrupted by a device Apple refused.
+    Devices whose token Apple no longer accepts are deactivated.
+
+    Requests Apple refuses because too many requests are being sent or because the provider
+    token expired are sent again, up to MAX_REQUEUES times, with a new provider token.
+    Requests are counted against the service's rate limiter, which backs off when Apple
+    answers that too many requests are being sent. Apple closes idle connections, so the
+    unanswered requests of a connection which fails are sent once more on a new connection.
+    """
+    from .models import PushResult, Device
+    if not HYPER:
+        raise ImproperlyConfigured('The HTTP/2 transport requires hyper to be installed.')
+
+    if record is None:
+        record = service._set_last_notified_at
+    max_streams = get_setting('IOS_NOTIFICATIONS_HTTP2_MAX_STREAMS')
+    headers = {
+        'apns-expiration': str(notification.expiry),
+        'apns-priority': str(notification.priority),
+        'apns-push-type': 'background' if notification.priority == 5 else 'alert',
+    }
+    if service.topic:
+        headers['apns-topic'] = service.topic
+    result = PushResult()
+    limiter = service.rate_limiter()
+
+    pool = get_http2_pool(service)
+    connection = pool.acquire()
+    try:
+        for chunk in service._device_batches(devices, chunk_size):
+            if not chunk:
+                continue
+            sent, unregistered = [], []
+            throttled = False
+            requeues = {}  # Maps the pks of the devices sent again to the number of times they were.
+            queue = collections.deque(chunk)
+            reconnected = False
+            while queue:
+                if service.auth_key:
+                    headers['authorization'] = 'bearer %s' % get_provider_token(service.team_id, service.key_id,
+                                                                                 service.auth_key)
+                batch = [queue.popleft() for i in xrange(min(max_streams, len(queue)))]
+                if limiter is not None:
+                    limiter.acquire(len(batch), len(batch) * len(payload))
+                answered = 0
+                requeued = []
+                try:
+                    streams = [connection.request('POST', '/3/device/%s' % hexlify(token), payload, headers)
+                               for pk, token in batch]
+                    for (pk, token), stream_id in zip(batch, streams):
+                        response = connection.get_response(stream_id)
+                        body = response.read()
+                        answered += 1
+                        if response.status == 200:
+                            sent.append(pk)
+                            continue
+                        reason = json.loads(body).get('reason') if body else None
+                        if reason == EXPIRED_PROVIDER_TOKEN or response.status == TOO_MANY_REQUESTS:
+                            if reason == EXPIRED_PROVIDER_TOKEN:
+                                clear_provider_token(service.team_id, service.key_id)
+                            else:
+                                throttled = True
+                            if requeues.get(pk, 0) < MAX_REQUEUES:
+                                requeues[pk] = requeues.get(pk, 0) + 1
+                                requeued.append((pk, token, response.status == TOO_MANY_REQUESTS))
+                                continue
+                        result.failed += 1
+                        if sent:
+                            result.sent += len(sent)
+                            record(sent)
+                            sent = []
+                        if response.status == UNREGISTERED or reason == BAD_DEVICE_TOKEN:
+                            unregistered.append(pk)
+                except Exception:
+                    if reconnected:
+                        raise
+                    # Most likely Apple closed the connection while it was idle.
+                    reconnected = True
+                    pool.discard(connection)
+                    connection = None
+                    connection = pool.acquire(fresh=True)
+                    queue.extendleft(reversed(batch[answered:]))
+                    continue
+                reconnected = False
+                if any(too_many for pk, token, too_many in requeued):
+                    if limiter is not None:
+                        limiter.backoff()
+                    time.sleep(THROTTLED_DELAY)
+                queue.extend((pk, token) for pk, token, too_many in requeued)
+            if sent:
+                result.sent += len(sent)
+                record(sent)
+            if limiter is not None and not throttled:
+                limiter.recover()
+            if unregistered:
+                Device.objects.filter(pk__in=unregistered).update(is_active=False, deactivated_at=dt_now())
+            if checkpoint is not None and checkpoint(chunk[-1][0], result) is False:
+                break
+    except:
+        if connection is not None:
+            pool.discard(connection)
+        raise
+    pool.release(connection)
+    return result
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import time
+import uuid
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ios_notifications.models import APNService, Device, token_to_binary
+from ios_notifications.tracking import MODES, TRACKERS
+
+
+class Command(BaseCommand):
+    help = ('Measures how many devices per second have their last_notified_at updated in each '
+            'IOS_NOTIFICATIONS_LAST_NOTIFIED_AT mode. The devices are created under a new APN service which is deleted afterwards.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--devices',
+                    help='The number of devices to create. Default is 10000.',
+                    dest='devices',
+                    default=10000),
+        make_option('--batch-size',
+                    help='The number of devices written to per batch, as in push_ios_notification. Default is 100.',
+                    dest='chunk_size',
+                    default=100),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            num_devices = int(options['devices'])
+            chunk_size = int(options['chunk_size'])
+        except ValueError:
+            raise CommandError('The --devices and --batch-size options should be integer values.')
+
+        service = APNService.objects.create(name='benchmark-%s' % uuid.uuid4().hex, hostname='127.0.0.1')
+        try:
+            self.benchmark(service, num_devices, chunk_size)
+        finally:
+            service.delete()
+
+    def benchmark(self, service, num_devices, chunk_size):
+        tokens = [uuid.uuid4().hex * 2 for i in xrange(num_devices)]
+        Device.objects.bulk_create([Device(token=token, binary_token=token_to_binary(token), service=service)
+                                    for token in tokens], batch_size=500)
+        devices = service.device_set.all()
+        pks = list(devices.order_by('pk').values_list('pk', flat=True))
+        chunks = [pks[i:i + chunk_size] for i in xrange(0, len(pks), chunk_size)]
+
+        for mode in MODES:
+            devices.update(last_notified_at=None)
+            tracker = TRACKERS[mode](devices)
+            started_at = time.time()
+            for chunk in chunks:
+                tracker.record(chunk)
+            tracker.flush()
+            elapsed = time.time() - started_at
+            rows = devices.filter(last_notified_at__isnull=False).count()
+            self.stdout.write('%-8s %8d rows in %.3fs (%d rows/s)\n' % (mode, rows, elapsed, rows / elapsed if elapsed else 0))
@@ -1,12 +1,32 @@
 # -*- coding: utf-8 -*-
 
+import time
+from multiprocessing.pool import ThreadPool
+
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
 from ios_notifications.models import FeedbackService
 from optparse import make_option
 
 # TODO: argparse for Python 2.7
 
 
+def call_service(service):
+    """
+    Calls a feedback service and returns the service, the number of feedback tuples received,
+    the number of devices deactivated, the number of seconds it took and the exception raised, if any.
+    """
+    started_at = time.time()
+    try:
+        num_deactivated = service.call()
+    except Exception as e:
+        return service, service.received, 0, time.time() - started_at, e
+    finally:
+        # Each thread has its own database connection.
+        connection.close()
+    return service, service.received, num_deactivated, time.time() - started_at, None
+
+
 class Command(BaseCommand):
     help = 'Calls the Apple Feedback Service to determine which devices are no longer active and deactivates them in the database.'
 
@@ -14,20 +34,81 @@ class Command(BaseCommand):
         make_option('--feedback-service',
             help='The id of the Feedback Service to call',
             dest='service',
+            default=None),
+        make_option('--all',
+            help='Call every Feedback Service',
+            action='store_true',
+            dest='all',
+            default=False),
+        make_option('--workers',
+            help='The number of Feedback Services called at once with --all. Default is 4.',
+            dest='workers',
+            default=4),
+        make_option('--interval',
+            help='Keep running and call the Feedback Service(s) again every this many seconds',
+            dest='interval',
             default=None),)
 
     def handle(self, *args, **options):
-        if options['service'] is None:
-            raise CommandError('The --feedback-service option is required')
+        if options['all']:
+            services = None
+        elif options['service'] is None:
+            raise CommandError('Either the --feedback-service or the --all option is required')
+        else:
+            try:
+                service_id = int(options['service'])
+            except ValueError:
+                raise CommandError('The --feedback-service option should pass an id in integer format as its value')
+            try:
+                services = [FeedbackService.objects.select_related('apn_service').get(pk=service_id)]
+            except FeedbackService.DoesNotExist:
+                raise CommandError('FeedbackService with id %d does not exist' % service_id)
+
         try:
-            service_id = int(options['service'])
+            workers = int(options['workers'])
         except ValueError:
-            raise CommandError('The --feedback-service option should pass an id in integer format as its value')
-        try:
-            service = FeedbackService.objects.get(pk=service_id)
-        except FeedbackService.DoesNotExist:
-            raise CommandError('FeedbackService with id %d does not exist' % service_id)
+            raise CommandError('The --workers option should be an integer value.')
+        if workers < 1:
+            raise CommandError('The --workers option should be greater than zero.')
+        interval = options['interval']
+        if interval is not None:
+            try:
+                interval = float(interval)
+            except ValueError:
+                raise CommandError('The --interval option should be a number.')
 
-        num_deactivated = service.call()
-        output = '%d device%s deactivated.\n' % (num_deactivated, ' was' if num_deactivated == 1 else 's were')
-        self.stdout.write(output)
+        if services is not None and interval is None:
+            num_deactivated = services[0].call()
+            output = '%d device%s deactivated.\n' % (num_deactivated, ' was' if num_deactivated == 1 else 's were')
+            self.stdout.write(output)
+            return
+
+        while True:
+            started_at = time.time()
+            if options['all']:
+                services = FeedbackService.objects.select_related('apn_service')
+            self.call_services(services, workers)
+            if interval is None:
+                return
+            time.sleep(max(0, interval - (time.time() - started_at)))
+
+    def call_services(self, services, workers):
+        """
+        Calls the feedback services, at most `workers` at a time, and reports on each of them.
+        A service which fails is reported without stopping the others.
+        """
+        services = list(services)
+        if not services:
+            return
+        pool = ThreadPool(min(workers, len(services)))
+        try:
+            for service, received, num_deactivated, elapsed, error in pool.imap_unordered(call_service, services):
+                if error is not None:
+                    self.stderr.write('%s: failed after %.2fs: %s\n' % (service, elapsed, error))
+                    continue
+                self.stdout.write('%s: %d feedback tuple%s received, %d device%s deactivated in %.2fs.\n' % (
+                    service, received, '' if received == 1 else 's',
+                    num_deactivated, '' if num_deactivated == 1 else 's', elapsed))
+        finally:
+            pool.close()
+            pool.join()
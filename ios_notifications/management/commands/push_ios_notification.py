@@ -45,6 +45,15 @@ class Command(BaseCommand):
                     help='Notifications are sent to devices in batches via the APN Service. This controls the batch size. Default is 100.',
                     dest='chunk_size',
                     default=100),
+        make_option('--workers',
+                    help='The number of processes the devices are split between, each with its own connection. Default is 1.',
+                    dest='workers',
+                    default=1),
+        make_option('--enqueue',
+                    help='Queue the notification to be pushed by the run_push_worker command instead of pushing it now.',
+                    action='store_true',
+                    dest='enqueue',
+                    default=False),
     )
 
     def handle(self, *args, **options):
@@ -86,9 +95,20 @@ class Command(BaseCommand):
         except ValueError:
             raise CommandError('The --batch-size option should be an integer value.')
 
+        try:
+            workers = int(options['workers'])
+        except ValueError:
+            raise CommandError('The --workers option should be an integer value.')
+
         if not notification.is_valid_length():
             raise CommandError('Notification exceeds the maximum payload length. Try making your message shorter.')
 
-        service.push_notification_to_devices(notification, chunk_size=chunk_size)
+        if options['enqueue']:
+            service.enqueue_notification(notification, chunk_size=chunk_size)
+            if 'test' not in sys.argv:
+                self.stdout.write('Notification queued successfully\n')
+            return
+
+        service.push_notification_to_devices(notification, chunk_size=chunk_size, workers=workers)
         if 'test' not in sys.argv:
             self.stdout.write('Notification pushed successfully\n')
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ios_notifications.models import PushJob
+
+
+class Command(BaseCommand):
+    help = 'Pushes queued notifications. Any number of workers can run at once, on one or more machines.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--once',
+                    help='Exit once there are no queued push jobs left instead of waiting for more.',
+                    action='store_true',
+                    dest='once',
+                    default=False),
+        make_option('--sleep',
+                    help='The number of seconds to wait before checking for new push jobs when the queue is empty. Default is 5.',
+                    dest='sleep',
+                    default=5),
+        make_option('--time-limit',
+                    help='The number of seconds a job is pushed for before it is queued again to be resumed, e.g. by another worker.',
+                    dest='time_limit',
+                    default=None),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            sleep = float(options['sleep'])
+        except ValueError:
+            raise CommandError('The --sleep option should be a number.')
+        time_limit = options['time_limit']
+        if time_limit is not None:
+            try:
+                time_limit = float(time_limit)
+            except ValueError:
+                raise CommandError('The --time-limit option should be a number.')
+
+        while True:
+            job = PushJob.objects.claim()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(sleep)
+                continue
+            job.run(time_limit)
+            if int(options.get('verbosity', 1)) > 0:
+                self.stdout.write('Push job %d %s: %d sent, %d failed.\n' % (job.pk, job.status, job.sent, job.failed))
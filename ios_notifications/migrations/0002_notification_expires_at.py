@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ios_notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, help_text=b'Time after which Apple stops trying to deliver the notification. Leave empty to only attempt delivery once.', null=True),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+from binascii import unhexlify
+
+import django
+from django.db import migrations, models, transaction
+
+TOKEN_RE = re.compile(r'^[0-9a-fA-F]{64}$')
+BATCH_SIZE = 1000
+
+
+def fill_binary_tokens(apps, schema_editor):
+    """
+    Stores the binary form of every valid token, a batch at a time. Each batch is written
+    with a single CASE update (on Django 1.8 and later) in its own transaction, so a large
+    table is neither updated row by row nor, on Django 1.10 and later, locked for the whole backfill.
+    """
+    Device = apps.get_model('ios_notifications', 'Device')
+    binary = schema_editor.connection.Database.Binary
+    devices = Device.objects.filter(binary_token__isnull=True).order_by('pk').values_list('pk', 'token')
+    last_pk = 0
+    while True:
+        batch = list(devices.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            break
+        tokens = [(pk, unhexlify(token)) for pk, token in batch if TOKEN_RE.match(token)]
+        with transaction.atomic(using=schema_editor.connection.alias):
+            if django.VERSION >= (1, 8):
+                from django.db.models import Case, When, Value
+                if tokens:
+                    Device.objects.filter(pk__in=[pk for pk, token in tokens]).update(binary_token=Case(
+                        *[When(pk=pk, then=Value(binary(token))) for pk, token in tokens],
+                        output_field=models.BinaryField()))
+            else:
+                for pk, token in tokens:
+                    Device.objects.filter(pk=pk).update(binary_token=token)
+        last_pk = batch[-1][0]
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+    # The backfill commits a batch at a time rather than in one transaction (Django 1.10 and later).
+    atomic = False
+
+    dependencies = [
+        ('ios_notifications', '0002_notification_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='binary_token',
+            field=models.BinaryField(blank=True, max_length=32, null=True),
+        ),
+        migrations.RunPython(fill_binary_tokens, noop),
+    ]
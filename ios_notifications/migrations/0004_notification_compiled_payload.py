@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ios_notifications', '0003_device_binary_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='compiled_payload',
+            field=models.BinaryField(blank=True, max_length=256, null=True),
+        ),
+    ]
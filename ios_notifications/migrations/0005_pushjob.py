@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-16 20:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ios_notifications', '0004_notification_compiled_payload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_size', models.PositiveIntegerField(default=100)),
+                ('status', models.CharField(choices=[(b'queued', b'Queued'), (b'running', b'Running'), (b'done', b'Done'), (b'failed', b'Failed')], db_index=True, default=b'queued', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('devices', models.ManyToManyField(blank=True, to='ios_notifications.Device')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='pushjob',
+            name='notification',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ios_notifications.Notification'),
+        ),
+    ]
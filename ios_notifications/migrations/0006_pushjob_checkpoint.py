@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-16 20:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ios_notifications', '0005_pushjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushjob',
+            name='checkpointed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pushjob',
+            name='last_device_pk',
+            field=models.PositiveIntegerField(blank=True, help_text=b'The last device the notification was sent to.', null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_registered_at(apps, schema_editor):
+    Device = apps.get_model('ios_notifications', 'Device')
+    Device.objects.filter(registered_at__isnull=True).update(registered_at=models.F('added_at'))
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ios_notifications', '0006_pushjob_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='registered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_registered_at, noop),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-16 21:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ios_notifications', '0007_device_registered_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apnservice',
+            name='auth_key',
+            field=models.TextField(blank=True, help_text=b'The .p8 signing key for token authentication. Leave empty to authenticate with the certificate.'),
+        ),
+        migrations.AddField(
+            model_name='apnservice',
+            name='key_id',
+            field=models.CharField(blank=True, help_text=b'Key ID of the signing key for token authentication', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='apnservice',
+            name='team_id',
+            field=models.CharField(blank=True, help_text=b'Team ID for token authentication', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='apnservice',
+            name='topic',
+            field=models.CharField(blank=True, help_text=b'The bundle ID of the app. Required by the HTTP/2 transport with token authentication.', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='apnservice',
+            name='transport',
+            field=models.CharField(choices=[(b'binary', b'Binary protocol'), (b'http2', b'HTTP/2 provider API')], default=b'binary', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='apnservice',
+            name='certificate',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='apnservice',
+            name='private_key',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-16 21:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ios_notifications', '0008_apnservice_http2'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apnservice',
+            name='rate_limit_bytes',
+            field=models.PositiveIntegerField(blank=True, help_text=b'Maximum bytes sent per second by all processes. Leave empty for no limit.', null=True),
+        ),
+        migrations.AddField(
+            model_name='apnservice',
+            name='rate_limit_frames',
+            field=models.PositiveIntegerField(blank=True, help_text=b'Maximum notifications sent per second by all processes. Leave empty for no limit.', null=True),
+        ),
+    ]
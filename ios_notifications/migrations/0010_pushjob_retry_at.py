@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-16 21:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ios_notifications', '0009_apnservice_rate_limit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushjob',
+            name='retry_at',
+            field=models.DateTimeField(blank=True, help_text=b'When a job queued again because its service was unavailable is retried.', null=True),
+        ),
+    ]
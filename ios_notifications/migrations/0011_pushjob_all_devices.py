@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-16 22:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def flag_all_device_jobs(apps, schema_editor):
+    # Jobs without devices used to be pushed to every device of their service.
+    PushJob = apps.get_model('ios_notifications', 'PushJob')
+    PushJob.objects.filter(devices__isnull=True).update(all_devices=True)
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ios_notifications', '0010_pushjob_retry_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushjob',
+            name='all_devices',
+            field=models.BooleanField(default=False, help_text=b'Whether the notification is pushed to every device of its service.'),
+        ),
+        migrations.RunPython(flag_all_device_jobs, noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.4 on 2026-10-16 22:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ios_notifications', '0011_pushjob_all_devices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='compiled_from',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+    ]
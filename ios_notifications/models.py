@@ -1,16 +1,27 @@
 # -*- coding: utf-8 -*-
+import re
 import socket
+import select
 import struct
+import calendar
 import errno
 import json
+import time
+import datetime
+import itertools
+import hashlib
 from binascii import hexlify, unhexlify
 
-from django.db import models
+import django
+from django.core.exceptions import ValidationError
+from django.db import models, connection, transaction, IntegrityError
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 try:
     from django.utils.timezone import now as dt_now
 except ImportError:
-    import datetime
     dt_now = datetime.datetime.now
 
 from django_fields.fields import EncryptedCharField
@@ -18,12 +29,65 @@ import OpenSSL
 
 try:
     import gevent_openssl
+    from gevent import socket as gevent_socket
     GEVENT_OPEN_SSL=True
 except:
     GEVENT_OPEN_SSL=False
 
-from .exceptions import NotificationPayloadSizeExceeded, InvalidPassPhrase
+from .exceptions import NotificationPayloadSizeExceeded, ServiceUnavailable
 from .settings import get_setting
+from .pool import get_pool, clear_pool, is_alive
+from .contexts import get_context, clear_context, fingerprint
+from .frames import FrameBuilder, TemplateFrameBuilder, FrameConnection
+from .payloads import PayloadTemplate
+from .shards import push_in_processes
+from .engines import ENGINES, send_with_gevent, send_pipelined
+from .tracking import get_tracker
+from .feedback import read_records, feedback_time
+from .http2 import send_http2, clear_http2_pool
+from .ratelimit import RateLimiter
+from .breakers import connect, clear_breaker
+
+
+TOKEN_RE = re.compile(r'^[0-9a-fA-F]{64}$')
+
+
+def token_to_binary(token):
+    """
+    Converts a 64 character hex device token to its 32 byte binary form.
+    Returns None if the token is not valid.
+    """
+    if token is None or not TOKEN_RE.match(token):
+        return None
+    return unhexlify(token)
+
+
+class DeviceTokens(list):
+    """
+    A list of (pk, binary token) pairs of active devices, sorted by pk,
+    which can be pushed to without reading the devices again.
+    """
+
+
+class PushResult(object):
+    """
+    The number of devices a notification was sent to and failed to be sent to.
+    """
+    def __init__(self, sent=0, failed=0):
+        self.sent = sent
+        self.failed = failed
+
+    def __add__(self, other):
+        return PushResult(self.sent + other.sent, self.failed + other.failed)
+
+    def __eq__(self, other):
+        return isinstance(other, PushResult) and (self.sent, self.failed) == (other.sent, other.failed)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'PushResult(sent=%d, failed=%d)' % (self.sent, self.failed)
 
 
 class BaseService(models.Model):
@@ -40,28 +104,44 @@ class BaseService(models.Model):
         Establishes an encrypted SSL socket connection to the service.
         After connecting the socket can be written to or read from.
         """
-        # ssl in Python < 3.2 does not support certificates/keys as strings.
-        # See http://bugs.python.org/issue3823
-        # Therefore pyOpenSSL which lets us do this is a dependancy.
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, certificate)
-        args = [OpenSSL.crypto.FILETYPE_PEM, private_key]
-        if passphrase is not None:
-            args.append(str(passphrase))
-        try:
-            pkey = OpenSSL.crypto.load_privatekey(*args)
-        except OpenSSL.crypto.Error:
-            raise InvalidPassPhrase
-        context = OpenSSL.SSL.Context(OpenSSL.SSL.TLSv1_METHOD)
-        context.use_certificate(cert)
-        context.use_privatekey(pkey)
+        self.connection = self._open_connection(certificate, private_key, passphrase)
+
+    def _open_connection(self, certificate, private_key, passphrase=None):
+        """
+        Opens a new encrypted SSL socket connection to the service and returns it.
+
+        Failed attempts are retried with jittered exponential backoff. Once connecting has
+        failed repeatedly the service's circuit breaker opens and ServiceUnavailable is raised
+        straight away, until a single probing connection succeeds again.
+        """
+        return connect(self._pool_key(), lambda: self._handshake(certificate, private_key, passphrase))
+
+    def _handshake(self, certificate, private_key, passphrase=None):
+        """
+        Makes a single attempt at opening an encrypted SSL socket connection to the service.
+
+        The parsed certificate and private key are cached in an SSL context per
+        APN service, so only the socket and handshake are paid for on reconnect.
+        """
+        if GEVENT_OPEN_SSL:
+            # A cooperative socket lets gevent_openssl wait for the socket
+            # instead of blocking every other greenlet.
+            sock = gevent_socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        context = get_context(self._context_key(), certificate, private_key, passphrase)
         if GEVENT_OPEN_SSL:
-            self.connection = gevent_openssl.SSL.Connection(context, sock)
+            connection = gevent_openssl.SSL.Connection(context, sock)
         else:
-            self.connection = OpenSSL.SSL.Connection(context, sock)
-        self.connection.connect((self.hostname, self.PORT))
-        self.connection.set_connect_state()
-        self.connection.do_handshake()
+            connection = OpenSSL.SSL.Connection(context, sock)
+        try:
+            connection.connect((self.hostname, self.PORT))
+            connection.set_connect_state()
+            connection.do_handshake()
+        except Exception:
+            sock.close()
+            raise
+        return connection
 
     def _disconnect(self):
         """
@@ -71,6 +151,55 @@ class BaseService(models.Model):
             self.connection.shutdown()
             self.connection.close()
 
+    def _context_key(self):
+        raise NotImplementedError
+
+    def _pool_key(self):
+        return (self.__class__.__name__, self.pk)
+
+    def _check_connection(self, connection):
+        """
+        Determines whether an idle pooled connection can be handed out again.
+        """
+        return is_alive(connection)
+
+    def _pool_version(self, certificate, private_key):
+        """
+        Identifies the hostname and credentials pooled connections are opened with.
+        """
+        return (self.hostname, fingerprint(certificate, private_key))
+
+    def _pooled_connect(self, certificate, private_key, passphrase=None):
+        """
+        Takes an open connection from the service's connection pool.
+        A new connection is only opened if no healthy idle connection is available.
+        Connections opened with other credentials or another hostname are never reused.
+        """
+        self._connection_pool = get_pool(self._pool_key(),
+                                         lambda: self._open_connection(certificate, private_key, passphrase),
+                                         self._pool_version(certificate, private_key),
+                                         check=self._check_connection)
+        self.connection = self._connection_pool.acquire()
+
+    def _pooled_disconnect(self, reuse=True):
+        """
+        Hands the connection back to the pool it was taken from.
+        If `reuse` is False the connection is closed instead,
+        e.g. because Apple has dropped it.
+        """
+        if self.connection is not None:
+            if reuse:
+                self._connection_pool.release(self.connection)
+            else:
+                self._connection_pool.discard(self.connection)
+            self.connection = None
+
+    def close_connections(self):
+        """
+        Closes all pooled connections to the service.
+        """
+        clear_pool(self._pool_key())
+
     class Meta:
         abstract = True
 
@@ -82,37 +211,194 @@ class APNService(BaseService):
 
     `private_key` is optional if both the certificate and key are provided in
     `certificate`.
+
+    With the HTTP/2 transport the service can authenticate with a signing key
+    (`team_id`, `key_id` and `auth_key`) instead of the certificate.
     """
-    certificate = models.TextField()
-    private_key = models.TextField()
+    BINARY = 'binary'
+    HTTP2 = 'http2'
+    TRANSPORT_CHOICES = (
+        (BINARY, 'Binary protocol'),
+        (HTTP2, 'HTTP/2 provider API'),
+    )
+
+    certificate = models.TextField(blank=True)
+    private_key = models.TextField(blank=True)
     passphrase = EncryptedCharField(
         null=True, blank=True, help_text='Passphrase for the private key',
         block_type='MODE_CBC')
+    transport = models.CharField(max_length=10, choices=TRANSPORT_CHOICES, default=BINARY)
+    topic = models.CharField(max_length=255, blank=True,
+                             help_text='The bundle ID of the app. Required by the HTTP/2 transport with token authentication.')
+    team_id = models.CharField(max_length=10, blank=True, help_text='Team ID for token authentication')
+    key_id = models.CharField(max_length=10, blank=True, help_text='Key ID of the signing key for token authentication')
+    auth_key = models.TextField(blank=True, help_text='The .p8 signing key for token authentication. '
+                                                      'Leave empty to authenticate with the certificate.')
+    rate_limit_frames = models.PositiveIntegerField(null=True, blank=True,
+                                                    help_text='Maximum notifications sent per second by all processes. '
+                                                              'Leave empty for no limit.')
+    rate_limit_bytes = models.PositiveIntegerField(null=True, blank=True,
+                                                   help_text='Maximum bytes sent per second by all processes. '
+                                                             'Leave empty for no limit.')
 
     PORT = 2195
+    HTTP2_PORT = 443
+    http2_secure = True  # Whether HTTP/2 connections use TLS.
     fmt = '!cH32sH%ds'
+    # Command 2 frames: the command and frame length followed by the
+    # device token, payload, identifier, expiry and priority items.
+    enhanced_fmt = '!BIBH32sBH%dsBHIBHIBHB'
+    enhanced_frame_length = 56  # The frame length excluding the payload.
+    error_response_fmt = '!BBI'
+    error_response_timeout = 1  # Seconds to wait for an error response after a dropped connection.
+    SHUTDOWN = 10  # The error response status naming the last frame processed before Apple shut down.
+    sent_frames_history = 10000  # Enhanced frames remembered per connection to be sent again after an error.
+    user_batch_size = 500  # Ids listed in a single query when looking up or queueing many devices.
+
+    def _context_key(self):
+        return self.pk
+
+    def _open_connection(self, certificate, private_key, passphrase=None):
+        connection = super(APNService, self)._open_connection(certificate, private_key, passphrase)
+        return FrameConnection(connection, self.sent_frames_history)
+
+    def _check_connection(self, connection):
+        """
+        Connections with enhanced frames Apple might still answer are always handed out,
+        so whoever takes it reads the error response and sends the discarded frames again.
+        """
+        return bool(connection.sent) or is_alive(connection)
 
     def _connect(self):
         """
         Establishes an encrypted SSL socket connection to the service.
         After connecting the socket can be written to or read from.
+        Connections are pooled and kept open between calls.
         """
-        return super(APNService, self)._connect(self.certificate, self.private_key, self.passphrase)
+        return self._pooled_connect(self.certificate, self.private_key, self.passphrase)
 
-    def push_notification_to_devices(self, notification, devices=None, chunk_size=100):
+    def _disconnect(self, reuse=True):
+        """
+        Returns the connection to the pool or closes it if `reuse` is False.
+        """
+        return self._pooled_disconnect(reuse)
+
+    def close_connections(self):
+        super(APNService, self).close_connections()
+        clear_http2_pool(self)
+
+    def rate_limiter(self):
+        """
+        Returns the RateLimiter shared by every process sending to the service,
+        or None if the service is not rate limited.
+        """
+        if not (self.rate_limit_frames or self.rate_limit_bytes):
+            return None
+        return RateLimiter(self.pk, self.rate_limit_frames, self.rate_limit_bytes)
+
+    def push_notification_to_devices(self, notification, devices=None, chunk_size=100, workers=1, engine=None,
+                                     values=None, slots=None):
         """
         Sends the specific notification to devices.
         if `devices` is not supplied, all devices in the `APNService`'s device
         list will be sent the notification.
+
+        If `workers` is greater than one and `devices` is a queryset, the devices are split
+        into shards by primary key and each shard is sent from its own process.
+
+        `engine` selects how connections are written to. 'blocking' writes to one connection
+        at a time, 'pipelined' fetches devices and updates them in other threads while writing
+        and 'gevent' writes to several connections at once from greenlets.
+        It defaults to the IOS_NOTIFICATIONS_ENGINE setting.
+
+        With the HTTP/2 transport `workers` must be 1 and `engine` is ignored, as every
+        notification is sent on its own stream of one connection.
+
+        `values` personalises the payload per device. It is a dict mapping device pks to a dict
+        of the values of `slots` for the device, e.g. `{device.pk: {'badge': 3}}`, or a callable
+        taking a list of device pks and returning such a dict, called once per chunk.
+        `slots` lists the slots of the payload (see payloads.PayloadTemplate) and defaults to the
+        keys used in the `values` dict. Devices whose payload is too long are counted as failed.
+        Personalised payloads are sent with one worker over the binary protocol.
+
+        Returns a PushResult with the number of devices sent to and failed.
         """
         if devices is None:
             devices = self.device_set.filter(is_active=True)
-        self._write_message(notification, devices, chunk_size)
+        return self._write_message(notification, devices, chunk_size, workers, engine, values=values, slots=slots)
+
+    def push_notification_to_users(self, notification, user_ids, chunk_size=100, workers=1, engine=None):
+        """
+        Sends the notification to the active devices of the service belonging to any of the users.
+        `user_ids` is a list of user pks or a queryset of them, e.g. `User.objects.filter(...).values('pk')`,
+        which keeps the ids in the database. See `push_notification_to_devices` for the other arguments.
+
+        A queryset of ids selects the devices with a subquery on the users many to many table,
+        so each batch of tokens is read with a single query. The tokens for a list of ids are read once,
+        a few hundred ids at a time, instead of listing every id in each batch. No Device or user
+        instances are created and a device belonging to several of the users is sent the notification once.
+
+        Returns a PushResult with the number of devices sent to and failed.
+        """
+        return self._write_message(notification, self._user_devices(user_ids), chunk_size, workers, engine)
+
+    def _user_devices(self, user_ids):
+        """
+        Returns the active devices of the service belonging to any of the users.
+
+        A queryset of user ids stays in the database as a subquery and a queryset of the devices is returned.
+        A list of user ids is looked up `user_batch_size` ids at a time, so no query has more parameters
+        than the database allows, and the devices are returned as DeviceTokens read with those queries.
+        """
+        through = Device.users.through
+        field = Device._meta.get_field('users')
+        device_field, user_field = field.m2m_field_name(), field.m2m_reverse_field_name()
+        if isinstance(user_ids, models.query.QuerySet):
+            device_ids = through.objects.filter(**{'%s__in' % user_field: user_ids})
+            return self.device_set.filter(is_active=True, pk__in=device_ids.values(device_field))
+        user_ids = list(user_ids)
+        tokens = {}
+        for start in xrange(0, len(user_ids), self.user_batch_size):
+            rows = through.objects.filter(**{'%s__in' % user_field: user_ids[start:start + self.user_batch_size],
+                                             '%s__service' % device_field: self,
+                                             '%s__is_active' % device_field: True})
+            rows = rows.values_list(device_field, '%s__binary_token' % device_field, '%s__token' % device_field)
+            for pk, binary_token, token in rows.iterator():
+                tokens[pk] = token_to_binary(token) if binary_token is None else bytes(binary_token)
+        return DeviceTokens(sorted((pk, token) for pk, token in tokens.iteritems() if token is not None))
+
+    def enqueue_notification(self, notification, devices=None, chunk_size=100):
+        """
+        Queues the notification to be pushed by a worker instead of pushing it straight away.
+        See `push_notification_to_devices` for the arguments.
 
-    def _write_message(self, notification, devices, chunk_size):
+        Returns the PushJob.
+        """
+        if notification.pk is None:
+            notification.save()
+        job = PushJob.objects.create(notification=notification, chunk_size=chunk_size, all_devices=devices is None)
+        if isinstance(devices, models.query.QuerySet):
+            # Add the devices by pk rather than loading each of them.
+            devices = list(devices.values_list('pk', flat=True))
+        elif isinstance(devices, DeviceTokens):
+            devices = [pk for pk, token in devices]
+        else:
+            devices = list(devices or [])
+        # Add the devices in batches so no query has more parameters than the database allows.
+        for start in xrange(0, len(devices), self.user_batch_size):
+            job.devices.add(*devices[start:start + self.user_batch_size])
+        return job
+
+    def _write_message(self, notification, devices, chunk_size, workers=1, engine=None, checkpoint=None,
+                       values=None, slots=None):
         """
         Writes the message for the supplied devices to
         the APN Service SSL socket.
+
+        If given, `checkpoint` is called with the pk of the last device of each chunk and the
+        PushResult so far once every device up to that one has been sent to. Sending stops early
+        if it returns False. Devices are sent to in pk order, so a push can be resumed by
+        filtering `devices` on `pk__gt` the last checkpointed pk.
         """
         if not isinstance(notification, Notification):
             raise TypeError('notification should be an instance of ios_notifications.models.Notification')
@@ -120,42 +406,312 @@ class APNService(BaseService):
         if not isinstance(chunk_size, int) or chunk_size < 1:
             raise ValueError('chunk_size must be an integer greater than zero.')
 
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError('workers must be an integer greater than zero.')
+
+        if engine is None:
+            engine = get_setting('IOS_NOTIFICATIONS_ENGINE')
+        if engine not in ENGINES:
+            raise ValueError('engine must be one of %s.' % ', '.join(ENGINES))
+
+        if checkpoint is not None and workers > 1:
+            raise ValueError('checkpoint can not be used with more than one worker.')
+
+        if self.transport == self.HTTP2 and workers > 1:
+            raise ValueError('workers can not be used with the HTTP/2 transport.')
+
+        if values is not None:
+            if workers > 1 or self.transport == self.HTTP2:
+                raise ValueError('values can only be used with one worker and the binary transport.')
+            if slots is None:
+                if callable(values):
+                    raise ValueError('slots must be given when values is a callable.')
+                slots = sorted(set(slot for device_values in values.itervalues() for slot in device_values))
+
         payload = notification.payload
+        if len(payload) > 256:
+            raise NotificationPayloadSizeExceeded
+
+        if self.transport == self.HTTP2:
+            tracker = get_tracker(devices)
+            try:
+                result = send_http2(self, notification, payload, devices, chunk_size, checkpoint, tracker.record)
+            finally:
+                tracker.flush()
+        else:
+            if values is not None:
+                frames = self._template_frame_builder(notification, PayloadTemplate(notification, slots), values)
+            else:
+                frames = self._frame_builder(notification, payload)
+            if workers > 1 and isinstance(devices, models.query.QuerySet) and devices.query.can_filter():
+                result = push_in_processes(self, frames, devices, chunk_size, workers, engine)
+            else:
+                result = self._send(frames, devices, chunk_size, engine, checkpoint)
 
-        # Split the devices into manageable chunks.
-        # Chunk sizes being determined by the `chunk_size` arg.
-        device_length = devices.count() if isinstance(devices, models.query.QuerySet) else len(devices)
-        chunks = [devices[i:i + chunk_size] for i in xrange(0, device_length, chunk_size)]
+        if notification.pk or notification.persist:
+            notification.last_sent_at = dt_now()
+            notification.save()
+        return result
+
+    def _send(self, frames, devices, chunk_size, engine='blocking', checkpoint=None):
+        """
+        Sends the frames in `frames` to the devices and returns a PushResult.
+        See `_write_message` for `checkpoint`.
+
+        last_notified_at is updated as set by the IOS_NOTIFICATIONS_LAST_NOTIFIED_AT setting.
+        """
+        tracker = get_tracker(devices)
+        try:
+            if engine == 'gevent':
+                return send_with_gevent(self, frames, devices, chunk_size,
+                                        get_setting('IOS_NOTIFICATIONS_CONNECTION_POOL_SIZE'),
+                                        checkpoint, tracker.record)
+            if engine == 'pipelined':
+                return send_pipelined(self, frames, devices, chunk_size,
+                                      checkpoint=checkpoint, record=tracker.record)
+            result = PushResult()
+            # Send to the devices in manageable chunks.
+            # Chunk sizes being determined by the `chunk_size` arg.
+            for chunk in self._device_batches(devices, chunk_size):
+                if not chunk:
+                    continue
+                last_pk = chunk[-1][0]
+                while chunk:
+                    chunk = self._write_chunk(chunk, frames, result, tracker.record)
+                if checkpoint is not None and checkpoint(last_pk, result) is False:
+                    break
+            return result
+        finally:
+            tracker.flush()
 
-        for index in xrange(len(chunks)):
-            chunk = chunks[index]
-            self._connect()
+    def _device_batches(self, devices, batch_size):
+        """
+        Yields lists of (pk, binary token) pairs of the active devices, `batch_size` at a time.
 
-            for device in chunk:
+        A queryset is walked by primary key rather than sliced, so each batch is
+        fetched with a cheap `pk > last_pk` query instead of an ever growing OFFSET,
+        and devices added or deactivated during a push do not shift later batches.
+        """
+        if isinstance(devices, models.query.QuerySet) and devices.query.can_filter():
+            devices = devices.filter(is_active=True).order_by('pk').values_list('pk', 'binary_token')
+            last_pk = None
+            while True:
+                batch = devices if last_pk is None else devices.filter(pk__gt=last_pk)
+                batch = list(batch[:batch_size])
+                if not batch:
+                    return
+                last_pk = batch[-1][0]
+                yield self._decode_batch(batch)
+                if len(batch) < batch_size:
+                    return
+        elif isinstance(devices, DeviceTokens):
+            for start in xrange(0, len(devices), batch_size):
+                yield devices[start:start + batch_size]
+        else:
+            batch = []
+            for device in devices:
                 if not device.is_active:
                     continue
+                batch.append((device.pk, device.get_binary_token()))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def _decode_batch(self, batch):
+        """
+        Converts the binary tokens in a batch of (pk, binary token) pairs to bytes.
+        Devices saved without a binary token, e.g. through `QuerySet.update`,
+        have their hex token decoded instead and devices with invalid tokens are skipped.
+        """
+        missing = [pk for pk, token in batch if token is None]
+        if missing:
+            tokens = dict((pk, token_to_binary(token)) for pk, token in
+                          Device.objects.filter(pk__in=missing).values_list('pk', 'token'))
+            batch = [(pk, tokens.get(pk) if token is None else token) for pk, token in batch]
+        return [(pk, bytes(token)) for pk, token in batch if token is not None]
+
+    def _frame_builder(self, notification, payload):
+        """
+        Returns a FrameBuilder for the notification's frames, using the
+        enhanced format if IOS_NOTIFICATIONS_ENHANCED_FORMAT is set.
+        """
+        buffer_size = get_setting('IOS_NOTIFICATIONS_WRITE_BUFFER_SIZE')
+        blank_token = '\0' * 32
+        if get_setting('IOS_NOTIFICATIONS_ENHANCED_FORMAT'):
+            template = self._pack_enhanced_frame(payload, blank_token, 0, notification.expiry, notification.priority)
+            # The token follows the command, frame length and item header. The identifier follows
+            # the token and payload items and its own item header.
+            return FrameBuilder(template, 8, 8 + 32 + 3 + len(payload) + 3, buffer_size)
+        return FrameBuilder(self._pack_frame(payload, blank_token), 3, buffer_size=buffer_size)
+
+    def _template_frame_builder(self, notification, template, values):
+        """
+        Returns a TemplateFrameBuilder for the notification's personalised frames.
+        """
+        buffer_size = get_setting('IOS_NOTIFICATIONS_WRITE_BUFFER_SIZE')
+        if get_setting('IOS_NOTIFICATIONS_ENHANCED_FORMAT'):
+            expiry, priority = notification.expiry, notification.priority
+            return TemplateFrameBuilder(
+                template, values,
+                lambda payload, token, identifier: self._pack_enhanced_frame(payload, token, identifier, expiry, priority),
+                enhanced=True, buffer_size=buffer_size)
+        return TemplateFrameBuilder(template, values, lambda payload, token, identifier: self._pack_frame(payload, token),
+                                    buffer_size=buffer_size)
+
+    def _write_chunk(self, chunk, frames, result, record=None):
+        """
+        Writes a frame for each (pk, binary token) pair in `chunk` to a single connection.
+        Frames are buffered and written together once the buffer is full.
+        The pks of the devices written to are passed to `record`, which defaults
+        to updating their last_notified_at.
+
+        Devices whose personalised payload is too long are counted as failed and left out.
+
+        Enhanced frames are numbered per connection and remembered (see frames.SentFrames).
+        Apple's error response is read after the chunk is written and before the connection is
+        used again, so the frames Apple discarded after the one it names are sent again even
+        when the response arrives after the chunk it is about.
+
+        Returns the devices which have not been sent the notification
+        yet because Apple dropped the connection.
+        """
+        if record is None:
+            record = self._set_last_notified_at
+        limiter = self.rate_limiter()
+        earlier = []  # (frame builder, (pk, token)) pairs of earlier pushes Apple discarded.
+        self._connect()
+        try:
+            if self.connection.sent:
+                # Apple may have answered frames written before, e.g. at the end of the previous chunk.
+                error, resend, undelivered = self._read_lost_frames(frames, result, earlier)
+                chunk = resend + chunk
+                if error is not None or not is_alive(self.connection):
+                    self._disconnect(reuse=False)
+                    self._connect()
+            too_long = frames.prepare(chunk)
+            if too_long:
+                result.failed += len(too_long)
+                too_long = set(too_long)
+                chunk = [(pk, token) for pk, token in chunk if pk not in too_long]
+            failed_at = None
+            frames.clear()
+            buffered_from = 0  # The position in the chunk of the first buffered frame.
+            numbered = len(chunk)  # The number of frames given an identifier, i.e. written or attempted.
+            last = len(chunk) - 1
+            identifiers = []
+
+            for i, (pk, token) in enumerate(chunk):
+                identifier = self.connection.sent.add(pk, token, frames) if frames.enhanced else 0
+                identifiers.append(identifier)
+                if not frames.add(token, identifier, pk) and i != last:
+                    continue
+                view = frames.view()
+                if limiter is not None:
+                    limiter.acquire(i + 1 - buffered_from, len(view))
                 try:
-                    self.connection.send(self.pack_message(payload, device))
+                    self.connection.sendall(view)
                 except (OpenSSL.SSL.WantWriteError, socket.error) as e:
                     if isinstance(e, socket.error) and isinstance(e.args, tuple) and e.args[0] != errno.EPIPE:
+                        if limiter is not None and e.args[0] == errno.ECONNRESET:
+                            limiter.backoff()
                         raise e  # Unexpected exception, raise it.
-                    self._disconnect()
-                    i = chunk.index(device)
-                    self.set_devices_last_notified_at(chunk[:i])
-                    # Start again from the next device.
-                    # We start from the next device since
-                    # if the device no longer accepts push notifications from your app
-                    # and you send one to it anyways, Apple immediately drops the connection to your APNS socket.
-                    # http://stackoverflow.com/a/13332486/1025116
-                    self._write_message(notification, chunk[i + 1:], chunk_size)
+                    failed_at = buffered_from
+                    numbered = i + 1
+                    break
+                frames.clear()
+                buffered_from = i + 1
 
-            self._disconnect()
+            error, resend, undelivered = None, [], None
+            if frames.enhanced and chunk:
+                # The frames written count as sent unless the error response says otherwise.
+                result.sent += numbered
+                error, resend, undelivered = self._read_lost_frames(
+                    frames, result, earlier, self.error_response_timeout if failed_at is not None else 0)
+        except:
+            # Whatever went wrong, e.g. SysCallError for a dropped connection or an error from
+            # the rate limiter's cache, the connection must not stay checked out of the pool.
+            self._disconnect(reuse=False)
+            raise
 
-            self.set_devices_last_notified_at(chunk)
+        if undelivered is not None:
+            # Apple named a frame and dropped the connection. Frames written after it were discarded.
+            self._disconnect(reuse=False)
+            record([pk for sent_as, (pk, token) in zip(identifiers, chunk) if sent_as not in undelivered])
+            # The devices after the failed write were never written to.
+            remaining = resend + chunk[numbered:]
+        elif failed_at is None:
+            # Keep the connection open for the next chunk, unless Apple answered with an error
+            # response about frames it no longer remembers.
+            self._disconnect(reuse=error is None)
+            if limiter is not None:
+                limiter.recover()
+            record([pk for pk, token in chunk])
+            if not frames.enhanced:
+                result.sent += len(chunk)
+            remaining = []
+        else:
+            self._disconnect(reuse=False)
+            if frames.enhanced:
+                result.sent -= numbered - failed_at
+                if limiter is not None:
+                    # Dropped without blaming a frame, most likely for sending too fast.
+                    limiter.backoff()
+            else:
+                result.sent += failed_at
+            record([pk for pk, token in chunk[:failed_at]])
+            result.failed += 1
+            # Start again from the next device.
+            # We start from the next device since
+            # if the device no longer accepts push notifications from your app
+            # and you send one to it anyways, Apple immediately drops the connection to your APNS socket.
+            # http://stackoverflow.com/a/13332486/1025116
+            # Without an error response we can only guess that the failed device is the first
+            # one in the write during which the connection was dropped.
+            remaining = chunk[failed_at + 1:]
 
-        if notification.pk or notification.persist:
-            notification.last_sent_at = dt_now()
-            notification.save()
+        # The frames of earlier pushes are sent again with their own frames. Their pushes have
+        # finished, so they are no longer counted or recorded.
+        for builder, pairs in itertools.groupby(earlier, lambda pair: pair[0]):
+            pairs = [pair for builder, pair in pairs]
+            builder = builder.copy()
+            while pairs:
+                pairs = self._write_chunk(pairs, builder, PushResult(), lambda pks: None)
+        return remaining
+
+    def _read_lost_frames(self, frames, result, earlier, timeout=0):
+        """
+        Reads Apple's error response about the enhanced frames remembered for the connection.
+
+        The frame it names failed, unless Apple was shutting down, and the frames written after it
+        were discarded. Those frames of the push `frames` belongs to are no longer counted as sent in
+        `result` and are returned to be sent again. Those of earlier pushes are added to `earlier`.
+
+        Returns the error response, the (pk, token) pairs to send again and the identifiers of
+        the frames which were not delivered, or None if the response names no remembered frame.
+        """
+        error = self.read_error_response(timeout)
+        if error is None:
+            return None, [], None
+        status, identifier = error
+        named, lost = self.connection.sent.split(identifier)
+        if named is None:
+            return error, [], None
+        undelivered = set(entry[0] for entry in lost)
+        if status != self.SHUTDOWN:
+            undelivered.add(identifier)
+            if named[3].origin is frames.origin:
+                result.sent -= 1
+                result.failed += 1
+        resend = []
+        for identifier, pk, token, builder in lost:
+            if builder.origin is frames.origin:
+                result.sent -= 1
+                resend.append((pk, token))
+            else:
+                earlier.append((builder, (pk, token)))
+        return error, resend, undelivered
 
     def set_devices_last_notified_at(self, devices):
         # Rather than do a save on every object,
@@ -164,7 +720,11 @@ class APNService(BaseService):
         # Since the devices argument could be a sliced queryset
         # we can't rely on devices.update() even if devices is
         # a queryset object.
-        Device.objects.filter(pk__in=[d.pk for d in devices]).update(last_notified_at=dt_now())
+        self._set_last_notified_at([d.pk for d in devices])
+
+    def _set_last_notified_at(self, pks):
+        if pks:
+            Device.objects.filter(pk__in=pks).update(last_notified_at=dt_now())
 
     def pack_message(self, payload, device):
         """
@@ -175,8 +735,54 @@ class APNService(BaseService):
         if not isinstance(device, Device):
             raise TypeError('device must be an instance of ios_notifications.models.Device')
 
-        msg = struct.pack(self.fmt % len(payload), chr(0), 32, unhexlify(device.token), len(payload), payload)
-        return msg
+        return self._pack_frame(payload, device.get_binary_token())
+
+    def _pack_frame(self, payload, token):
+        return struct.pack(self.fmt % len(payload), chr(0), 32, token, len(payload), payload)
+
+    def pack_enhanced_message(self, payload, device, identifier, expiry=0, priority=10):
+        """
+        Converts a notification payload into the binary form of a command 2 frame.
+        The frame carries an `identifier` which Apple refers to in its error response
+        and an `expiry` as a UNIX timestamp, 0 meaning the notification is not stored
+        if it can not be delivered immediately.
+        """
+        if len(payload) > 256:
+            raise NotificationPayloadSizeExceeded
+        if not isinstance(device, Device):
+            raise TypeError('device must be an instance of ios_notifications.models.Device')
+
+        return self._pack_enhanced_frame(payload, device.get_binary_token(), identifier, expiry, priority)
+
+    def _pack_enhanced_frame(self, payload, token, identifier, expiry=0, priority=10):
+        return struct.pack(self.enhanced_fmt % len(payload), 2, self.enhanced_frame_length + len(payload),
+                           1, 32, token,
+                           2, len(payload), payload,
+                           3, 4, identifier,
+                           4, 4, expiry,
+                           5, 1, priority)
+
+    def read_error_response(self, timeout=0):
+        """
+        Reads the error response Apple writes to the connection before dropping it.
+
+        Returns a (status, identifier) tuple or None if no error response
+        could be read within `timeout` seconds.
+        """
+        try:
+            if not self.connection.pending():
+                readable, _, _ = select.select([self.connection], [], [], timeout)
+                if not readable:
+                    return None
+            data = self.connection.recv(6)
+        except (OpenSSL.SSL.Error, socket.error, select.error):
+            return None
+        if len(data) != 6:
+            return None
+        command, status, identifier = struct.unpack(self.error_response_fmt, data)
+        if command != 8:
+            return None
+        return status, identifier
 
     def __unicode__(self):
         return self.name
@@ -198,11 +804,26 @@ class Notification(models.Model):
     last_sent_at = models.DateTimeField(null=True, blank=True)
     custom_payload = models.CharField(max_length=240, blank=True, help_text='JSON representation of an object containing custom payload.')
     loc_payload = models.CharField(max_length=240, blank=True, help_text="JSON representation of an object containing the localization payload.")
+    expires_at = models.DateTimeField(null=True, blank=True, help_text='Time after which Apple stops trying to deliver the notification. Leave empty to only attempt delivery once.')
+    # The encoded payload, compiled from the fields in PAYLOAD_FIELDS, and a digest of their values.
+    compiled_payload = models.BinaryField(max_length=256, null=True, blank=True)
+    compiled_from = models.CharField(max_length=40, blank=True, editable=False)
+
+    PAYLOAD_FIELDS = ('message', 'badge', 'silent', 'sound', 'custom_payload', 'loc_payload')
 
     def __init__(self, *args, **kwargs):
         self.persist = get_setting('IOS_NOTIFICATIONS_PERSIST_NOTIFICATIONS')
         super(Notification, self).__init__(*args, **kwargs)
 
+    def save(self, *args, **kwargs):
+        if not self.is_valid_length():
+            raise NotificationPayloadSizeExceeded
+        super(Notification, self).save(*args, **kwargs)
+
+    def clean(self):
+        if not self.is_valid_length():
+            raise ValidationError(str(NotificationPayloadSizeExceeded()))
+
     def __unicode__(self):
         return u'%s%s%s' % (self.message, ' ' if self.message and self.custom_payload else '', self.custom_payload)
 
@@ -261,8 +882,48 @@ class Notification(models.Model):
         """
         return len(self.payload) <= 256
 
+    @property
+    def expiry(self):
+        """
+        The expiry of the notification as a UNIX timestamp, as used by the enhanced frame format.
+        """
+        if self.expires_at is None:
+            return 0
+        return calendar.timegm(self.expires_at.utctimetuple())
+
+    @property
+    def priority(self):
+        """
+        Apple requires a priority of 5 for notifications which only
+        contain the content-available key and 10 for any others.
+        """
+        if self.silent and not (self.message or self.loc_payload or self.badge is not None or self.sound):
+            return 5
+        return 10
+
+    def _payload_digest(self):
+        fields = json.dumps([getattr(self, name) for name in self.PAYLOAD_FIELDS])
+        return hashlib.sha1(fields).hexdigest()
+
     @property
     def payload(self):
+        """
+        The encoded payload. It is only compiled again if one of the fields it is compiled
+        from has changed, also when it was changed in the database, e.g. with `QuerySet.update`.
+        """
+        digest = self._payload_digest()
+        if self.compiled_payload is None or self.compiled_from != digest:
+            self.compiled_payload = self.compile_payload()
+            self.compiled_from = digest
+        return bytes(self.compiled_payload)
+
+    def compile_payload(self):
+        return json.dumps(self.payload_message(), separators=(',', ':'), ensure_ascii=False).encode('utf8')
+
+    def payload_message(self):
+        """
+        Returns the payload as a dictionary, before it is encoded.
+        """
         aps = {}
 
         loc_data = self.loc_data
@@ -281,8 +942,63 @@ class Notification(models.Model):
         extra = self.extra
         if extra is not None:
             message.update(extra)
-        payload = json.dumps(message, separators=(',', ':'), ensure_ascii=False).encode('utf8')
-        return payload
+        return message
+
+
+class DeviceManager(models.Manager):
+    # The metadata a device can be registered with.
+    METADATA = ('platform', 'display', 'os_version')
+
+    def bulk_register(self, service, devices, batch_size=500):
+        """
+        Registers many devices of `service` at once. `devices` is a list of dicts with a valid
+        `token` and any of the METADATA keys. New devices are created, existing ones are
+        reactivated and have any metadata given updated, just like registering them one by one.
+
+        Returns a dict mapping each token to a (pk, created) pair.
+
+        Each batch takes one query to find the existing devices, one to reactivate them, one per
+        distinct set of metadata to update and one to create the rest. A device registered
+        concurrently between finding and creating is reactivated instead.
+        """
+        results = {}
+        for start in xrange(0, len(devices), batch_size):
+            results.update(self._register_batch(service, devices[start:start + batch_size]))
+        return results
+
+    def _register_batch(self, service, devices, retry=True):
+        now = dt_now()
+        by_token = dict((device['token'], device) for device in devices)
+        existing = dict(self.filter(service=service, token__in=by_token).values_list('token', 'pk'))
+        results = dict((token, (pk, False)) for token, pk in existing.iteritems())
+        if existing:
+            self.filter(pk__in=existing.values()).update(is_active=True, registered_at=now)
+            updates = {}
+            for token, pk in existing.iteritems():
+                metadata = tuple((key, by_token[token][key]) for key in self.METADATA if key in by_token[token])
+                if metadata:
+                    updates.setdefault(metadata, []).append(pk)
+            for metadata, pks in updates.iteritems():
+                self.filter(pk__in=pks).update(**dict(metadata))
+
+        new = [self.model(token=token, binary_token=token_to_binary(token), service=service,
+                          is_active=True, registered_at=now,
+                          **dict((key, device[key]) for key in self.METADATA if key in device))
+               for token, device in by_token.iteritems() if token not in existing]
+        if not new:
+            return results
+        try:
+            with transaction.atomic():
+                self.bulk_create(new)
+        except IntegrityError:
+            if not retry:
+                raise
+            # Some of the devices were registered since they were looked up.
+            results.update(self._register_batch(service, [by_token[device.token] for device in new], retry=False))
+            return results
+        created = self.filter(service=service, token__in=[device.token for device in new]).values_list('token', 'pk')
+        results.update((token, (pk, True)) for token, pk in created)
+        return results
 
 
 class Device(models.Model):
@@ -299,6 +1015,26 @@ class Device(models.Model):
     platform = models.CharField(max_length=30, blank=True, null=True)
     display = models.CharField(max_length=30, blank=True, null=True)
     os_version = models.CharField(max_length=20, blank=True, null=True)
+    # The token in its 32 byte binary form, as written to APNs. Kept in sync with `token` on save.
+    binary_token = models.BinaryField(max_length=32, null=True, blank=True)
+    # When the app last registered the device. Feedback from before then is ignored.
+    registered_at = models.DateTimeField(null=True, blank=True)
+
+    objects = DeviceManager()
+
+    def save(self, *args, **kwargs):
+        self.binary_token = token_to_binary(self.token)
+        if self.registered_at is None:
+            self.registered_at = dt_now()
+        super(Device, self).save(*args, **kwargs)
+
+    def get_binary_token(self):
+        """
+        Returns the token in binary form, decoding the hex token if it has not been stored.
+        """
+        if self.binary_token is not None:
+            return bytes(self.binary_token)
+        return unhexlify(self.token)
 
     def push_notification(self, notification):
         """
@@ -330,6 +1066,14 @@ class FeedbackService(BaseService):
     PORT = 2196
 
     fmt = '!lh32s'
+    record = struct.Struct(fmt)
+    read_size = 16384  # Bytes read from the connection at a time.
+    deactivate_batch_size = 500  # Devices deactivated per query.
+    received = 0  # The number of feedback tuples received by the last call.
+
+    def _context_key(self):
+        # The feedback service authenticates with the APN service's certificate.
+        return self.apn_service_id
 
     def _connect(self):
         """
@@ -337,31 +1081,198 @@ class FeedbackService(BaseService):
         """
         return super(FeedbackService, self)._connect(self.apn_service.certificate, self.apn_service.private_key, self.apn_service.passphrase)
 
-    def call(self):
+    def read_feedback(self):
         """
-        Calls the feedback service and deactivates any devices the feedback service mentions.
+        Connects to the feedback service and yields a (timestamp, token) pair
+        for each device it mentions as the feedback is received.
         """
         self._connect()
-        device_tokens = []
         try:
-            while True:
-                data = self.connection.recv(38)  # 38 being the length in bytes of the binary format feedback tuple.
-                if len(data) == 0:
-                    raise OpenSSL.SSL.ZeroReturnError()
-                timestamp, token_length, token = struct.unpack(self.fmt, data)
-                device_token = hexlify(token)
-                device_tokens.append(device_token)
-        except OpenSSL.SSL.ZeroReturnError:
-            # Nothing to receive
-            pass
+            for timestamp, token_length, token in read_records(self.connection, self.record, self.read_size):
+                yield timestamp, hexlify(token)
         finally:
             self._disconnect()
-        devices = Device.objects.filter(token__in=device_tokens, service=self.apn_service)
-        devices.update(is_active=False, deactivated_at=dt_now())
-        return devices.count()
+
+    def call(self):
+        """
+        Calls the feedback service and deactivates any devices the feedback service mentions.
+        Devices are deactivated in batches as the feedback is received. Devices which were
+        registered again after the time of their feedback are left active.
+
+        Returns the number of devices deactivated.
+        """
+        deactivated = 0
+        self.received = 0
+        batch = {}  # Maps a token to the time of its latest feedback.
+        for timestamp, token in self.read_feedback():
+            self.received += 1
+            batch[token] = max(batch.get(token, 0), timestamp)
+            if len(batch) == self.deactivate_batch_size:
+                deactivated += self._deactivate(batch)
+                batch = {}
+        return deactivated + self._deactivate(batch)
+
+    def _deactivate(self, feedback):
+        """
+        Deactivates the active devices with the tokens in `feedback` which were registered
+        before the time of their feedback. Returns the number of devices deactivated.
+        """
+        if not feedback:
+            return 0
+        devices = Device.objects.filter(service=self.apn_service, token__in=feedback.keys(), is_active=True)
+        pks = [pk for pk, token, registered_at in devices.values_list('pk', 'token', 'registered_at')
+               if registered_at is None or registered_at <= feedback_time(feedback[token])]
+        if not pks:
+            return 0
+        # Devices registered again since they were fetched are newer than any of the feedback.
+        latest = feedback_time(max(feedback.values()))
+        return devices.filter(Q(registered_at__isnull=True) | Q(registered_at__lte=latest), pk__in=pks) \
+            .update(is_active=False, deactivated_at=dt_now())
 
     def __unicode__(self):
         return self.name
 
     class Meta:
         unique_together = ('name', 'hostname')
+
+
+class PushJobManager(models.Manager):
+    def claim(self):
+        """
+        Claims the oldest queued job for the calling worker by marking it as running.
+        Jobs queued again because their service was unavailable are skipped until their retry_at.
+        Running jobs which have not been checkpointed for IOS_NOTIFICATIONS_PUSH_JOB_TIMEOUT
+        seconds are assumed to have crashed and are claimed again.
+        Returns None if there are no jobs to claim.
+
+        Any number of workers can claim jobs at once, each job is only claimed by one of them.
+        """
+        now = dt_now()
+        stale = now - datetime.timedelta(seconds=get_setting('IOS_NOTIFICATIONS_PUSH_JOB_TIMEOUT'))
+        due = Q(retry_at__isnull=True) | Q(retry_at__lte=now)
+        claimable = (Q(status=PushJob.QUEUED) & due) | Q(status=PushJob.RUNNING, checkpointed_at__lt=stale)
+        jobs = self.filter(claimable).order_by('pk')
+        if django.VERSION >= (1, 11) and connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                job = jobs.select_for_update(skip_locked=True).first()
+                if job is not None:
+                    job.status = PushJob.RUNNING
+                    job.started_at = job.checkpointed_at = now
+                    job.save(update_fields=['status', 'started_at', 'checkpointed_at'])
+                return job
+        # Without SKIP LOCKED a job is claimed by the worker whose conditional update changes its status.
+        for pk in jobs.values_list('pk', flat=True)[:10]:
+            if self.filter(claimable, pk=pk).update(status=PushJob.RUNNING, started_at=now, checkpointed_at=now):
+                return self.get(pk=pk)
+        return None
+
+
+class PushJob(models.Model):
+    """
+    A notification waiting to be pushed by a worker.
+    Jobs are run by the run_push_worker management command.
+
+    If `all_devices` is set the notification is pushed to all active devices of its service,
+    otherwise only to `devices`, so a job whose devices have all been deleted pushes to nobody.
+
+    Progress is checkpointed after every chunk, so a job which crashed or ran out of
+    time is resumed from the last device it was sent to instead of starting over.
+    A job whose service is unavailable is queued again to be retried at `retry_at`,
+    leaving the workers to the jobs of other services in the meantime.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    notification = models.ForeignKey(Notification)
+    devices = models.ManyToManyField(Device, blank=True)
+    all_devices = models.BooleanField(default=False,
+                                      help_text='Whether the notification is pushed to every device of its service.')
+    chunk_size = models.PositiveIntegerField(default=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    last_device_pk = models.PositiveIntegerField(null=True, blank=True,
+                                                 help_text='The last device the notification was sent to.')
+    checkpointed_at = models.DateTimeField(null=True, blank=True)
+    retry_at = models.DateTimeField(null=True, blank=True,
+                                    help_text='When a job queued again because its service was unavailable is retried.')
+
+    objects = PushJobManager()
+
+    def run(self, time_limit=None):
+        """
+        Pushes the notification and records the outcome.
+
+        If `time_limit` is given the job stops after the first chunk which finishes more than
+        `time_limit` seconds after it started and is queued again to be resumed later.
+        """
+        deadline = None if time_limit is None else time.time() + time_limit
+        sent, failed = self.sent, self.failed
+        stopped = []
+
+        def checkpoint(last_device_pk, result):
+            self.last_device_pk = last_device_pk
+            self.sent = sent + result.sent
+            self.failed = failed + result.failed
+            self.checkpointed_at = dt_now()
+            PushJob.objects.filter(pk=self.pk).update(last_device_pk=self.last_device_pk, sent=self.sent,
+                                                      failed=self.failed, checkpointed_at=self.checkpointed_at)
+            if deadline is not None and time.time() >= deadline:
+                stopped.append(True)
+                return False
+
+        service = self.notification.service
+        devices = service.device_set.all() if self.all_devices else self.devices.all()
+        if self.last_device_pk is not None:
+            devices = devices.filter(pk__gt=self.last_device_pk)
+        try:
+            result = service._write_message(self.notification, devices, self.chunk_size, checkpoint=checkpoint)
+        except ServiceUnavailable as e:
+            self.status = self.QUEUED
+            self.error = unicode(e)
+            self.retry_at = dt_now() + datetime.timedelta(seconds=e.retry_after or 0)
+            self.save()
+            return
+        except Exception as e:
+            self.status = self.FAILED
+            self.error = unicode(e)
+        else:
+            self.sent = sent + result.sent
+            self.failed = failed + result.failed
+            if stopped:
+                self.status = self.QUEUED
+                self.save()
+                return
+            self.status = self.DONE
+        self.finished_at = dt_now()
+        self.save()
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.notification, self.status)
+
+
+@receiver(post_save, sender=APNService)
+@receiver(post_delete, sender=APNService)
+def close_apn_service_connections(sender, instance, **kwargs):
+    """
+    Pooled connections and the cached SSL context were created with the service's
+    previous credentials and hostname, so they are discarded whenever the service changes.
+    """
+    instance.close_connections()
+    clear_context(instance.pk)
+    # New credentials or a new hostname deserve a fresh attempt.
+    clear_breaker(instance._pool_key())
+    for pk in FeedbackService.objects.filter(apn_service=instance).values_list('pk', flat=True):
+        clear_breaker((FeedbackService.__name__, pk))
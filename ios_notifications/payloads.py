@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import json
+from collections import OrderedDict
+
+from .exceptions import NotificationPayloadSizeExceeded
+
+MAX_PAYLOAD_SIZE = 256
+
+# Slots which are filled in inside the aps dictionary. Any other slot is a custom key of the payload.
+BADGE = 'badge'
+LOC_ARGS = 'loc-args'
+
+
+def encode(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf8')
+
+
+def last(obj, keys):
+    """
+    Returns the dict as an OrderedDict with `keys` at its end.
+    """
+    items = [(key, value) for key, value in obj.items() if key not in keys]
+    return OrderedDict(items + [(key, obj[key]) for key in keys if key in obj])
+
+
+class PayloadTemplate(object):
+    """
+    A notification's payload with slots whose values differ per device, e.g. its badge.
+
+    The payload is encoded once with a marker in place of each slot and split at the keys of the slots,
+    so a device's payload is rendered by joining the invariant segments with the encoded keys and values
+    of its slots. A slot without a value, like a badge the notification does not have, is left out of
+    the payload rather than rendered as null. The slots are encoded after the other keys of their
+    dictionary, so each is preceded by either another key, which a comma separates it from, or the
+    opening brace. Its size is at least the size of the segments plus the size of those keys and values,
+    which lets most payloads that are too long be rejected without joining them.
+
+    `slots` can include 'badge', 'loc-args' (which requires the notification to have loc data)
+    and the names of custom payload keys. A device without a value for a slot gets the notification's own.
+    """
+    def __init__(self, notification, slots):
+        self.slots = []
+        self.keys = []
+        message = notification.payload_message()
+        markers = {}
+        custom = []
+        for i, slot in enumerate(slots):
+            marker = u'\ufdd0%d\ufdd0' % i  # Noncharacters, which do not occur in payloads.
+            if slot == BADGE:
+                message['aps'][BADGE] = marker
+            elif slot == LOC_ARGS:
+                if not isinstance(message['aps'].get('alert'), dict):
+                    raise ValueError('The loc-args slot requires a notification with loc data.')
+                message['aps']['alert'] = last(dict(message['aps']['alert'], **{LOC_ARGS: marker}), [LOC_ARGS])
+            else:
+                message[slot] = marker
+                custom.append(slot)
+            markers[encode(slot) + ':' + encode(marker)] = slot
+        message['aps'] = last(message['aps'], [BADGE])
+        message = last(message, custom)
+        self.defaults = notification.payload_message()
+        payload = encode(message)
+        # Split the payload at the keys of the slots, in the order they appear in,
+        # leaving out the commas before them which are added back as the slots are rendered.
+        positions = sorted((payload.index(member), member) for member in markers)
+        self.segments = []
+        start = 0
+        for position, member in positions:
+            end = position - 1 if payload[position - 1] == ',' else position
+            self.segments.append(payload[start:end])
+            slot = markers[member]
+            self.slots.append(slot)
+            self.keys.append(encode(slot) + ':')
+            start = position + len(member)
+        self.segments.append(payload[start:])
+        self.size = sum(len(segment) for segment in self.segments)
+
+    def default(self, slot):
+        if slot == BADGE:
+            return self.defaults['aps'].get(BADGE)
+        if slot == LOC_ARGS:
+            return self.defaults['aps']['alert'].get(LOC_ARGS)
+        return self.defaults.get(slot)
+
+    def render(self, values):
+        """
+        Returns the payload with the slots filled in from the dict `values`.
+        Raises NotificationPayloadSizeExceeded if it is longer than Apple allows.
+        """
+        encoded = []
+        for slot, key in zip(self.slots, self.keys):
+            value = values[slot] if slot in values else self.default(slot)
+            encoded.append(None if value is None else key + encode(value))
+        if self.size + sum(len(value) for value in encoded if value is not None) > MAX_PAYLOAD_SIZE:
+            raise NotificationPayloadSizeExceeded
+        parts = [self.segments[0]]
+        for value, segment in zip(encoded, self.segments[1:]):
+            if value is not None:
+                # A value which is not the first key of its dictionary follows a comma.
+                if not parts[-1].endswith('{'):
+                    parts.append(',')
+                parts.append(value)
+            if segment:
+                parts.append(segment)
+        payload = ''.join(parts)
+        if len(payload) > MAX_PAYLOAD_SIZE:
+            raise NotificationPayloadSizeExceeded
+        return payload
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import select
+import socket
+import threading
+import time
+
+import OpenSSL
+
+from .settings import get_setting
+
+
+def is_alive(connection):
+    """
+    Determines whether an idle connection can still be written to.
+
+    APNs never sends anything on a healthy connection. If the socket is readable
+    Apple has either written an error response or closed the connection, and in
+    both cases the connection is about to be (or already is) dropped.
+    """
+    try:
+        if connection.pending():
+            return False
+        readable, _, _ = select.select([connection], [], [], 0)
+    except (OpenSSL.SSL.Error, socket.error, select.error, ValueError):
+        return False
+    return not readable
+
+
+def close_connection(connection):
+    """
+    Closes an SSL connection, ignoring any errors raised by a connection
+    which has already been dropped by the remote end.
+    """
+    try:
+        connection.shutdown()
+    except (OpenSSL.SSL.Error, socket.error):
+        pass
+    try:
+        connection.close()
+    except (OpenSSL.SSL.Error, socket.error):
+        pass
+
+
+class ConnectionPool(object):
+    """
+    A pool of open SSL connections to a single service.
+
+    Connections are returned to the pool after use and handed out again on the
+    next call to `acquire`, so the TCP and TLS handshakes are only paid for when
+    a connection is first opened or after the remote end has dropped it.
+
+    `check` tells whether an idle connection can be reused and `close` closes a connection.
+    """
+    def __init__(self, factory, max_size=4, idle_timeout=300, check=is_alive, close=close_connection):
+        self.factory = factory
+        self.check = check
+        self.close_connection = close
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.closed = False
+        self.version = None  # See get_pool.
+        self._idle = []  # (connection, released_at) pairs. The most recently released is last.
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, fresh=False):
+        """
+        Returns a healthy idle connection or opens a new one.
+        Blocks while `max_size` connections are checked out.
+
+        If `fresh` is True a new connection is opened and the idle connections are closed,
+        e.g. after one of them turned out to have been closed by the remote end.
+        """
+        with self._condition:
+            while True:
+                while self._idle:
+                    connection, released_at = self._idle.pop()
+                    if fresh or time.time() - released_at > self.idle_timeout or not self.check(connection):
+                        self.close_connection(connection)
+                        continue
+                    self._in_use += 1
+                    return connection
+                if self._in_use < self.max_size:
+                    self._in_use += 1
+                    break
+                self._condition.wait()
+        try:
+            return self.factory()
+        except:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, connection):
+        """
+        Returns a connection to the pool so it can be reused.
+        """
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify()
+            if not self.closed:
+                self._idle.append((connection, time.time()))
+                return
+        self.close_connection(connection)
+
+    def discard(self, connection):
+        """
+        Closes a connection which should not be reused,
+        e.g. after it was dropped by the remote end.
+        """
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify()
+        self.close_connection(connection)
+
+    def close(self):
+        """
+        Closes all idle connections. Connections which are checked out
+        are closed when they are released.
+        """
+        with self._condition:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for connection, released_at in idle:
+            self.close_connection(connection)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, factory, version=None, **kwargs):
+    """
+    Returns the process-wide connection pool for `key`,
+    creating it with `factory` if it does not exist yet.
+    Any keyword arguments are passed on to ConnectionPool.
+
+    `version` identifies what the pool's connections are opened with, e.g. the service's
+    hostname and certificate. If it differs from the version the pool was created with the
+    pool is closed and replaced by one using `factory`, so a process which did not see the
+    service change does not keep connecting with its previous credentials.
+    """
+    stale = None
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and version is not None and pool.version != version:
+            stale, pool = pool, None
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(factory,
+                                                get_setting('IOS_NOTIFICATIONS_CONNECTION_POOL_SIZE'),
+                                                get_setting('IOS_NOTIFICATIONS_CONNECTION_IDLE_TIMEOUT'),
+                                                **kwargs)
+            pool.version = version
+    if stale is not None:
+        stale.close()
+    return pool
+
+
+def clear_pool(key):
+    """
+    Closes and forgets the connection pool for `key`.
+    """
+    with _pools_lock:
+        pool = _pools.pop(key, None)
+    if pool is not None:
+        pool.close()
+
+
+def reset_pools():
+    """
+    Forgets all connection pools without closing their connections.
+    Used in forked processes, where the pooled connections belong to the parent.
+    """
+    with _pools_lock:
+        _pools.clear()
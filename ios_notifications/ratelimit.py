@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import math
+import time
+
+try:
+    from django.core.cache import caches
+    get_cache = caches.__getitem__
+except ImportError:
+    # Django < 1.7
+    from django.core.cache import get_cache
+
+from .settings import get_setting
+
+
+class RateLimiter(object):
+    """
+    Limits the frames and bytes per second written to an APN service by every process sending to it.
+
+    Time is divided into windows of `window` seconds, each allowing a window's share of the
+    per second limits. Writers count what they write against the current window with atomic
+    cache increments, so processes sharing the IOS_NOTIFICATIONS_RATE_LIMIT_CACHE (e.g.
+    memcached or redis) share the limits. A write which does not fit waits for the next window.
+    A write larger than a window's share, e.g. a whole buffer of frames, is let into an empty
+    window and counted as debt against the windows after it, like a token bucket allowed
+    to go below empty, so large writes do not let the rate exceed the limits.
+
+    The limits are scaled by a factor, also kept in the cache, which `backoff` halves when
+    Apple drops a connection and `recover` raises step by step after successful writes, so
+    the rate settles just below what Apple sustains instead of swinging between extremes.
+    """
+    window = 0.1  # Seconds.
+    min_factor = 0.05  # The lowest fraction of the limits backing off goes down to.
+    recovery = 0.02  # The fraction of the limits added back per successful write.
+
+    def __init__(self, key, frames_per_second=None, bytes_per_second=None, cache=None):
+        self.key = 'ios_notifications:rate:%s' % key
+        self.frames_per_second = frames_per_second
+        self.bytes_per_second = bytes_per_second
+        self.cache = cache or get_cache(get_setting('IOS_NOTIFICATIONS_RATE_LIMIT_CACHE'))
+
+    @property
+    def factor(self):
+        return self.cache.get(self.key + ':factor', 1.0)
+
+    def backoff(self):
+        """
+        Halves the rate after Apple dropped or reset a connection.
+        """
+        self.cache.set(self.key + ':factor', max(self.min_factor, self.factor / 2), None)
+
+    def recover(self):
+        """
+        Raises the rate a step back towards the limits after a successful write.
+        """
+        factor = self.factor
+        if factor < 1.0:
+            self.cache.set(self.key + ':factor', min(1.0, factor + self.recovery), None)
+
+    def _take(self, name, window, amount, limit):
+        """
+        Counts `amount` against the window. Returns None, without counting it, if it would exceed
+        the limit, or else how much over the limit the window now is. A window always allows one
+        write, however large, so that writes larger than a window's share still get through;
+        `_carry` counts what they exceed the share by against the following windows.
+        """
+        key = '%s:%s:%d' % (self.key, name, window)
+        used = self._incr(key, amount, 10)
+        if used > limit and used != amount:
+            self.cache.decr(key, amount)
+            return None
+        return max(0, int(math.ceil(used - limit)))
+
+    def _carry(self, name, window, excess, limit):
+        """
+        Counts `excess` against the windows after `window`, a window's share each,
+        so a large write delays later ones and the rate averages out to the limit.
+        """
+        share = max(1, int(limit))
+        while excess > 0:
+            window += 1
+            amount = min(share, excess)
+            self._incr('%s:%s:%d' % (self.key, name, window), amount, 10 + int(excess / share * self.window))
+            excess -= amount
+
+    def _incr(self, key, amount, timeout):
+        self.cache.add(key, 0, timeout)
+        try:
+            return self.cache.incr(key, amount)
+        except ValueError:
+            # The window expired in between.
+            self.cache.add(key, amount, timeout)
+            return amount
+
+    def acquire(self, frames, size):
+        """
+        Waits until `frames` frames of `size` bytes in total can be written.
+        """
+        while True:
+            now = time.time()
+            window = int(now / self.window)
+            factor = self.factor
+            if self._fits(window, factor, frames, size):
+                return
+            time.sleep((window + 1) * self.window - now)
+
+    def _fits(self, window, factor, frames, size):
+        frames_limit = self.frames_per_second and self.frames_per_second * self.window * factor
+        bytes_limit = self.bytes_per_second and self.bytes_per_second * self.window * factor
+        frames_excess = bytes_excess = 0
+        if frames_limit:
+            frames_excess = self._take('frames', window, frames, frames_limit)
+            if frames_excess is None:
+                return False
+        if bytes_limit:
+            bytes_excess = self._take('bytes', window, size, bytes_limit)
+            if bytes_excess is None:
+                if frames_limit:
+                    # Give back the frames counted above.
+                    self.cache.decr('%s:frames:%d' % (self.key, window), frames)
+                return False
+        if frames_excess:
+            self._carry('frames', window, frames_excess, frames_limit)
+        if bytes_excess:
+            self._carry('bytes', window, bytes_excess, bytes_limit)
+        return True
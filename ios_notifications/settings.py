@@ -12,6 +12,80 @@ defaults = {
             # Expected values: one of 'AuthNone', 'AuthBasic', 'AuthBasicIsStaff'.
             # This setting MUST be set for the API to be usable.
             'IOS_NOTIFICATIONS_AUTHENTICATION': None,
+
+            # Number of seconds a verified AuthBasic Authorization header is remembered for, so repeated requests
+            # with it skip hashing the password. It is forgotten as soon as the user's password or is_staff changes.
+            # Expected values: a number of seconds, 0 to verify the password on every request.
+            'IOS_NOTIFICATIONS_AUTHENTICATION_CACHE_TIMEOUT': 60,
+
+            # Maximum number of open connections kept per APN service.
+            # Expected values: a positive integer.
+            'IOS_NOTIFICATIONS_CONNECTION_POOL_SIZE': 4,
+
+            # Number of seconds an unused connection is kept open before it is closed and replaced.
+            # Expected values: a positive number.
+            'IOS_NOTIFICATIONS_CONNECTION_IDLE_TIMEOUT': 300,
+
+            # Whether notifications are sent as enhanced (command 2) frames carrying an identifier and expiry.
+            # Expected values: True, False.
+            'IOS_NOTIFICATIONS_ENHANCED_FORMAT': False,
+
+            # Number of bytes of frames buffered before they are written to the connection in a single write.
+            # Expected values: a positive integer.
+            'IOS_NOTIFICATIONS_WRITE_BUFFER_SIZE': 16384,
+
+            # How notifications are written to the APN service connections.
+            # Expected values: 'blocking' for one connection at a time, 'pipelined' to fetch and update devices
+            # in other threads while writing, 'gevent' for IOS_NOTIFICATIONS_CONNECTION_POOL_SIZE connections
+            # at once (requires gevent and gevent_openssl).
+            'IOS_NOTIFICATIONS_ENGINE': 'blocking',
+
+            # Whether notifications pushed from the admin are queued for the run_push_worker command
+            # instead of being pushed during the request.
+            # Expected values: True, False.
+            'IOS_NOTIFICATIONS_QUEUE_PUSHES': False,
+
+            # Number of seconds a running push job can go without checkpointing its progress
+            # before it is assumed to have crashed and is resumed by another worker.
+            # Expected values: a positive number.
+            'IOS_NOTIFICATIONS_PUSH_JOB_TIMEOUT': 600,
+
+            # How Device.last_notified_at is updated during a push.
+            # Expected values: 'ids' to update each write's devices by pk, 'range' to update them by pk range,
+            # 'deferred' to update the pk ranges together at the end of the push, 'off' to not update it.
+            'IOS_NOTIFICATIONS_LAST_NOTIFIED_AT': 'ids',
+
+            # Maximum number of requests in flight at once on an HTTP/2 connection.
+            # Expected values: a positive integer.
+            'IOS_NOTIFICATIONS_HTTP2_MAX_STREAMS': 100,
+
+            # Number of seconds a provider authentication token is used for before a new one is signed.
+            # Apple rejects tokens older than an hour and tokens replaced more often than every 20 minutes.
+            # Expected values: a number between 1200 and 3600.
+            'IOS_NOTIFICATIONS_PROVIDER_TOKEN_LIFETIME': 3000,
+
+            # The cache which the rate limits of APN services are counted in. It must be shared by
+            # every process sending notifications, e.g. memcached or redis, for the limits to be shared.
+            # Expected values: an alias in CACHES.
+            'IOS_NOTIFICATIONS_RATE_LIMIT_CACHE': 'default',
+
+            # Number of times a failed connection attempt to an APN or feedback service is retried.
+            # Expected values: an integer, 0 to not retry.
+            'IOS_NOTIFICATIONS_CONNECT_RETRIES': 3,
+
+            # Seconds the wait before retrying a connection is based on. The wait is random, up to this
+            # doubled for every failed attempt so far.
+            # Expected values: a positive number.
+            'IOS_NOTIFICATIONS_CONNECT_BACKOFF': 0.5,
+
+            # Number of connects to a service, each after its retries, which fail in a row before
+            # connecting is not tried again for IOS_NOTIFICATIONS_CIRCUIT_BREAKER_TIMEOUT seconds.
+            # Expected values: a positive integer.
+            'IOS_NOTIFICATIONS_CIRCUIT_BREAKER_THRESHOLD': 3,
+
+            # Seconds a service which keeps failing to connect is given before a single connection is tried again.
+            # Expected values: a positive number.
+            'IOS_NOTIFICATIONS_CIRCUIT_BREAKER_TIMEOUT': 30,
             }
 
 def get_setting(name):
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+
+from django.db import connections
+from django.db.models import Min, Max
+
+from .pool import reset_pools
+
+# Database connections inherited from the parent process. They are kept referenced
+# so they are never closed (and torn down on the server) by a worker process.
+_inherited_connections = []
+
+
+def shard_ranges(min_pk, max_pk, shards):
+    """
+    Splits the primary key range [min_pk, max_pk] into at most `shards`
+    contiguous (start, end) ranges, `start` inclusive and `end` exclusive.
+    """
+    if min_pk is None or max_pk is None:
+        return []
+    size = (max_pk - min_pk + shards) // shards
+    return [(start, min(start + size, max_pk + 1)) for start in xrange(min_pk, max_pk + 1, size)]
+
+
+def init_worker():
+    """
+    Prepares a forked worker process. Database and APNs connections belong to
+    the parent process, so the worker forgets them and opens its own.
+    """
+    for connection in connections.all():
+        _inherited_connections.append(connection.connection)
+        connection.connection = None
+    reset_pools()
+
+
+def push_shard(args):
+    """
+    Sends the frames in `frames` to the devices of a shard and returns its PushResult.
+    """
+    from .models import APNService, Device
+
+    service_pk, frames, query, start, end, chunk_size, engine = args
+    service = APNService.objects.get(pk=service_pk)
+    devices = Device.objects.all()
+    devices.query = query
+    try:
+        return service._send(frames, devices.filter(pk__gte=start, pk__lt=end), chunk_size, engine)
+    finally:
+        service.close_connections()
+
+
+def push_in_processes(service, frames, devices, chunk_size, workers, engine='blocking'):
+    """
+    Splits the active devices in `devices` into shards by primary key and sends
+    each shard from its own process over its own connection.
+    Returns the PushResult of all shards combined.
+    """
+    from .models import PushResult
+
+    bounds = devices.filter(is_active=True).aggregate(min_pk=Min('pk'), max_pk=Max('pk'))
+    args = [(service.pk, frames, devices.query, start, end, chunk_size, engine)
+            for start, end in shard_ranges(bounds['min_pk'], bounds['max_pk'], workers)]
+    if not args:
+        return PushResult()
+    pool = multiprocessing.Pool(len(args), init_worker)
+    try:
+        results = pool.map(push_shard, args)
+    finally:
+        pool.close()
+        pool.join()
+    return sum(results, PushResult())
+
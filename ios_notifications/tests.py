@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
+import base64
 import subprocess
 import struct
 import os
 import json
 import uuid
 import StringIO
+import datetime
+import socket
+import errno
+import threading
+import time
+from binascii import unhexlify
+from unittest import skipUnless
 
 import django
-from django.test import TestCase
+import OpenSSL
+from django.test import TestCase, TransactionTestCase
 
 try:
     from django.test.utils import override_settings
@@ -18,19 +27,41 @@ from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.http import HttpResponseNotAllowed
-from django.core import management
+from django.core import management, serializers
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.timezone import utc
 
 try:
     from django.utils.timezone import now as dt_now
 except ImportError:
-    import datetime
     dt_now = datetime.datetime.now
 
-from .models import APNService, Device, Notification, NotificationPayloadSizeExceeded
-from .http import JSONResponse
+from .models import APNService, Device, Notification, FeedbackService, PushResult, PushJob, NotificationPayloadSizeExceeded
+from .http import JSONResponse, StreamingJSONResponse
 from .utils import generate_cert_and_pkey
 from .forms import APNServiceForm
 from .settings import get_setting
+from .pool import get_pool
+from .contexts import get_context
+from .shards import shard_ranges, push_shard
+from .tracking import get_tracker
+from .engines import send_pipelined, send_with_gevent
+from .feedback import iter_unpack, read_records, feedback_time
+from . import http2
+from .http2 import HYPER, get_provider_token, sign_provider_token, get_http2_pool
+from .decorators import clear_verified
+from .payloads import PayloadTemplate
+from .frames import FrameConnection
+from .ratelimit import RateLimiter, get_cache
+from .breakers import CircuitBreaker, retry_with_backoff, get_breaker, clear_breaker
+from .exceptions import InvalidPassPhrase, ServiceUnavailable
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    pass
 
 TOKEN = '0fd12510cfe6b0a4a89dc7369c96df956f991e66131dab63398734e8000d0029'
 TEST_PEM = os.path.abspath(os.path.join(os.path.dirname(__file__), 'test.pem'))
@@ -38,6 +69,81 @@ TEST_PEM = os.path.abspath(os.path.join(os.path.dirname(__file__), 'test.pem'))
 SSL_SERVER_COMMAND = ('openssl', 's_server', '-accept', '2195', '-cert', TEST_PEM)
 
 
+def generate_signing_key():
+    """
+    Returns a new P-256 private key in the PKCS #8 PEM format of the signing keys Apple issues.
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                             serialization.NoEncryption())
+
+
+class HTTP2Server(threading.Thread):
+    """
+    A local stand-in for the APNs provider API. Accepts `connections` plain text HTTP/2 connections one
+    after another and answers every request with 200, with 410 for the device tokens in `unregistered`,
+    with 429 the first time a token in `throttled` is sent and with 403 for the authorization headers in
+    `expired`. A connection is closed after answering `requests_per_connection` requests.
+    """
+    def __init__(self, unregistered=(), throttled=(), expired=(), connections=1, requests_per_connection=None):
+        super(HTTP2Server, self).__init__()
+        self.daemon = True
+        self.unregistered = set(unregistered)
+        self.throttled = set(throttled)
+        self.expired = set(expired)
+        self.connections = connections
+        self.requests_per_connection = requests_per_connection
+        self.requests = []  # The headers of each request received.
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(1)
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        for i in xrange(self.connections):
+            self.serve(self.sock.accept()[0])
+        self.sock.close()
+
+    def serve(self, connection):
+        h2_connection = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        h2_connection.initiate_connection()
+        connection.sendall(h2_connection.data_to_send())
+        headers = {}
+        answered = 0
+        while answered != self.requests_per_connection:
+            data = connection.recv(65535)
+            if not data:
+                break
+            for event in h2_connection.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    headers[event.stream_id] = dict(event.headers)
+                elif isinstance(event, h2.events.StreamEnded):
+                    self.respond(h2_connection, event.stream_id, headers.pop(event.stream_id))
+                    answered += 1
+            connection.sendall(h2_connection.data_to_send())
+        connection.close()
+
+    def respond(self, h2_connection, stream_id, headers):
+        self.requests.append(headers)
+        token = headers[':path'].split('/')[-1]
+        if token in self.unregistered:
+            status, reason = 410, 'Unregistered'
+        elif token in self.throttled:
+            self.throttled.remove(token)
+            status, reason = 429, 'TooManyRequests'
+        elif headers.get('authorization') in self.expired:
+            status, reason = 403, 'ExpiredProviderToken'
+        else:
+            h2_connection.send_headers(stream_id, [(':status', '200'), ('content-length', '0')], end_stream=True)
+            return
+        body = json.dumps({'reason': reason})
+        h2_connection.send_headers(stream_id, [(':status', str(status)), ('content-length', str(len(body)))])
+        h2_connection.send_data(stream_id, body, end_stream=True)
+
+
 class UseMockSSLServerMixin(object):
     @classmethod
     def setUpClass(cls):
@@ -92,6 +198,23 @@ class APNServiceTest(UseMockSSLServerMixin, TestCase):
         self.assertFalse(form.is_valid())
         self.assertTrue('passphrase' in form.errors)
 
+    def test_create_with_token_authentication(self):
+        form = APNServiceForm({'name': 'test', 'hostname': 'localhost', 'transport': APNService.HTTP2,
+                               'auth_key': generate_signing_key(), 'team_id': 'TEAM123456', 'key_id': 'KEY1234567',
+                               'topic': 'com.example.app'})
+        self.assertTrue(form.is_valid())
+
+    def test_create_with_token_authentication_requires_key_details(self):
+        form = APNServiceForm({'name': 'test', 'hostname': 'localhost', 'transport': APNService.BINARY,
+                               'auth_key': generate_signing_key()})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(set(['transport', 'team_id', 'key_id', 'topic']), set(form.errors))
+
+    def test_create_without_certificate(self):
+        form = APNServiceForm({'name': 'test', 'hostname': 'localhost'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(set(['certificate', 'private_key']), set(form.errors))
+
     def test_pushing_notification_in_chunks(self):
         devices = []
         for i in xrange(10):
@@ -106,6 +229,802 @@ class APNServiceTest(UseMockSSLServerMixin, TestCase):
                           Device.objects.filter(last_notified_at__gte=started_at).count())
 
 
+    def test_connection_reused_between_pushes(self):
+        self.service.push_notification_to_devices(self.notification, [self.device])
+        pool = get_pool(self.service._pool_key(), None)
+        self.assertEqual(len(pool._idle), 1)
+        connection = pool._idle[0][0]
+        self.service.push_notification_to_devices(self.notification, [self.device])
+        self.assertEqual(len(pool._idle), 1)
+        self.assertTrue(pool._idle[0][0] is connection)
+
+    def test_expired_idle_connection_is_replaced(self):
+        self.service.push_notification_to_devices(self.notification, [self.device])
+        pool = get_pool(self.service._pool_key(), None)
+        connection = pool._idle[0][0]
+        pool.idle_timeout = -1
+        self.service.push_notification_to_devices(self.notification, [self.device])
+        self.assertEqual(len(pool._idle), 1)
+        self.assertFalse(pool._idle[0][0] is connection)
+
+    def test_pool_replaced_when_certificate_changes_elsewhere(self):
+        self.service.push_notification_to_devices(self.notification, [self.device])
+        pool = get_pool(self.service._pool_key(), None)
+        # Changed by another process, so the post_save signal does not clear the pool here.
+        cert, key = generate_cert_and_pkey()
+        APNService.objects.filter(pk=self.service.pk).update(certificate=cert, private_key=key)
+        service = APNService.objects.get(pk=self.service.pk)
+        service.push_notification_to_devices(self.notification, [self.device])
+        self.assertTrue(pool.closed)
+        self.assertFalse(get_pool(self.service._pool_key(), None) is pool)
+
+    def test_connection_discarded_when_write_fails(self):
+        class DroppedConnection(object):
+            closed = False
+
+            def sendall(self, data):
+                raise OpenSSL.SSL.SysCallError(-1, 'Unexpected EOF')
+
+            def shutdown(self):
+                pass
+
+            def close(self):
+                self.closed = True
+
+        connection = DroppedConnection()
+        pool = get_pool(self.service._pool_key(), lambda: FrameConnection(connection),
+                        self.service._pool_version(self.service.certificate, self.service.private_key))
+        self.assertRaises(OpenSSL.SSL.SysCallError, self.service.push_notification_to_devices,
+                          self.notification, [self.device])
+        self.assertEqual(pool._in_use, 0)
+        self.assertTrue(connection.closed)
+
+    def test_saving_service_closes_pooled_connections(self):
+        self.service.push_notification_to_devices(self.notification, [self.device])
+        pool = get_pool(self.service._pool_key(), None)
+        self.service.save()
+        self.assertTrue(pool.closed)
+        self.assertEqual(len(pool._idle), 0)
+
+
+    def test_ssl_context_cached_per_service(self):
+        context = get_context(self.service.pk, self.service.certificate, self.service.private_key)
+        self.assertTrue(context is get_context(self.service.pk, self.service.certificate, self.service.private_key))
+        feedback_service = FeedbackService(name='feedback', hostname='127.0.0.1', apn_service=self.service)
+        self.assertEqual(feedback_service._context_key(), self.service._context_key())
+
+    def test_ssl_context_rebuilt_when_certificate_changes(self):
+        context = get_context(self.service.pk, self.service.certificate, self.service.private_key)
+        cert, key = generate_cert_and_pkey()
+        self.assertFalse(context is get_context(self.service.pk, cert, key))
+
+    def test_saving_service_clears_ssl_context(self):
+        context = get_context(self.service.pk, self.service.certificate, self.service.private_key)
+        self.service.save()
+        self.assertFalse(context is get_context(self.service.pk, self.service.certificate, self.service.private_key))
+
+
+    def test_enhanced_payload_packed_correctly(self):
+        payload = self.notification.payload
+        msg = self.service.pack_enhanced_message(payload, self.device, 7, 1400000000, 10)
+        unpacked = struct.unpack(self.service.enhanced_fmt % len(payload), msg)
+        self.assertEqual(unpacked[0], 2)
+        self.assertEqual(unpacked[1], len(msg) - 5)
+        self.assertEqual(unpacked[7], payload)
+        self.assertEqual(unpacked[10], 7)
+        self.assertEqual(unpacked[13], 1400000000)
+        self.assertEqual(unpacked[16], 10)
+
+    def test_read_error_response(self):
+        class ErrorResponseConnection(object):
+            def pending(self):
+                return 6
+
+            def recv(self, size):
+                return struct.pack('!BBI', 8, 8, 3)
+
+        self.service.connection = ErrorResponseConnection()
+        self.assertEqual(self.service.read_error_response(), (8, 3))
+
+    def push_with_late_error_response(self, status):
+        """
+        Pushes to three devices in chunks of two over a connection which answers the first frame
+        with an error response only once the second chunk is about to be written.
+        Returns the PushResult and the frames written to the connection replacing it.
+        """
+        class LateErrorResponseConnection(object):
+            def __init__(self, response=''):
+                self.sock, self.peer = socket.socketpair()
+                self.response = response
+                self.checks = 0
+                self.written = ''
+
+            def sendall(self, data):
+                self.written += data.tobytes()
+
+            def pending(self):
+                self.checks += 1
+                return len(self.response) if self.checks > 1 else 0
+
+            def recv(self, size):
+                response, self.response = self.response, ''
+                return response
+
+            def fileno(self):
+                return self.sock.fileno()
+
+            def shutdown(self):
+                pass
+
+            def close(self):
+                self.sock.close()
+                self.peer.close()
+
+        connections = [LateErrorResponseConnection(struct.pack('!BBI', 8, status, 0)), LateErrorResponseConnection()]
+        replacement = connections[1]
+        get_pool(self.service._pool_key(), lambda: FrameConnection(connections.pop(0)),
+                 self.service._pool_version(self.service.certificate, self.service.private_key),
+                 check=self.service._check_connection)
+        for i in xrange(2):
+            Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+        result = self.service.push_notification_to_devices(self.notification, chunk_size=2)
+        return result, replacement.written
+
+    @override_settings(IOS_NOTIFICATIONS_ENHANCED_FORMAT=True)
+    def test_frames_after_late_error_response_sent_again(self):
+        result, written = self.push_with_late_error_response(8)
+        self.assertEqual(PushResult(sent=2, failed=1), result)
+        devices = list(self.service.device_set.order_by('pk'))
+        self.assertNotIn(devices[0].get_binary_token(), written)
+        self.assertIn(devices[1].get_binary_token(), written)
+        self.assertIn(devices[2].get_binary_token(), written)
+
+    @override_settings(IOS_NOTIFICATIONS_ENHANCED_FORMAT=True)
+    def test_frame_named_by_shutdown_not_failed(self):
+        result, written = self.push_with_late_error_response(10)
+        self.assertEqual(PushResult(sent=3), result)
+        devices = list(self.service.device_set.order_by('pk'))
+        self.assertNotIn(devices[0].get_binary_token(), written)
+        self.assertIn(devices[1].get_binary_token(), written)
+
+    @override_settings(IOS_NOTIFICATIONS_ENHANCED_FORMAT=True, IOS_NOTIFICATIONS_WRITE_BUFFER_SIZE=1)
+    def test_frames_after_failed_write_sent_again(self):
+        class BrokenPipeConnection(object):
+            """
+            Writes one frame and then fails, answering the first frame with an error response.
+            """
+            def __init__(self, response=''):
+                self.sock, self.peer = socket.socketpair()
+                self.response = response
+                self.written = []
+
+            def sendall(self, data):
+                if self.response and self.written:
+                    raise socket.error(errno.EPIPE, 'Broken pipe')
+                self.written.append(data.tobytes())
+
+            def pending(self):
+                return len(self.response)
+
+            def recv(self, size):
+                response, self.response = self.response, ''
+                return response
+
+            def fileno(self):
+                return self.sock.fileno()
+
+            def shutdown(self):
+                pass
+
+            def close(self):
+                self.sock.close()
+                self.peer.close()
+
+        connections = [BrokenPipeConnection(struct.pack('!BBI', 8, 8, 0)), BrokenPipeConnection()]
+        replacement = connections[1]
+        get_pool(self.service._pool_key(), lambda: FrameConnection(connections.pop(0)),
+                 self.service._pool_version(self.service.certificate, self.service.private_key),
+                 check=self.service._check_connection)
+        for i in xrange(4):
+            Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+        result = self.service.push_notification_to_devices(self.notification, chunk_size=5)
+        self.assertEqual(PushResult(sent=4, failed=1), result)
+        devices = list(self.service.device_set.order_by('pk'))
+        written = ''.join(replacement.written)
+        self.assertNotIn(devices[0].get_binary_token(), written)
+        for device in devices[1:]:
+            self.assertIn(device.get_binary_token(), written)
+
+    @override_settings(IOS_NOTIFICATIONS_ENHANCED_FORMAT=True)
+    def test_push_notification_with_enhanced_format(self):
+        started_at = dt_now()
+        self.notification.expires_at = started_at
+        self.service.push_notification_to_devices(self.notification, [self.device])
+        self.assertTrue(Device.objects.filter(pk=self.device.pk, last_notified_at__gte=started_at).exists())
+
+
+    def test_device_batches_walk_queryset_by_pk(self):
+        devices = [self.device]
+        for i in xrange(6):
+            devices.append(Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service))
+        Device.objects.filter(pk=devices[3].pk).update(is_active=False)
+        batches = list(self.service._device_batches(self.service.device_set.order_by('-pk'), 2))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 2])
+        expected = [(d.pk, unhexlify(d.token)) for d in devices if d.pk != devices[3].pk]
+        self.assertEqual([pair for batch in batches for pair in batch], expected)
+
+    def test_device_batches_from_list(self):
+        inactive = Device(token=TOKEN, service=self.service, is_active=False)
+        batches = list(self.service._device_batches([self.device, inactive, self.device], 2))
+        self.assertEqual(batches, [[(self.device.pk, unhexlify(TOKEN)), (self.device.pk, unhexlify(TOKEN))]])
+
+    def test_binary_token_stored_on_save(self):
+        device = Device.objects.get(pk=self.device.pk)
+        self.assertEqual(bytes(device.binary_token), unhexlify(TOKEN))
+        self.assertEqual(device.get_binary_token(), unhexlify(TOKEN))
+
+    def test_device_batches_decode_missing_binary_tokens(self):
+        Device.objects.filter(pk=self.device.pk).update(binary_token=None)
+        invalid = Device.objects.create(token='not-a-token', service=self.service)
+        self.assertIsNone(invalid.binary_token)
+        batches = list(self.service._device_batches(self.service.device_set.all(), 10))
+        self.assertEqual(batches, [[(self.device.pk, unhexlify(TOKEN))]])
+
+
+    def test_frame_builder_matches_pack_message(self):
+        payload = self.notification.payload
+        frames = self.service._frame_builder(self.notification, payload)
+        tokens = [uuid.uuid1().get_hex() * 2 for i in xrange(3)]
+        for token in tokens:
+            frames.add(unhexlify(token))
+        expected = ''.join(self.service.pack_message(payload, Device(token=token)) for token in tokens)
+        self.assertEqual(frames.view().tobytes(), expected)
+
+    @override_settings(IOS_NOTIFICATIONS_ENHANCED_FORMAT=True)
+    def test_enhanced_frame_builder_matches_pack_enhanced_message(self):
+        payload = self.notification.payload
+        frames = self.service._frame_builder(self.notification, payload)
+        frames.add(unhexlify(TOKEN), 5)
+        expected = self.service.pack_enhanced_message(payload, self.device, 5, self.notification.expiry,
+                                                      self.notification.priority)
+        self.assertEqual(frames.view().tobytes(), expected)
+
+    def test_payload_template(self):
+        notification = Notification(message=u'Hello', badge=1, service=self.service)
+        notification.extra = {'name': 'there', 'id': 7}
+        notification.set_loc_data('GREETING', ['there'])
+        template = PayloadTemplate(notification, ['badge', 'loc-args', 'name'])
+        self.assertEqual(json.loads(notification.payload), json.loads(template.render({})))
+        payload = json.loads(template.render({'badge': 5, 'loc-args': [u'J\xf6rg'], 'name': u'J\xf6rg'}))
+        expected = json.loads(notification.payload)
+        expected['aps']['badge'] = 5
+        expected['aps']['alert']['loc-args'] = [u'J\xf6rg']
+        expected['name'] = u'J\xf6rg'
+        self.assertEqual(expected, payload)
+        self.assertRaises(NotificationPayloadSizeExceeded, template.render, {'name': 'x' * 256})
+
+    def test_payload_template_leaves_out_slots_without_values(self):
+        notification = Notification(badge=None, service=self.service)
+        notification.extra = {'id': 7}
+        template = PayloadTemplate(notification, ['badge', 'name'])
+        self.assertEqual({'aps': {}, 'id': 7}, json.loads(template.render({})))
+        self.assertEqual({'aps': {'badge': 2}, 'id': 7}, json.loads(template.render({'badge': 2})))
+        self.assertEqual({'aps': {}, 'id': 7, 'name': 'x'}, json.loads(template.render({'badge': None, 'name': 'x'})))
+
+    def test_payload_template_requires_loc_data_for_loc_args(self):
+        self.assertRaises(ValueError, PayloadTemplate, self.notification, ['loc-args'])
+
+    def test_template_frame_builder_matches_pack_message(self):
+        template = PayloadTemplate(self.notification, ['badge'])
+        frames = self.service._template_frame_builder(self.notification, template, lambda pks: {pks[1]: {'badge': 2}})
+        chunk = [(1, unhexlify(TOKEN)), (2, unhexlify(TOKEN))]
+        self.assertEqual([], frames.prepare(chunk))
+        for i, (pk, token) in enumerate(chunk):
+            frames.add(token, i, pk)
+        self.assertEqual(self.notification.payload, template.render({}))
+        expected = (self.service.pack_message(template.render({}), self.device) +
+                    self.service.pack_message(template.render({'badge': 2}), self.device))
+        self.assertEqual(frames.view().tobytes(), expected)
+
+    def test_push_personalised_notification(self):
+        devices = [self.device] + [Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+                                   for i in xrange(2)]
+        values = {devices[0].pk: {'badge': 1}, devices[1].pk: {'badge': 2, 'name': 'x' * 256}}
+        result = self.service.push_notification_to_devices(self.notification, values=values)
+        self.assertEqual(PushResult(sent=2, failed=1), result)
+        self.assertFalse(Device.objects.get(pk=devices[1].pk).last_notified_at)
+        self.assertRaises(ValueError, self.service.push_notification_to_devices, self.notification,
+                          values=lambda pks: {})
+        self.assertRaises(ValueError, self.service.push_notification_to_devices, self.notification,
+                          values=values, workers=2)
+
+    @override_settings(IOS_NOTIFICATIONS_ENHANCED_FORMAT=True)
+    def test_push_personalised_notification_with_enhanced_format(self):
+        result = self.service.push_notification_to_devices(self.notification, values=lambda pks: {},
+                                                           slots=['badge'])
+        self.assertEqual(PushResult(sent=1), result)
+
+    @override_settings(IOS_NOTIFICATIONS_WRITE_BUFFER_SIZE=1)
+    def test_frame_builder_holds_at_least_one_frame(self):
+        frames = self.service._frame_builder(self.notification, self.notification.payload)
+        self.assertEqual(frames.capacity, 1)
+        self.assertTrue(frames.add(unhexlify(TOKEN)))
+
+
+    def test_rate_limiter(self):
+        self.assertIsNone(self.service.rate_limiter())
+        self.service.rate_limit_frames = 1000
+        limiter = self.service.rate_limiter()
+        self.assertEqual((1000, None), (limiter.frames_per_second, limiter.bytes_per_second))
+
+    def test_push_with_rate_limit(self):
+        get_cache('default').clear()
+        self.service.rate_limit_frames, self.service.rate_limit_bytes = 1000, 100000
+        for i in xrange(4):
+            Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+        result = self.service.push_notification_to_devices(self.notification, chunk_size=2)
+        self.assertEqual(PushResult(sent=5), result)
+
+    def test_push_returns_result(self):
+        result = self.service.push_notification_to_devices(self.notification, [self.device])
+        self.assertEqual(result, PushResult(sent=1))
+
+    def test_push_with_invalid_workers(self):
+        self.assertRaises(ValueError, self.service.push_notification_to_devices, self.notification, workers=0)
+
+    def test_shard_ranges(self):
+        self.assertEqual(shard_ranges(1, 10, 3), [(1, 5), (5, 9), (9, 11)])
+        self.assertEqual(shard_ranges(4, 5, 4), [(4, 5), (5, 6)])
+        self.assertEqual(shard_ranges(None, None, 4), [])
+
+    def test_push_shard(self):
+        other = Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+        frames = self.service._frame_builder(self.notification, self.notification.payload)
+        query = self.service.device_set.all().query
+        result = push_shard((self.service.pk, frames, query, self.device.pk, other.pk, 100, 'blocking'))
+        self.assertEqual(result, PushResult(sent=1))
+        self.assertIsNotNone(Device.objects.get(pk=self.device.pk).last_notified_at)
+        self.assertIsNone(Device.objects.get(pk=other.pk).last_notified_at)
+
+
+    @override_settings(IOS_NOTIFICATIONS_CONNECTION_POOL_SIZE=1)
+    def test_push_with_gevent_engine(self):
+        for i in xrange(5):
+            Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+        started_at = dt_now()
+        result = self.service.push_notification_to_devices(self.notification, chunk_size=2, engine='gevent')
+        self.assertEqual(result, PushResult(sent=6))
+        self.assertEqual(Device.objects.filter(last_notified_at__gte=started_at).count(), 6)
+
+    def test_gevent_engine_requires_gevent_openssl(self):
+        from . import models
+        frames = self.service._frame_builder(self.notification, self.notification.payload)
+        gevent_open_ssl, models.GEVENT_OPEN_SSL = models.GEVENT_OPEN_SSL, False
+        try:
+            self.assertRaises(ImproperlyConfigured, send_with_gevent, self.service, frames, [self.device], 1, 1)
+        finally:
+            models.GEVENT_OPEN_SSL = gevent_open_ssl
+
+    def test_checkpoint(self):
+        devices = [Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service) for i in xrange(4)]
+        checkpoints = []
+        result = self.service._write_message(self.notification, self.service.device_set.all(), 2,
+                                             checkpoint=lambda pk, result: checkpoints.append((pk, result.sent)))
+        self.assertEqual(result, PushResult(sent=5))
+        self.assertEqual(checkpoints, [(devices[0].pk, 2), (devices[2].pk, 4), (devices[3].pk, 5)])
+
+    def test_checkpoint_stops_sending(self):
+        for i in xrange(4):
+            Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+        result = self.service._write_message(self.notification, self.service.device_set.all(), 2,
+                                             checkpoint=lambda pk, result: False)
+        self.assertEqual(result, PushResult(sent=2))
+
+    @override_settings(IOS_NOTIFICATIONS_CONNECTION_POOL_SIZE=1)
+    def test_checkpoint_with_gevent_engine(self):
+        devices = [Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service) for i in xrange(4)]
+        checkpoints = []
+        self.service._write_message(self.notification, self.service.device_set.all(), 2, engine='gevent',
+                                    checkpoint=lambda pk, result: checkpoints.append(pk))
+        self.assertEqual(checkpoints, [devices[0].pk, devices[2].pk, devices[3].pk])
+
+    def test_gevent_engine_checkpoints_chunks_written_after_stopping(self):
+        import gevent
+
+        class SlowFirstChunkService(object):
+            """
+            Writes chunks of one device, the first of them slower than the others.
+            """
+            def _device_batches(self, devices, batch_size):
+                for pk in devices:
+                    yield [(pk, '')]
+
+            def _write_chunk(self, chunk, frames, result, record=None):
+                gevent.sleep(0.1 if chunk[0][0] == 1 else 0.05)
+                result.sent += 1
+                return []
+
+        frames = self.service._frame_builder(self.notification, self.notification.payload)
+        checkpoints = []
+
+        def checkpoint(pk, result):
+            checkpoints.append((pk, result.sent))
+            return False
+
+        result = send_with_gevent(SlowFirstChunkService(), frames, range(1, 9), 1, 3, checkpoint)
+        # The second and third chunks finish first but are only checkpointed after the first, which
+        # stops the push. The fourth and fifth were being written by then and are checkpointed too.
+        self.assertEqual([(1, 1), (2, 2), (3, 3), (4, 4), (5, 5)], checkpoints)
+        self.assertEqual(PushResult(sent=5), result)
+
+    @override_settings(IOS_NOTIFICATIONS_LAST_NOTIFIED_AT='deferred')
+    def test_push_with_deferred_last_notified_at(self):
+        Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+        self.assertEqual(self.service.push_notification_to_devices(self.notification, chunk_size=1), PushResult(sent=2))
+        self.assertEqual(Device.objects.filter(last_notified_at__isnull=True).count(), 0)
+
+    @override_settings(IOS_NOTIFICATIONS_LAST_NOTIFIED_AT='off')
+    def test_push_without_last_notified_at(self):
+        self.assertEqual(self.service.push_notification_to_devices(self.notification), PushResult(sent=1))
+        self.assertIsNone(Device.objects.get(pk=self.device.pk).last_notified_at)
+
+    def test_checkpoint_with_workers(self):
+        self.assertRaises(ValueError, self.service._write_message, self.notification, self.service.device_set.all(), 100,
+                          workers=2, checkpoint=lambda pk, result: None)
+
+    def test_push_with_invalid_engine(self):
+        self.assertRaises(ValueError, self.service.push_notification_to_devices, self.notification, engine='threads')
+
+
+@skipUnless(HYPER, 'The HTTP/2 transport requires hyper.')
+class HTTP2TransportTest(TestCase):
+    def setUp(self):
+        self.service = APNService.objects.create(name='test-service', hostname='127.0.0.1',
+                                                 transport=APNService.HTTP2, topic='com.example.app')
+        self.devices = [Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+                        for i in xrange(3)]
+        self.notification = Notification(message='Test message', service=self.service)
+
+    def tearDown(self):
+        self.service.close_connections()
+
+    def serve(self, unregistered=(), **kwargs):
+        server = HTTP2Server(unregistered, **kwargs)
+        server.start()
+        self.service.http2_secure = False
+        self.service.HTTP2_PORT = server.port
+        return server
+
+    def test_push(self):
+        server = self.serve([self.devices[1].token])
+        result = self.service.push_notification_to_devices(self.notification)
+        self.assertEqual(result, PushResult(sent=2, failed=1))
+        self.assertEqual(['/3/device/%s' % device.token for device in self.devices],
+                         [headers[':path'] for headers in server.requests])
+        self.assertEqual('com.example.app', server.requests[0]['apns-topic'])
+        self.assertEqual('10', server.requests[0]['apns-priority'])
+        self.assertFalse('authorization' in server.requests[0])
+        self.assertEqual(2, Device.objects.filter(last_notified_at__isnull=False).count())
+        self.assertFalse(Device.objects.get(pk=self.devices[1].pk).is_active)
+
+    @override_settings(IOS_NOTIFICATIONS_HTTP2_MAX_STREAMS=2)
+    def test_push_limits_streams_in_flight(self):
+        server = self.serve()
+        in_flight = [0, 0]  # Requests in flight now and at most.
+
+        class CountingConnection(object):
+            def __init__(self, connection):
+                self.connection = connection
+
+            def request(self, *args):
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+                return self.connection.request(*args)
+
+            def get_response(self, stream_id):
+                in_flight[0] -= 1
+                return self.connection.get_response(stream_id)
+
+            def close(self):
+                self.connection.close()
+
+        pool = get_http2_pool(self.service)
+        factory = pool.factory
+        pool.factory = lambda: CountingConnection(factory())
+        result = self.service.push_notification_to_devices(self.notification, chunk_size=100)
+        self.assertEqual(result, PushResult(sent=3))
+        self.assertEqual(3, len(server.requests))
+        self.assertEqual([0, 2], in_flight)
+
+    def test_push_sends_throttled_requests_again(self):
+        self.addCleanup(setattr, http2, 'THROTTLED_DELAY', http2.THROTTLED_DELAY)
+        http2.THROTTLED_DELAY = 0
+        server = self.serve(throttled=[self.devices[0].token])
+        result = self.service.push_notification_to_devices(self.notification)
+        self.assertEqual(result, PushResult(sent=3))
+        self.assertEqual(4, len(server.requests))
+
+    def test_push_sends_again_with_new_provider_token_after_expiry(self):
+        self.service.auth_key = generate_signing_key()
+        self.service.team_id, self.service.key_id = 'TEAM123456', 'KEY1234567'
+        expired = 'bearer %s' % get_provider_token(self.service.team_id, self.service.key_id, self.service.auth_key)
+        server = self.serve(expired=[expired])
+        result = self.service.push_notification_to_devices(self.notification)
+        self.assertEqual(result, PushResult(sent=3))
+        self.assertEqual(6, len(server.requests))
+        self.assertFalse(expired in set(headers['authorization'] for headers in server.requests[3:]))
+
+    def test_push_reconnects_after_connection_closed_while_idle(self):
+        server = self.serve(connections=2, requests_per_connection=3)
+        self.assertEqual(PushResult(sent=3), self.service.push_notification_to_devices(self.notification))
+        time.sleep(0.1)  # Let the server close the idle connection.
+        self.assertEqual(PushResult(sent=3), self.service.push_notification_to_devices(self.notification))
+        self.assertEqual(6, len(server.requests))
+
+    def test_push_with_token_authentication(self):
+        self.service.auth_key = generate_signing_key()
+        self.service.team_id, self.service.key_id = 'TEAM123456', 'KEY1234567'
+        server = self.serve()
+        self.service.push_notification_to_devices(self.notification)
+        token = get_provider_token(self.service.team_id, self.service.key_id, self.service.auth_key)
+        self.assertEqual(set(['bearer %s' % token]), set(headers['authorization'] for headers in server.requests))
+
+    def test_push_with_workers(self):
+        self.assertRaises(ValueError, self.service.push_notification_to_devices, self.notification, workers=2)
+
+    def test_provider_token_signature(self):
+        from cryptography.hazmat.backends import default_backend
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import ec
+        from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+        auth_key = generate_signing_key()
+        token = sign_provider_token('TEAM123456', 'KEY1234567', auth_key, 1356998400)
+        header, claims, signature = [part + '=' * (-len(part) % 4) for part in token.split('.')]
+        self.assertEqual({'alg': 'ES256', 'kid': 'KEY1234567'}, json.loads(base64.urlsafe_b64decode(header)))
+        self.assertEqual({'iss': 'TEAM123456', 'iat': 1356998400}, json.loads(base64.urlsafe_b64decode(claims)))
+        signature = base64.urlsafe_b64decode(signature)
+        self.assertEqual(64, len(signature))
+        key = serialization.load_pem_private_key(auth_key, None, default_backend())
+        key.public_key().verify(encode_dss_signature(int(signature[:32].encode('hex'), 16), int(signature[32:].encode('hex'), 16)),
+                                token.rsplit('.', 1)[0], ec.ECDSA(hashes.SHA256()))
+
+    def test_provider_token_cached(self):
+        auth_key = generate_signing_key()
+        token = get_provider_token('TEAM123456', 'KEY1234567', auth_key)
+        self.assertEqual(token, get_provider_token('TEAM123456', 'KEY1234567', auth_key))
+        with override_settings(IOS_NOTIFICATIONS_PROVIDER_TOKEN_LIFETIME=0):
+            self.assertNotEqual(token, get_provider_token('TEAM123456', 'KEY1234567', auth_key))
+
+
+def closed_port():
+    """
+    Returns a local port nothing is listening on.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class BreakerTest(TestCase):
+    def failing(self, failures, error=socket.error):
+        calls = []
+
+        def func():
+            calls.append(True)
+            if len(calls) <= failures:
+                raise error('failed')
+            return len(calls)
+        return func, calls
+
+    def test_retry_with_backoff(self):
+        func, calls = self.failing(2)
+        self.assertEqual(3, retry_with_backoff(func, 3, 0))
+        func, calls = self.failing(2)
+        self.assertRaises(socket.error, retry_with_backoff, func, 1, 0)
+        self.assertEqual(2, len(calls))
+
+    def test_retry_with_backoff_only_retries_transient_errors(self):
+        func, calls = self.failing(1, InvalidPassPhrase)
+        self.assertRaises(InvalidPassPhrase, retry_with_backoff, func, 3, 0)
+        self.assertEqual(1, len(calls))
+
+    def test_circuit_breaker_opens(self):
+        breaker = CircuitBreaker(2, 0.05)
+        func, calls = self.failing(10)
+        self.assertRaises(socket.error, breaker.call, func)
+        self.assertFalse(breaker.is_open)
+        self.assertRaises(socket.error, breaker.call, func)
+        self.assertTrue(breaker.is_open)
+        self.assertRaises(ServiceUnavailable, breaker.call, func)
+        self.assertEqual(2, len(calls))
+
+    def test_circuit_breaker_probes(self):
+        breaker = CircuitBreaker(1, 0.05)
+        func, calls = self.failing(2)
+        self.assertRaises(socket.error, breaker.call, func)
+        time.sleep(0.06)
+        self.assertRaises(socket.error, breaker.call, func)  # The probe fails and the breaker opens again.
+        self.assertRaises(ServiceUnavailable, breaker.call, func)
+        time.sleep(0.06)
+        breaker._before()  # A probe is let through...
+        self.assertRaises(ServiceUnavailable, breaker.call, func)  # ...while the other calls fail fast.
+        breaker._succeeded()
+        self.assertEqual(3, breaker.call(func))
+        self.assertFalse(breaker.is_open)
+
+    @override_settings(IOS_NOTIFICATIONS_CONNECT_RETRIES=0, IOS_NOTIFICATIONS_CIRCUIT_BREAKER_THRESHOLD=1)
+    def test_service_circuit_breaker(self):
+        cert, key = generate_cert_and_pkey()
+        service = APNService.objects.create(name='test-service', hostname='127.0.0.1', certificate=cert, private_key=key)
+        clear_breaker(service._pool_key())
+        self.addCleanup(clear_breaker, service._pool_key())
+        service.PORT = closed_port()
+        notification = Notification(message='Test message', service=service)
+        Device.objects.create(token=TOKEN, service=service)
+        self.assertRaises(socket.error, service.push_notification_to_devices, notification)
+        self.assertRaises(ServiceUnavailable, service.push_notification_to_devices, notification)
+        self.assertTrue(get_breaker(service._pool_key()).is_open)
+        service.save()  # New credentials clear the breaker.
+        self.assertFalse(get_breaker(service._pool_key()).is_open)
+
+
+class RateLimiterTest(TestCase):
+    def setUp(self):
+        get_cache('default').clear()
+        self.limiter = RateLimiter('test', frames_per_second=100, bytes_per_second=10000)
+
+    def test_window_limits(self):
+        # A window of 0.1 seconds allows 10 frames and 1000 bytes.
+        self.assertTrue(self.limiter._fits(1, 1.0, 6, 100))
+        self.assertTrue(self.limiter._fits(1, 1.0, 4, 100))
+        self.assertFalse(self.limiter._fits(1, 1.0, 1, 100))
+        self.assertTrue(self.limiter._fits(2, 1.0, 1, 100))
+
+    def test_bytes_limit_gives_back_frames(self):
+        self.assertTrue(self.limiter._fits(1, 1.0, 1, 900))
+        self.assertFalse(self.limiter._fits(1, 1.0, 1, 200))
+        self.assertTrue(self.limiter._fits(1, 1.0, 8, 100))
+
+    def test_large_write_carried_over_to_later_windows(self):
+        # 50 frames take the share of the window they are written in and of the four after it.
+        self.assertTrue(self.limiter._fits(1, 1.0, 50, 100))
+        for window in xrange(1, 6):
+            self.assertFalse(self.limiter._fits(window, 1.0, 1, 100))
+        self.assertTrue(self.limiter._fits(6, 1.0, 10, 100))
+        # 2500 bytes take two windows and half of the third.
+        self.assertTrue(self.limiter._fits(10, 1.0, 1, 2500))
+        self.assertFalse(self.limiter._fits(11, 1.0, 1, 100))
+        self.assertTrue(self.limiter._fits(12, 1.0, 1, 500))
+        self.assertFalse(self.limiter._fits(12, 1.0, 1, 1))
+
+    def test_large_write_not_carried_over_when_refused(self):
+        self.assertTrue(self.limiter._fits(1, 1.0, 1, 100))
+        self.assertFalse(self.limiter._fits(1, 1.0, 1, 5000))
+        self.assertFalse(self.limiter._fits(1, 1.0, 50, 100))
+        self.assertTrue(self.limiter._fits(2, 1.0, 10, 1000))
+
+    def test_factor_scales_limits(self):
+        self.assertTrue(self.limiter._fits(1, 0.5, 5, 100))
+        self.assertFalse(self.limiter._fits(1, 0.5, 1, 100))
+
+    def test_backoff_and_recover(self):
+        self.limiter.backoff()
+        self.assertEqual(0.5, self.limiter.factor)
+        self.assertEqual(0.5, RateLimiter('test').factor)  # Shared through the cache.
+        self.assertEqual(1.0, RateLimiter('other').factor)
+        for i in xrange(10):
+            self.limiter.backoff()
+        self.assertEqual(RateLimiter.min_factor, self.limiter.factor)
+        for i in xrange(100):
+            self.limiter.recover()
+        self.assertEqual(1.0, self.limiter.factor)
+
+    def test_acquire_waits_for_next_window(self):
+        self.limiter.acquire(10, 100)
+        window = int(time.time() / self.limiter.window)
+        self.limiter.acquire(10, 100)
+        self.assertTrue(int(time.time() / self.limiter.window) > window)
+
+
+class TrackingTest(TestCase):
+    def setUp(self):
+        self.service = APNService.objects.create(name='test-service', hostname='127.0.0.1')
+        self.other_service = APNService.objects.create(name='other-service', hostname='127.0.0.1')
+        self.devices = [Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=service)
+                        for service in (self.service, self.other_service, self.service, self.service)]
+
+    def notified(self):
+        return list(Device.objects.filter(last_notified_at__isnull=False).order_by('pk'))
+
+    def test_ids(self):
+        get_tracker(self.service.device_set.all(), 'ids').record([self.devices[0].pk, self.devices[3].pk])
+        self.assertEqual(self.notified(), [self.devices[0], self.devices[3]])
+
+    def test_range(self):
+        Device.objects.filter(pk=self.devices[2].pk).update(is_active=False)
+        get_tracker(self.service.device_set.all(), 'range').record([self.devices[0].pk, self.devices[3].pk])
+        self.assertEqual(self.notified(), [self.devices[0], self.devices[3]])
+
+    def test_range_of_pks_out_of_order(self):
+        # Devices Apple throttled are sent again after the others of their chunk.
+        get_tracker(self.service.device_set.all(), 'range').record([self.devices[3].pk, self.devices[0].pk])
+        self.assertEqual(self.notified(), [self.devices[0], self.devices[2], self.devices[3]])
+
+    def test_range_without_queryset(self):
+        get_tracker(self.devices, 'range').record([self.devices[0].pk, self.devices[2].pk])
+        self.assertEqual(self.notified(), [self.devices[0], self.devices[2]])
+
+    def test_deferred(self):
+        tracker = get_tracker(self.service.device_set.all(), 'deferred')
+        tracker.record([self.devices[0].pk])
+        tracker.record([self.devices[2].pk, self.devices[3].pk])
+        self.assertEqual(self.notified(), [])
+        tracker.flush()
+        self.assertEqual(self.notified(), [self.devices[0], self.devices[2], self.devices[3]])
+        last_notified_at = set(device.last_notified_at for device in self.notified())
+        self.assertEqual(len(last_notified_at), 1)
+
+    def test_off(self):
+        tracker = get_tracker(self.service.device_set.all(), 'off')
+        tracker.record([self.devices[0].pk])
+        tracker.flush()
+        self.assertEqual(self.notified(), [])
+
+    def test_invalid_mode(self):
+        self.assertRaises(ValueError, get_tracker, self.devices, 'sometimes')
+
+    def test_benchmark_command(self):
+        stdout = StringIO.StringIO()
+        management.call_command('benchmark_last_notified_at', devices=10, chunk_size=3, stdout=stdout)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 4)
+        self.assertEqual(len(self.notified()), 0)
+        self.assertEqual(Device.objects.count(), 4)
+
+
+@skipUnless(django.VERSION >= (1, 8) or settings.DATABASES['default']['ENGINE'] != 'django.db.backends.sqlite3',
+            'In-memory SQLite test databases are only shared with other threads from Django 1.8.')
+class PipelinedEngineTest(UseMockSSLServerMixin, TransactionTestCase):
+    def setUp(self):
+        cert, key = generate_cert_and_pkey()
+        self.service = APNService.objects.create(name='test-service', hostname='127.0.0.1',
+                                                 certificate=cert, private_key=key)
+        self.notification = Notification.objects.create(message='Test message', service=self.service)
+
+    def tearDown(self):
+        # The service is not rolled back, so its pooled connection would otherwise stay open.
+        self.service.close_connections()
+
+    def test_push_with_pipelined_engine(self):
+        for i in xrange(7):
+            Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+        started_at = dt_now()
+        result = self.service.push_notification_to_devices(self.notification, chunk_size=2, engine='pipelined')
+        self.assertEqual(result, PushResult(sent=7))
+        self.assertEqual(Device.objects.filter(last_notified_at__gte=started_at).count(), 7)
+
+    def test_checkpoint_with_pipelined_engine(self):
+        devices = [Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service) for i in xrange(3)]
+        checkpoints = []
+        self.service._write_message(self.notification, self.service.device_set.all(), 2, engine='pipelined',
+                                    checkpoint=lambda pk, result: checkpoints.append(pk))
+        self.assertEqual(checkpoints, [devices[1].pk, devices[2].pk])
+
+    def test_pipelined_engine_stops_when_recording_fails(self):
+        for i in xrange(7):
+            Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+        frames = self.service._frame_builder(self.notification, self.notification.payload)
+
+        def record(pks):
+            # Fails once the writer has filled the queue of written chunks.
+            time.sleep(0.5)
+            raise ValueError('Recording failed.')
+
+        self.assertRaises(ValueError, send_pipelined, self.service, frames, self.service.device_set.all(), 1,
+                          record=record)
+
+
 @override_settings(IOS_NOTIFICATIONS_AUTHENTICATION='AuthNone')
 class APITest(UseMockSSLServerMixin, TestCase):
     urls = 'ios_notifications.urls'
@@ -146,6 +1065,103 @@ class APITest(UseMockSSLServerMixin, TestCase):
         device_json = json.loads(content)
         self.assertEqual(device_json.get('model'), 'ios_notifications.device')
 
+    def test_register_existing_device_again(self):
+        Device.objects.filter(pk=self.device.pk).update(is_active=False, registered_at=feedback_time(0))
+        resp = self.client.post(reverse('ios-notifications-device-create'),
+                                {'token': self.device.token, 'service': self.service.id})
+        self.assertEqual(resp.status_code, 200)
+        device = Device.objects.get(pk=self.device.pk)
+        self.assertTrue(device.is_active)
+        self.assertTrue(device.registered_at > feedback_time(0))
+
+    def test_register_existing_device_queries(self):
+        # One update to reactivate the device, then the device and its users for the response.
+        with self.assertNumQueries(3):
+            resp = self.client.post(reverse('ios-notifications-device-create'),
+                                    {'token': self.device.token, 'service': self.service.id, 'platform': 'iPhone'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.device.pk, json.loads(resp.content)['pk'])
+
+    def test_register_device_with_metadata(self):
+        resp = self.client.post(reverse('ios-notifications-device-create'),
+                                {'token': self.device_token, 'service': self.service.id,
+                                 'platform': 'iPhone', 'os_version': 'iPhone OS 9.3'})
+        self.assertEqual(resp.status_code, 201)
+        device = Device.objects.get(pk=json.loads(resp.content)['pk'])
+        self.assertEqual(('iPhone', 'iPhone OS 9.3'), (device.platform, device.os_version))
+        self.assertEqual(unhexlify(self.device_token), bytes(device.binary_token))
+        self.assertTrue(device.is_active and device.registered_at is not None)
+
+    def test_register_device_invalid_metadata(self):
+        resp = self.client.post(reverse('ios-notifications-device-create'),
+                                {'token': self.device_token, 'service': self.service.id, 'display': 'x' * 31})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(['display'], json.loads(resp.content).keys())
+
+    def test_register_device_unknown_service(self):
+        resp = self.client.post(reverse('ios-notifications-device-create'),
+                                {'token': self.device_token, 'service': self.service.id + 1})
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue('service' in json.loads(resp.content))
+
+    def test_register_device_strips_token(self):
+        resp = self.client.post(reverse('ios-notifications-device-create'),
+                                {'token': '<%s %s>' % (self.device_token[:32], self.device_token[32:]),
+                                 'service': self.service.id})
+        self.assertEqual(resp.status_code, 201)
+        self.assertTrue(Device.objects.filter(token=self.device_token, service=self.service).exists())
+
+    def test_register_device_invalid_token(self):
+        resp = self.client.post(reverse('ios-notifications-device-create'),
+                                {'token': 'xyz', 'service': self.service.id})
+        self.assertEqual(resp.status_code, 400)
+        self.assertTrue('token' in json.loads(resp.content))
+
+    def bulk_register(self, data):
+        return self.client.post(reverse('ios-notifications-device-bulk'), json.dumps(data),
+                                content_type='application/json')
+
+    def test_bulk_register_devices(self):
+        Device.objects.filter(pk=self.device.pk).update(is_active=False, registered_at=feedback_time(0))
+        new_token = uuid.uuid1().get_hex() * 2
+        resp = self.bulk_register({'service': self.service.id, 'devices': [
+            {'token': '<%s %s>' % (self.device_token[:32], self.device_token[32:]), 'platform': 'iPhone'},
+            {'token': self.device.token, 'os_version': 'iPhone OS 9.3'},
+            new_token,
+            {'token': 'xyz', 'display': 'x' * 31},
+        ]})
+        self.assertEqual(resp.status_code, 200)
+        results = json.loads(resp.content)
+        device = Device.objects.get(token=self.device_token, service=self.service)
+        self.assertEqual({'token': self.device_token, 'status': 'created', 'pk': device.pk}, results[0])
+        self.assertEqual({'token': self.device.token, 'status': 'updated', 'pk': self.device.pk}, results[1])
+        self.assertEqual('created', results[2]['status'])
+        self.assertEqual('invalid', results[3]['status'])
+        self.assertEqual(set(['token', 'display']), set(results[3]['errors']))
+        self.assertEqual('iPhone', device.platform)
+        self.assertEqual(unhexlify(self.device_token), bytes(device.binary_token))
+        self.assertTrue(device.is_active and device.registered_at is not None)
+        existing = Device.objects.get(pk=self.device.pk)
+        self.assertTrue(existing.is_active)
+        self.assertTrue(existing.registered_at > feedback_time(0))
+        self.assertEqual('iPhone OS 9.3', existing.os_version)
+        self.assertEqual(3, Device.objects.filter(service=self.service).count())
+
+    def test_bulk_register_devices_invalid_request(self):
+        resp = self.bulk_register({'devices': [self.device_token]})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.bulk_register({'service': self.service.id + 1, 'devices': [self.device_token]})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_bulk_register_devices_in_batches(self):
+        tokens = [uuid.uuid1().get_hex() * 2 for i in xrange(5)]
+        registered = Device.objects.bulk_register(self.service, [{'token': token} for token in tokens[:3]])
+        self.assertTrue(all(created for pk, created in registered.values()))
+        registered = Device.objects.bulk_register(self.service, [{'token': token} for token in tokens], batch_size=2)
+        self.assertEqual([False] * 3 + [True] * 2, [registered[token][1] for token in tokens])
+        self.assertEqual(set(Device.objects.filter(token__in=tokens).values_list('pk', flat=True)),
+                         set(pk for pk, created in registered.values()))
+
     def test_disallowed_method(self):
         resp = self.client.delete(reverse('ios-notifications-device-create'))
         self.assertEqual(resp.status_code, 405)
@@ -172,6 +1188,103 @@ class APITest(UseMockSSLServerMixin, TestCase):
         self.assertEqual(device_json.get('model'), 'ios_notifications.device')
 
 
+@override_settings(IOS_NOTIFICATIONS_AUTHENTICATION='AuthNone')
+class UserPushTest(UseMockSSLServerMixin, TestCase):
+    urls = 'ios_notifications.urls'
+
+    def setUp(self):
+        cert, key = generate_cert_and_pkey()
+        self.service = APNService.objects.create(name='test-service', hostname='127.0.0.1',
+                                                 certificate=cert, private_key=key)
+        other_service = APNService.objects.create(name='other-service', hostname='127.0.0.1',
+                                                  certificate=cert, private_key=key)
+        self.users = [User.objects.create(username='user%d' % i) for i in xrange(3)]
+        self.devices = [Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=service)
+                        for service in [self.service] * 4 + [other_service]]
+        self.devices[0].users.add(self.users[0], self.users[1])
+        self.devices[1].users.add(self.users[1])
+        self.devices[2].users.add(self.users[2])
+        self.devices[3].users.add(self.users[0])
+        self.devices[4].users.add(self.users[0])
+        Device.objects.filter(pk=self.devices[3].pk).update(is_active=False)
+        self.notification = Notification(message='Test message', service=self.service)
+        self.user_ids = [self.users[0].pk, self.users[1].pk]
+
+    def test_user_devices(self):
+        self.assertEqual([(device.pk, device.get_binary_token()) for device in self.devices[:2]],
+                         self.service._user_devices(self.user_ids))
+        users = User.objects.filter(username__in=['user0', 'user1']).values('pk')
+        self.assertEqual(2, self.service._user_devices(users).count())
+
+    def test_user_devices_looked_up_in_batches(self):
+        user_ids = self.user_ids + range(10 ** 6, 10 ** 6 + 1200)
+        with self.assertNumQueries(3):
+            devices = self.service._user_devices(user_ids)
+        self.assertEqual([self.devices[0].pk, self.devices[1].pk], [pk for pk, token in devices])
+
+    def test_push_notification_to_users(self):
+        result = self.service.push_notification_to_users(self.notification, self.user_ids)
+        self.assertEqual(PushResult(sent=2), result)
+        self.assertEqual(set([self.devices[0].pk, self.devices[1].pk]),
+                         set(Device.objects.filter(last_notified_at__isnull=False).values_list('pk', flat=True)))
+
+    def push(self, data):
+        return self.client.post(reverse('ios-notifications-notification-users'), json.dumps(data),
+                                content_type='application/json')
+
+    def test_push_notification_to_users_api(self):
+        resp = self.push({'service': self.service.pk, 'users': self.user_ids, 'message': 'Test message', 'badge': 1})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual({'sent': 2, 'failed': 0}, json.loads(resp.content))
+
+    def test_push_notification_to_users_api_invalid_request(self):
+        self.assertEqual(400, self.push({'service': self.service.pk, 'users': self.user_ids}).status_code)
+        self.assertEqual(400, self.push({'service': self.service.pk, 'users': 'abc', 'message': 'Test'}).status_code)
+        self.assertEqual(400, self.push({'service': self.service.pk + 2, 'users': [], 'message': 'Test'}).status_code)
+
+    @override_settings(IOS_NOTIFICATIONS_QUEUE_PUSHES=True)
+    def test_push_notification_to_users_api_queued(self):
+        resp = self.push({'service': self.service.pk, 'users': self.user_ids, 'message': 'Test message'})
+        self.assertEqual(resp.status_code, 202)
+        job = PushJob.objects.get(pk=json.loads(resp.content)['job'])
+        self.assertEqual(set([self.devices[0], self.devices[1]]), set(job.devices.all()))
+        resp = self.push({'service': self.service.pk, 'users': [0], 'message': 'Test message'})
+        self.assertEqual({'sent': 0, 'failed': 0}, json.loads(resp.content))
+        self.assertEqual(1, PushJob.objects.count())
+
+
+class JSONResponseTest(TestCase):
+    def setUp(self):
+        self.service = APNService.objects.create(name='test-service', hostname='127.0.0.1')
+        self.user = User.objects.create(username='testuser', email='test@example.com')
+        self.devices = [Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service,
+                                              platform=u'iPh\xf6ne') for i in xrange(5)]
+        self.devices[1].users.add(self.user)
+
+    def django_serialize(self, devices):
+        serialized = json.loads(serializers.serialize('json', devices))
+        for device in serialized:
+            del device['fields']['binary_token']
+        return serialized
+
+    def test_serialize_device(self):
+        with self.assertNumQueries(1):
+            content = JSONResponse(self.devices[1]).content
+        self.assertEqual(self.django_serialize([self.devices[1]])[0], json.loads(content))
+
+    def test_serialize_devices(self):
+        devices = Device.objects.order_by('pk')
+        self.assertEqual(self.django_serialize(devices), json.loads(JSONResponse(devices).content))
+
+    def test_stream_devices(self):
+        devices = Device.objects.order_by('pk')
+        with self.assertNumQueries(4):
+            chunks = list(StreamingJSONResponse(devices, chunk_size=2).streaming_content)
+        self.assertEqual(5, len(chunks))  # The brackets and three chunks of devices.
+        self.assertEqual(self.django_serialize(devices), json.loads(''.join(chunks)))
+        self.assertEqual([], json.loads(''.join(StreamingJSONResponse(Device.objects.none()).streaming_content)))
+
+
 class AuthenticationDecoratorTestAuthBasic(UseMockSSLServerMixin, TestCase):
     urls = 'ios_notifications.urls'
 
@@ -186,6 +1299,58 @@ class AuthenticationDecoratorTestAuthBasic(UseMockSSLServerMixin, TestCase):
         self.user.is_staff = True
         self.user.save()
         self.device = Device.objects.create(service=self.service, token='0fd12510cfe6b0a4a89dc7369d96df956f991e66131dab63398734e8000d0029')
+        clear_verified()
+
+    def get_with_credentials(self, password=None):
+        kwargs = {'token': self.device.token, 'service__id': self.device.service.id}
+        user_pass = '%s:%s' % (self.user.username, password or self.user_password)
+        return self.client.get(reverse('ios-notifications-device', kwargs=kwargs),
+                               HTTP_AUTHORIZATION='Basic %s' % user_pass.encode('base64'))
+
+    def count_authentications(self):
+        """
+        Replaces the password check of the decorator with one counting its calls in self.authentications.
+        """
+        from ios_notifications import decorators
+        authenticate = decorators.authenticate
+        self.authentications = 0
+
+        def counting_authenticate(**credentials):
+            self.authentications += 1
+            return authenticate(**credentials)
+        decorators.authenticate = counting_authenticate
+        self.addCleanup(setattr, decorators, 'authenticate', authenticate)
+
+    @override_settings(IOS_NOTIFICATIONS_AUTHENTICATION='AuthBasic')
+    def test_basic_authorization_cached(self):
+        self.count_authentications()
+        self.assertEqual(200, self.get_with_credentials().status_code)
+        self.assertEqual(200, self.get_with_credentials().status_code)
+        self.assertEqual(1, self.authentications)
+        self.assertEqual(401, self.get_with_credentials('invalidpassword').status_code)
+        self.assertEqual(2, self.authentications)
+
+    @override_settings(IOS_NOTIFICATIONS_AUTHENTICATION='AuthBasic',
+                       IOS_NOTIFICATIONS_AUTHENTICATION_CACHE_TIMEOUT=0)
+    def test_basic_authorization_not_cached(self):
+        self.count_authentications()
+        self.get_with_credentials()
+        self.get_with_credentials()
+        self.assertEqual(2, self.authentications)
+
+    @override_settings(IOS_NOTIFICATIONS_AUTHENTICATION='AuthBasic')
+    def test_basic_authorization_cache_password_change(self):
+        self.assertEqual(200, self.get_with_credentials().status_code)
+        self.user.set_password('def456')
+        self.user.save()
+        self.assertEqual(401, self.get_with_credentials().status_code)
+        self.assertEqual(200, self.get_with_credentials('def456').status_code)
+
+    @override_settings(IOS_NOTIFICATIONS_AUTHENTICATION='AuthBasicIsStaff')
+    def test_basic_authorization_cache_is_staff_change(self):
+        self.assertEqual(200, self.get_with_credentials().status_code)
+        User.objects.filter(pk=self.user.pk).update(is_staff=False)
+        self.assertEqual(401, self.get_with_credentials().status_code)
 
     @override_settings(IOS_NOTIFICATIONS_AUTHENTICATION='AuthBasic')
     def test_basic_authorization_request(self):
@@ -285,6 +1450,47 @@ class NotificationTest(UseMockSSLServerMixin, TestCase):
         p = self.notification.payload
         self.assertEqual(json.loads(p)['aps']['alert'], loc_data)
 
+    def test_expiry(self):
+        self.assertEqual(self.notification.expiry, 0)
+        self.notification.expires_at = datetime.datetime(2014, 5, 13, 16, 53, 20, tzinfo=utc)
+        self.assertEqual(self.notification.expiry, 1400000000)
+
+    def test_priority(self):
+        self.assertEqual(self.notification.priority, 10)
+        notification = Notification(service=self.service, silent=True)
+        self.assertEqual(notification.priority, 5)
+
+    def test_payload_compiled_on_save(self):
+        notification = Notification.objects.get(pk=self.notification.pk)
+        self.assertEqual(bytes(notification.compiled_payload), self.notification.payload)
+
+        def compile_payload():
+            raise AssertionError('The stored payload should have been used')
+
+        notification.compile_payload = compile_payload
+        self.assertEqual(notification.payload, self.notification.payload)
+
+    def test_payload_recompiled_when_fields_change(self):
+        notification = Notification.objects.get(pk=self.notification.pk)
+        notification.badge = 3
+        self.assertEqual(json.loads(notification.payload)['aps']['badge'], 3)
+        notification.save()
+        self.assertEqual(json.loads(bytes(Notification.objects.get(pk=notification.pk).compiled_payload))['aps']['badge'], 3)
+
+    def test_payload_recompiled_when_fields_change_in_database(self):
+        Notification.objects.filter(pk=self.notification.pk).update(badge=7)
+        self.assertEqual(json.loads(Notification.objects.get(pk=self.notification.pk).payload)['aps']['badge'], 7)
+
+    def test_deferred_fields_loaded_once(self):
+        with self.assertNumQueries(1):
+            notifications = list(Notification.objects.defer('message', 'compiled_payload'))
+        self.assertEqual([self.notification.pk], [notification.pk for notification in notifications])
+        self.assertEqual(self.notification.payload, notifications[0].payload)
+
+    def test_save_invalid_length(self):
+        self.notification.message = '.' * 250
+        self.assertRaises(NotificationPayloadSizeExceeded, self.notification.save)
+
     def test_extra_property_not_dict(self):
         with self.assertRaises(TypeError):
             self.notification.extra = 111
@@ -363,6 +1569,11 @@ class ManagementCommandPushNotificationTest(UseMockSSLServerMixin, TestCase):
         self.assertTrue(Notification.objects.filter(message=msg, last_sent_at__gt=self.started_at).exists())
         self.assertTrue(self.device in Device.objects.filter(last_notified_at__gt=self.started_at))
 
+    def test_call_push_ios_notification_command_invalid_workers(self):
+        with self.assertRaises(management.base.CommandError):
+            management.call_command('push_ios_notification', message='some message', service=self.service.pk,
+                                    workers='many', verbosity=0)
+
     def test_either_message_or_extra_option_required(self):
         # In Django < 1.5 django.core.management.base.BaseCommand.execute
         # catches CommandError and raises SystemExit instead.
@@ -373,8 +1584,239 @@ class ManagementCommandPushNotificationTest(UseMockSSLServerMixin, TestCase):
                                     verbosity=0, stderr=StringIO.StringIO())
 
 
+class PushJobTest(UseMockSSLServerMixin, TestCase):
+    def setUp(self):
+        self.started_at = dt_now()
+        cert, key = generate_cert_and_pkey()
+        self.service = APNService.objects.create(name='service', hostname='127.0.0.1',
+                                                 private_key=key, certificate=cert)
+        self.service.PORT = 2195
+        self.device = Device.objects.create(token=TOKEN, service=self.service)
+        self.notification = Notification(message='Test message', service=self.service)
+
+    def test_enqueue_notification(self):
+        job = self.service.enqueue_notification(self.notification, [self.device])
+        self.assertIsNotNone(self.notification.pk)
+        self.assertEqual(PushJob.QUEUED, job.status)
+        self.assertEqual([self.device], list(job.devices.all()))
+        self.assertFalse(job.all_devices)
+        self.assertIsNone(Device.objects.get(pk=self.device.pk).last_notified_at)
+        self.assertTrue(self.service.enqueue_notification(self.notification).all_devices)
+
+    def test_run_without_devices_pushes_to_nobody(self):
+        for devices in ([], Device.objects.none()):
+            job = self.service.enqueue_notification(self.notification, devices)
+            job.run()
+            self.assertEqual((PushJob.DONE, 0), (job.status, job.sent))
+        job = self.service.enqueue_notification(self.notification, [self.device])
+        self.device.delete()
+        Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service)
+        job.run()
+        self.assertEqual((PushJob.DONE, 0), (job.status, job.sent))
+
+    @override_settings(IOS_NOTIFICATIONS_CONNECT_RETRIES=0, IOS_NOTIFICATIONS_CIRCUIT_BREAKER_THRESHOLD=1)
+    def test_run_with_service_unavailable(self):
+        clear_breaker(self.service._pool_key())
+        self.addCleanup(clear_breaker, self.service._pool_key())
+        self.service.PORT = closed_port()
+        job = self.service.enqueue_notification(self.notification)
+        job.run()
+        self.assertEqual(PushJob.FAILED, job.status)  # The connection was refused.
+        job = self.service.enqueue_notification(self.notification)
+        job.notification.service.PORT = self.service.PORT
+        job.run()
+        job = PushJob.objects.get(pk=job.pk)
+        self.assertEqual(PushJob.QUEUED, job.status)
+        self.assertTrue(job.retry_at > dt_now())
+        self.assertIsNone(PushJob.objects.claim())
+        PushJob.objects.filter(pk=job.pk).update(retry_at=dt_now())
+        self.assertEqual(job.pk, PushJob.objects.claim().pk)
+
+    def test_claim(self):
+        job = self.service.enqueue_notification(self.notification)
+        claimed = PushJob.objects.claim()
+        self.assertEqual(job.pk, claimed.pk)
+        self.assertEqual(PushJob.RUNNING, claimed.status)
+        self.assertIsNotNone(claimed.started_at)
+        self.assertIsNone(PushJob.objects.claim())
+
+    def test_run(self):
+        job = self.service.enqueue_notification(self.notification)
+        job.run()
+        job = PushJob.objects.get(pk=job.pk)
+        self.assertEqual(PushJob.DONE, job.status)
+        self.assertEqual(1, job.sent)
+        self.assertEqual(0, job.failed)
+        self.assertTrue(Device.objects.filter(pk=self.device.pk, last_notified_at__gte=self.started_at).exists())
+
+    def test_run_only_pushes_to_job_devices(self):
+        other_device = Device.objects.create(token='1' * 64, service=self.service)
+        job = self.service.enqueue_notification(self.notification, [other_device])
+        job.run()
+        self.assertEqual(1, PushJob.objects.get(pk=job.pk).sent)
+        self.assertIsNone(Device.objects.get(pk=self.device.pk).last_notified_at)
+
+    def test_run_checkpoints_progress(self):
+        other_device = Device.objects.create(token='1' * 64, service=self.service)
+        job = self.service.enqueue_notification(self.notification, chunk_size=1)
+        job.run()
+        job = PushJob.objects.get(pk=job.pk)
+        self.assertEqual(other_device.pk, job.last_device_pk)
+        self.assertIsNotNone(job.checkpointed_at)
+
+    def test_run_resumes_from_checkpoint(self):
+        other_device = Device.objects.create(token='1' * 64, service=self.service)
+        job = self.service.enqueue_notification(self.notification)
+        PushJob.objects.filter(pk=job.pk).update(last_device_pk=self.device.pk, sent=1)
+        PushJob.objects.get(pk=job.pk).run()
+        job = PushJob.objects.get(pk=job.pk)
+        self.assertEqual(PushJob.DONE, job.status)
+        self.assertEqual(2, job.sent)
+        self.assertIsNone(Device.objects.get(pk=self.device.pk).last_notified_at)
+        self.assertIsNotNone(Device.objects.get(pk=other_device.pk).last_notified_at)
+
+    def test_run_time_limit(self):
+        Device.objects.create(token='1' * 64, service=self.service)
+        job = self.service.enqueue_notification(self.notification, chunk_size=1)
+        job.run(time_limit=0)
+        job = PushJob.objects.get(pk=job.pk)
+        self.assertEqual(PushJob.QUEUED, job.status)
+        self.assertEqual(self.device.pk, job.last_device_pk)
+        self.assertEqual(1, job.sent)
+        self.assertIsNone(job.finished_at)
+
+    def test_claim_crashed_job(self):
+        job = self.service.enqueue_notification(self.notification)
+        PushJob.objects.filter(pk=job.pk).update(status=PushJob.RUNNING, checkpointed_at=dt_now())
+        self.assertIsNone(PushJob.objects.claim())
+        PushJob.objects.filter(pk=job.pk).update(checkpointed_at=dt_now() - datetime.timedelta(hours=1))
+        self.assertEqual(job.pk, PushJob.objects.claim().pk)
+
+    def test_run_push_worker_command(self):
+        jobs = [self.service.enqueue_notification(self.notification) for i in xrange(2)]
+        management.call_command('run_push_worker', once=True, verbosity=0)
+        self.assertEqual(2, PushJob.objects.filter(pk__in=[job.pk for job in jobs], status=PushJob.DONE).count())
+
+    def test_push_ios_notification_command_enqueue(self):
+        management.call_command('push_ios_notification', message='queued message', service=self.service.pk,
+                                enqueue=True, verbosity=0)
+        job = PushJob.objects.get(notification__message='queued message')
+        self.assertEqual(PushJob.QUEUED, job.status)
+        self.assertIsNone(Device.objects.get(pk=self.device.pk).last_notified_at)
+
+
+class FeedbackConnection(object):
+    """
+    Stands in for a connection to the feedback service, returning `data` at most `chunk` bytes at a time.
+    """
+    def __init__(self, data, chunk=1024):
+        self.data = data
+        self.chunk = chunk
+
+    def recv(self, size):
+        if not self.data:
+            raise OpenSSL.SSL.ZeroReturnError()
+        data, self.data = self.data[:min(size, self.chunk)], self.data[min(size, self.chunk):]
+        return data
+
+    def shutdown(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FeedbackServiceTest(TestCase):
+    def setUp(self):
+        self.service = APNService.objects.create(name='test-service', hostname='127.0.0.1')
+        self.feedback_service = FeedbackService.objects.create(name='feedback', hostname='127.0.0.1',
+                                                               apn_service=self.service)
+        self.tokens = [uuid.uuid1().get_hex() * 2 for i in xrange(3)]
+        self.data = ''.join(self.feedback_service.record.pack(1000 + i, 32, unhexlify(token))
+                            for i, token in enumerate(self.tokens))
+
+    def connect(self, data, chunk=1024):
+        def connect():
+            self.feedback_service.connection = FeedbackConnection(data, chunk)
+        self.feedback_service._connect = connect
+
+    def test_iter_unpack_ignores_partial_record(self):
+        records = list(iter_unpack(self.feedback_service.record, self.data[:-1]))
+        self.assertEqual([(1000 + i, 32, unhexlify(token)) for i, token in enumerate(self.tokens[:2])], records)
+
+    def test_read_records_across_reads(self):
+        records = list(read_records(FeedbackConnection(self.data, 7), self.feedback_service.record))
+        self.assertEqual([(1000 + i, 32, unhexlify(token)) for i, token in enumerate(self.tokens)], records)
+
+    def test_read_feedback(self):
+        self.connect(self.data, 50)
+        self.assertEqual([(1000 + i, token) for i, token in enumerate(self.tokens)],
+                         list(self.feedback_service.read_feedback()))
+
+    def test_call_deactivates_devices(self):
+        devices = [Device.objects.create(token=token, service=self.service, registered_at=feedback_time(0))
+                   for token in self.tokens]
+        other = Device.objects.create(token=uuid.uuid1().get_hex() * 2, service=self.service, registered_at=feedback_time(0))
+        self.connect(self.data)
+        self.assertEqual(3, self.feedback_service.call())
+        self.assertEqual(0, Device.objects.filter(pk__in=[d.pk for d in devices], is_active=True).count())
+        self.assertTrue(Device.objects.get(pk=other.pk).is_active)
+
+    def test_call_counts_only_devices_deactivated(self):
+        Device.objects.create(token=self.tokens[0], service=self.service, registered_at=feedback_time(0))
+        Device.objects.create(token=self.tokens[1], service=self.service, registered_at=feedback_time(0), is_active=False)
+        self.connect(self.data)
+        self.assertEqual(1, self.feedback_service.call())
+
+    def test_call_deactivates_in_batches(self):
+        for token in self.tokens:
+            Device.objects.create(token=token, service=self.service, registered_at=feedback_time(0))
+        self.feedback_service.deactivate_batch_size = 2
+        self.connect(self.data + self.data)
+        self.assertEqual(3, self.feedback_service.call())
+        self.assertEqual(0, Device.objects.filter(is_active=True).count())
+
+    def test_call_skips_devices_registered_after_feedback(self):
+        registered_before = Device.objects.create(token=self.tokens[0], service=self.service,
+                                                  registered_at=feedback_time(999))
+        registered_after = Device.objects.create(token=self.tokens[1], service=self.service,
+                                                 registered_at=feedback_time(1002))
+        self.connect(self.data)
+        self.assertEqual(1, self.feedback_service.call())
+        self.assertFalse(Device.objects.get(pk=registered_before.pk).is_active)
+        self.assertTrue(Device.objects.get(pk=registered_after.pk).is_active)
+
+    def test_feedback_time(self):
+        self.assertEqual(datetime.datetime(2013, 1, 1, tzinfo=utc), feedback_time(1356998400))
+
+
 class ManagementCommandCallFeedbackService(TestCase):
-    pass
+    def setUp(self):
+        cert, key = generate_cert_and_pkey()
+        self.service = APNService.objects.create(name='test-service', hostname='127.0.0.1',
+                                                 certificate=cert, private_key=key)
+
+    def test_service_or_all_required(self):
+        exception = SystemExit if django.VERSION < (1, 5) else management.base.CommandError
+        with self.assertRaises(exception):
+            management.call_command('call_feedback_service', verbosity=0, stderr=StringIO.StringIO())
+
+    def test_invalid_interval(self):
+        exception = SystemExit if django.VERSION < (1, 5) else management.base.CommandError
+        with self.assertRaises(exception):
+            management.call_command('call_feedback_service', all=True, interval='often', verbosity=0,
+                                    stderr=StringIO.StringIO())
+
+    def test_all_reports_each_service(self):
+        # Nothing listens on the feedback port, so every call fails without stopping the others.
+        for name in ('first', 'second'):
+            FeedbackService.objects.create(name=name, hostname='127.0.0.1', apn_service=self.service)
+        stdout, stderr = StringIO.StringIO(), StringIO.StringIO()
+        management.call_command('call_feedback_service', all=True, workers=2, verbosity=0, stdout=stdout, stderr=stderr)
+        lines = sorted(stderr.getvalue().splitlines())
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('first: failed after'))
+        self.assertTrue(lines[1].startswith('second: failed after'))
 
 
 class DefaultSettings(TestCase):
@@ -384,6 +1826,44 @@ class DefaultSettings(TestCase):
     def test_authentication_setting(self):
         self.assertEqual(None, get_setting('IOS_NOTIFICATIONS_AUTHENTICATION'))
 
+    def test_connection_pool_settings(self):
+        self.assertEqual(4, get_setting('IOS_NOTIFICATIONS_CONNECTION_POOL_SIZE'))
+        self.assertEqual(300, get_setting('IOS_NOTIFICATIONS_CONNECTION_IDLE_TIMEOUT'))
+
+    def test_enhanced_format_setting(self):
+        self.assertEqual(False, get_setting('IOS_NOTIFICATIONS_ENHANCED_FORMAT'))
+
+    def test_write_buffer_size_setting(self):
+        self.assertEqual(16384, get_setting('IOS_NOTIFICATIONS_WRITE_BUFFER_SIZE'))
+
+    def test_engine_setting(self):
+        self.assertEqual('blocking', get_setting('IOS_NOTIFICATIONS_ENGINE'))
+
+    def test_queue_pushes_setting(self):
+        self.assertEqual(False, get_setting('IOS_NOTIFICATIONS_QUEUE_PUSHES'))
+
+    def test_push_job_timeout_setting(self):
+        self.assertEqual(600, get_setting('IOS_NOTIFICATIONS_PUSH_JOB_TIMEOUT'))
+
+    def test_last_notified_at_setting(self):
+        self.assertEqual('ids', get_setting('IOS_NOTIFICATIONS_LAST_NOTIFIED_AT'))
+
+    def test_authentication_cache_timeout_setting(self):
+        self.assertEqual(60, get_setting('IOS_NOTIFICATIONS_AUTHENTICATION_CACHE_TIMEOUT'))
+
+    def test_connect_settings(self):
+        self.assertEqual(3, get_setting('IOS_NOTIFICATIONS_CONNECT_RETRIES'))
+        self.assertEqual(0.5, get_setting('IOS_NOTIFICATIONS_CONNECT_BACKOFF'))
+        self.assertEqual(3, get_setting('IOS_NOTIFICATIONS_CIRCUIT_BREAKER_THRESHOLD'))
+        self.assertEqual(30, get_setting('IOS_NOTIFICATIONS_CIRCUIT_BREAKER_TIMEOUT'))
+
+    def test_rate_limit_cache_setting(self):
+        self.assertEqual('default', get_setting('IOS_NOTIFICATIONS_RATE_LIMIT_CACHE'))
+
+    def test_http2_settings(self):
+        self.assertEqual(100, get_setting('IOS_NOTIFICATIONS_HTTP2_MAX_STREAMS'))
+        self.assertEqual(3000, get_setting('IOS_NOTIFICATIONS_PROVIDER_TOKEN_LIFETIME'))
+
     def test_auth_user_model(self):
         self.assertEqual('auth.User', get_setting('AUTH_USER_MODEL'))
 
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from django.db import models, transaction
+
+try:
+    from django.utils.timezone import now as dt_now
+except ImportError:
+    import datetime
+    dt_now = datetime.datetime.now
+
+from .settings import get_setting
+
+MODES = ('ids', 'range', 'deferred', 'off')
+
+
+class Tracker(object):
+    """
+    Updates last_notified_at for the devices a push was written to.
+
+    `record` is called with the pks of the devices written to, in the order of `devices`,
+    and `flush` once the push is over.
+    """
+    def __init__(self, devices):
+        if isinstance(devices, models.query.QuerySet) and devices.query.can_filter():
+            self.devices = devices
+        else:
+            self.devices = None
+
+    def record(self, pks):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def _update(self, pks, now):
+        from .models import Device
+        if pks:
+            Device.objects.filter(pk__in=pks).update(last_notified_at=now)
+
+    def _update_range(self, first_pk, last_pk, now):
+        """
+        Updates the active devices of `devices` between `first_pk` and `last_pk` with a single range scan.
+        Devices are written to in pk order, so these were sent to, except for devices left out of a write
+        in the range: devices with an invalid token, devices whose personalised payload is too long and,
+        with the enhanced format, the device Apple's error response names. They are updated too.
+        """
+        self.devices.filter(is_active=True, pk__gte=first_pk, pk__lte=last_pk).update(last_notified_at=now)
+
+
+class IdsTracker(Tracker):
+    """
+    Updates the devices of every write by pk as soon as it is written.
+    """
+    def record(self, pks):
+        self._update(pks, dt_now())
+
+
+class RangeTracker(Tracker):
+    """
+    Updates the devices of every write by their pk range as soon as it is written,
+    rather than listing each pk. Falls back to listing the pks if the devices are not a queryset.
+    See `Tracker._update_range` for the devices left out of a write which are updated anyway.
+    """
+    def record(self, pks):
+        if not pks:
+            return
+        if self.devices is None:
+            self._update(pks, dt_now())
+        else:
+            self._update_range(min(pks), max(pks), dt_now())
+
+
+class DeferredTracker(Tracker):
+    """
+    Keeps the pk ranges of the writes and updates them in a single transaction when the
+    push is over, or every `flush_every` writes, with one timestamp for all of them.
+    Like RangeTracker it updates devices left out of a write in its range.
+    """
+    def __init__(self, devices, flush_every=100):
+        super(DeferredTracker, self).__init__(devices)
+        self.flush_every = flush_every
+        self.written = []
+
+    def record(self, pks):
+        if pks:
+            self.written.append(pks if self.devices is None else (min(pks), max(pks)))
+            if len(self.written) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        written, self.written = self.written, []
+        if not written:
+            return
+        now = dt_now()
+        with transaction.atomic():
+            for pks in written:
+                if self.devices is None:
+                    self._update(pks, now)
+                else:
+                    self._update_range(pks[0], pks[1], now)
+
+
+class NullTracker(Tracker):
+    """
+    Leaves last_notified_at alone.
+    """
+    def record(self, pks):
+        pass
+
+
+TRACKERS = {
+    'ids': IdsTracker,
+    'range': RangeTracker,
+    'deferred': DeferredTracker,
+    'off': NullTracker,
+}
+
+
+def get_tracker(devices, mode=None):
+    """
+    Returns a tracker for a push to `devices`.
+    `mode` defaults to the IOS_NOTIFICATIONS_LAST_NOTIFIED_AT setting.
+    """
+    if mode is None:
+        mode = get_setting('IOS_NOTIFICATIONS_LAST_NOTIFIED_AT')
+    if mode not in TRACKERS:
+        raise ValueError('IOS_NOTIFICATIONS_LAST_NOTIFIED_AT must be one of %s.' % ', '.join(MODES))
+    return TRACKERS[mode](devices)
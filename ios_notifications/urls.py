@@ -5,5 +5,7 @@ from .api import routes
 
 urlpatterns = [
     url(r'^device/$', routes.device, name='ios-notifications-device-create'),
+    url(r'^devices/$', routes.devices, name='ios-notifications-device-bulk'),
+    url(r'^notification/users/$', routes.user_notification, name='ios-notifications-notification-users'),
     url(r'^device/(?P<token>\w+)/(?P<service__id>\d+)/$', routes.device, name='ios-notifications-device'),
 ]
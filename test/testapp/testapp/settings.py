@@ -18,6 +18,11 @@ DATABASES = {
         'PASSWORD': '',
         'HOST': '',                      # Empty for localhost through domain sockets or '127.0.0.1' for localhost through TCP.
         'PORT': '',                      # Set to empty string for default.
+        # Test against a file rather than an in-memory database so that
+        # the database can also be reached from other threads.
+        'TEST': {
+            'NAME': 'test_ios_notifications.db',
+        },
     }
 }
 